@@ -0,0 +1,13 @@
+"""
+Benchmarks for the simulator itself.
+
+These are modules like the ones in tests, so run them the same way, e.g.:
+python simulator.py --no-interactive --virtual-time --remote-interface=none \
+                    --no-console-log bench.cable --packets=100000
+
+Each reports how long it took (in wall clock time) on stderr.
+
+bench_suite.py runs a set of scenarios using these (and some of the
+topologies) and keeps track of how fast they are over time.
+
+"""
@@ -0,0 +1,57 @@
+"""
+Builds a big random topology, either all at once with
+core.build_topology() or (with --no-bulk) the usual way with create() and
+linkTo().
+
+The switches form a ring (so it's connected) plus extra random links, for
+links links in all.  The time reported is from the start of building
+until all the handle_link_up() calls have been made.
+
+"""
+
+import random
+import sys
+import time
+
+import sim
+import sim.api as api
+import sim.core as core
+
+
+def launch(switches=100000, links=None, bulk=True, seed=0,
+           switch_type=None):
+    n = int(switches)
+    links = int(links) if links is not None else 2 * n
+    if switch_type is None:
+        switch_type = api.Entity  # So the routing code isn't being timed
+    else:
+        switch_type = sim._find_switch_type(switch_type)
+
+    rand = random.Random(int(seed))
+    edges = [(i, (i + 1) % n) for i in range(n)]
+    while len(edges) < links:
+        a = rand.randrange(n)
+        b = rand.randrange(n)
+        if a != b:
+            edges.append((a, b))
+
+    t0 = time.time()
+    if bulk:
+        core.build_topology([("s%i" % i, switch_type) for i in range(n)],
+                            edges)
+    else:
+        s = [switch_type.create("s%i" % i) for i in range(n)]
+        for a, b in edges:
+            s[a].linkTo(s[b])
+    built = time.time() - t0
+
+    def done():
+        el = time.time() - t0
+        sys.__stderr__.write(
+            "%s %i switches, %i links: built in %.3fs, "
+            "links up in %.3fs\n" % ("Bulk built" if bulk else "Built", n,
+                                     len(edges), built, el))
+        core.world.stop()
+
+    # Link ups happen as soon as the world starts
+    core.world.doLater(0.001, done)
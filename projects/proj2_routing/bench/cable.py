@@ -0,0 +1,54 @@
+"""
+Pushes lots of packets through a single link.
+
+All of them are sent at once, so they pile up in the cable's queue, which
+is the worst case for a cable.  Pass --cable=dumb to compare against a
+DumbCable, which doesn't queue anything.
+
+"""
+
+import sys
+import time
+
+import sim.api as api
+import sim.basics as basics
+import sim.core as core
+from sim.cable import BasicCable, DumbCable
+
+
+class CountingHost(basics.BasicHost):
+    ENABLE_DISCOVERY = False
+    received = 0
+
+    def handle_rx(self, packet, port):
+        self.received += 1
+
+
+def launch(packets=100000, cable="basic"):
+    packets = int(packets)
+    cable_type = {"basic": BasicCable, "dumb": DumbCable}[cable]
+
+    h1 = CountingHost.create("h1")
+    h2 = CountingHost.create("h2")
+    h1.linkTo(h2, cable=(cable_type(), cable_type()))
+
+    def start():
+        t0 = time.time()
+        for _ in range(packets):
+            h1.send(api.Packet(dst=h2), 0)
+        sent = time.time() - t0
+
+        def check():
+            if h2.received < packets:
+                return  # Check again later
+            el = time.time() - t0
+            sys.__stderr__.write(
+                "%i packets through a %s cable: sent in %.3fs, "
+                "delivered in %.3fs (%.0f packets/s)\n"
+                % (packets, cable, sent, el, packets / el))
+            core.world.stop()
+            return False
+
+        api.create_timer(1, check)
+
+    api.create_timer(1, start, recurring=False)
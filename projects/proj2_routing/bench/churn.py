@@ -0,0 +1,46 @@
+"""
+Link churn.
+
+Builds a Barabasi-Albert topology (see topos.generators) of the default
+switch type, then, rate times per (simulated) second, takes a random link
+down and brings it back up down_time seconds later.
+
+"""
+
+import sim
+import sim.core as core
+import topos.generators as generators
+
+
+def launch(switches=100, hosts=20, rate=20, down_time=2, seed=0,
+           switch_type=None):
+    if switch_type is None:
+        switch_type = sim.config.default_switch_type
+    else:
+        switch_type = sim._find_switch_type(switch_type)
+    rate = float(rate)
+    down_time = float(down_time)
+    rand = generators.make_random(seed)
+
+    topo = generators.barabasi_albert(int(switches), 2, int(hosts), True,
+                                      rand)
+    entities = topo.build(switch_type)
+    links = [(entities[a], entities[b]) for a, b in topo.links
+             if not (topo.is_host[a] or topo.is_host[b])]
+    up = set(range(len(links)))
+
+    def bring_up(i):
+        a, b = links[i]
+        a.linkTo(b)
+        up.add(i)
+
+    def churn():
+        if up:
+            i = rand.choice(sorted(up))
+            a, b = links[i]
+            a.unlinkTo(b)
+            up.discard(i)
+            core.world.doLater(down_time, bring_up, i)
+        core.world.doLater(1 / rate, churn)
+
+    core.world.doLater(1, churn)
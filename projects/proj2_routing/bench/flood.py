@@ -0,0 +1,30 @@
+"""
+A flood storm on a star (see topos.star).
+
+The switch in the middle is a hub (see examples.hub), so every packet any
+host sends goes to all the others.  Each of the hosts sends packets
+packets, at random times during the first second, to random other hosts.
+
+"""
+
+import sim.api as api
+import sim.core as core
+import topos.generators as generators
+import topos.star as star
+from bench.cable import CountingHost
+from examples.hub import Hub
+
+
+def launch(hosts=40, packets=25, seed=0):
+    n = int(hosts)
+    packets = int(packets)
+    rand = generators.make_random(seed)
+
+    star.launch(switch_type=Hub, host_type=CountingHost, n=n)
+    h = [core._getEntByName("h%i" % (i, )) for i in range(1, n + 1)]
+
+    for i, src in enumerate(h):
+        for _ in range(packets):
+            dst = h[(i + 1 + rand.randrange(n - 1)) % n]
+            core.world.doLater(rand.random(), src.send, api.Packet(dst=dst),
+                               None, True)
@@ -0,0 +1,70 @@
+"""
+Times topos.loader on a big generated topology file.
+
+Writes a file of about lines lines (a fifth of them switches, the rest links
+between random ones) to a temporary directory, then loads it twice: cold
+(parsing it and writing the snapshot) and warm (from the snapshot).  With
+--build, it also builds the topology.
+
+"""
+
+import gzip as gzip_module
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import sim.api as api
+import sim.core as core
+import topos.loader as loader
+
+
+def _write(filename, lines, gzip, seed):
+    rand = random.Random(int(seed))
+    n = max(2, lines // 5)
+    opener = gzip_module.open if gzip else open
+    with opener(filename, 'wb') as f:
+        f.write("".join("s s%i\n" % i for i in range(n)).encode())
+        chunk = []
+        for i in range(lines - n):
+            a = rand.randrange(n)
+            b = (a + 1 + rand.randrange(n - 1)) % n
+            chunk.append("l s%i s%i %.3f\n" % (a, b, rand.random()))
+            if len(chunk) >= 10000:
+                f.write("".join(chunk).encode())
+                chunk = []
+        f.write("".join(chunk).encode())
+
+
+def launch(lines=1000000, gzip=False, build=False, seed=0):
+    lines = int(lines)
+    d = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(d, "big.topo" + (".gz" if gzip else ""))
+        _write(filename, lines, gzip, seed)
+        size = os.path.getsize(filename)
+
+        t0 = time.time()
+        loader.load(filename)
+        cold = time.time() - t0
+
+        t0 = time.time()
+        t = loader.load(filename)
+        warm = time.time() - t0
+
+        sys.__stderr__.write(
+            "%i lines (%.1f MB%s, %i nodes, %i links): cold load %.3fs, "
+            "warm load %.3fs\n" % (lines, size / 1e6,
+                                   " gzipped" if gzip else "", len(t),
+                                   t.link_count, cold, warm))
+
+        if build:
+            t0 = time.time()
+            t.build(api.Entity)  # So the routing code isn't being timed
+            sys.__stderr__.write("Built in %.3fs\n" % (time.time() - t0, ))
+    finally:
+        shutil.rmtree(d)
+
+    core.world.doLater(0.001, core.world.stop)
@@ -0,0 +1,26 @@
+"""
+All-to-all megaping bursts (see examples.megaping).
+
+The hosts hang off a random tree of hubs (see examples.hub), so pings get
+everywhere without any routing.  Every second, for bursts seconds, every
+host megapings every other one.
+
+"""
+
+import sim.core as core
+import topos.generators as generators
+from examples.hub import Hub
+from examples.megaping import MegaHost, all_hosts, do_send_megaping
+
+
+def launch(switches=10, hosts=20, bursts=3, seed=0):
+    rand = generators.make_random(seed)
+    topo = generators.random_tree(int(switches), 0, int(hosts), True, rand)
+    topo.build(Hub, MegaHost)
+
+    def burst():
+        for dst in sorted(all_hosts, key=lambda h: h.name):
+            do_send_megaping(dst)
+
+    for i in range(int(bursts)):
+        core.world.doLater(1 + i, burst)
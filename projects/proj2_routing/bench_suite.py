@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Benchmarks the simulator's performance.
+
+Runs each of the scenarios in BENCHMARKS below (most of them modules in
+bench/) and reports how fast the simulator got through it: events and
+packets per second of wall clock time, wall clock time per simulated
+second, and peak memory use (RSS).  Each scenario is run --repeat times,
+each time in a new process, and the fastest run counts.  Runs are
+deterministic for a given --seed, so the same scenario should always
+process the same number of events and packets.
+
+Use --save to write the results to a JSON file, and --compare to compare
+them against such a file from an earlier run (a baseline).  Anything which
+got worse by more than --threshold (10% by default) is a regression, and
+makes the exit status 1.  For example:
+
+  python bench_suite.py --save=baseline.json
+  ... change things ...
+  python bench_suite.py --compare=baseline.json
+
+Scenarios which route use the switch type given by --router (dv_router by
+default), so that's what the DV convergence and link churn numbers are for.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Name -> (simulated seconds to run for or None to run until it ends, and
+# the simulator commandline).  {seed} and {router} get filled in.
+BENCHMARKS = collections.OrderedDict([
+    ('flood_star', (None, [
+        'bench.flood', '--hosts=60', '--packets=40', '--seed={seed}'])),
+    ('converge_rand_20', (60, [
+        '--default-switch-type={router}',
+        'topos.rand', '--switches=20', '--hosts=10', '--links=40',
+        '--seed={seed}'])),
+    ('converge_rand_100', (60, [
+        '--default-switch-type={router}',
+        'topos.rand', '--switches=100', '--hosts=30', '--links=200',
+        '--seed={seed}'])),
+    ('converge_rand_300', (60, [
+        '--default-switch-type={router}',
+        'topos.rand', '--switches=300', '--hosts=60', '--links=600',
+        '--seed={seed}'])),
+    ('megaping', (None, [
+        'bench.megaping', '--switches=10', '--hosts=20', '--bursts=3',
+        '--seed={seed}'])),
+    ('link_churn', (60, [
+        '--default-switch-type={router}',
+        'bench.churn', '--switches=100', '--hosts=20', '--rate=20',
+        '--seed={seed}'])),
+    ('deep_queue', (None, [
+        'bench.cable', '--packets=100000'])),
+])
+
+_common_args = ['--no-interactive', '--virtual-time',
+                '--remote-interface=none', '--no-console-log']
+
+# Metric -> (whether bigger is better, whether it's a timing)
+METRICS = collections.OrderedDict([
+    ('events_per_sec', (True, True)),
+    ('packets_per_sec', (True, True)),
+    ('wall_per_virtual_sec', (False, True)),
+    ('peak_rss_mb', (False, False)),
+])
+
+# Runs quicker than this (in seconds) are too noisy to compare timings of
+MIN_WALL_TIME = 0.2
+
+
+def _sim_args(name, seed, router):
+    duration, args = BENCHMARKS[name]
+    return [a.format(seed=seed, router=router) for a in args]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / (1024.0 * 1024)  # Bytes
+    return rss / 1024.0  # Kilobytes
+
+
+def _run_here(name, seed, router):
+    """Runs a benchmark in this process (a new one).  Returns results."""
+    random.seed(seed)
+    import sim
+    sim.config.console_log = False  # (Must be before sim.core import)
+    import sim.boot as boot
+    import sim.cable as cable
+    import sim.core as core
+
+    # Cables which get disconnected (e.g., by link churn) take their
+    # counters with them, so add them up as they go
+    gone = [0]
+    handle_disconnect = cable.BasicCable._handle_disconnect
+
+    def _handle_disconnect(self):
+        gone[0] += self.packets_sent
+        handle_disconnect(self)
+
+    cable.BasicCable._handle_disconnect = _handle_disconnect
+
+    start = time.time()
+    general_args, modules = boot.parse_commandline(
+        _common_args + _sim_args(name, seed, router))
+    if boot.setup(general_args, modules) is None:
+        raise RuntimeError("Could not set up")
+    world = core.current_world()
+    duration = BENCHMARKS[name][0]
+    if duration is not None:
+        world.doAt(duration, world.stop)
+    setup_time = time.time() - start
+
+    start = time.time()
+    world.start(threaded=False)
+    wall_time = time.time() - start
+
+    packets = gone[0]
+    for te in world.registry.values():
+        for c in te.ports:
+            if c is not None:
+                packets += getattr(c, 'packets_sent', 0)
+
+    virtual_time = world.time
+    return {
+        'setup_time': setup_time,
+        'wall_time': wall_time,
+        'virtual_time': virtual_time,
+        'events': world.event_count,
+        'packets': packets,
+        'errors': world.error_count,
+        'events_per_sec': world.event_count / wall_time if wall_time else 0,
+        'packets_per_sec': packets / wall_time if wall_time else 0,
+        'wall_per_virtual_sec': (wall_time / virtual_time
+                                 if virtual_time else None),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _run_child(name, seed, router, verbose):
+    """Runs a benchmark in a new process.  Returns results or None."""
+    fd, result_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--child=' + name, '--result=' + result_file,
+               '--seed=%s' % (seed, ), '--router=' + router]
+        with open(os.devnull, 'w') as devnull:
+            out = None if verbose else devnull
+            status = subprocess.call(cmd, stdout=out, stderr=out,
+                                     cwd=os.path.dirname(
+                                         os.path.abspath(__file__)))
+        if status != 0:
+            return None
+        with open(result_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def run(names, seed=0, router='dv_router', repeat=3, verbose=False):
+    """Runs benchmarks, returning a results document (see --save)."""
+    results = collections.OrderedDict()
+    for name in names:
+        best = None
+        for _ in range(max(1, repeat)):
+            r = _run_child(name, seed, router, verbose)
+            if r is None:
+                best = None
+                break
+            if best is None or r['wall_time'] < best['wall_time']:
+                best = r
+        if best is None:
+            print("%s: failed" % (name, ))
+            results[name] = None
+            continue
+        best['args'] = _sim_args(name, seed, router)
+        results[name] = best
+        print(_describe(name, best))
+        sys.stdout.flush()
+    return collections.OrderedDict([
+        ('version', 1),
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.platform()),
+        ('seed', seed),
+        ('router', router),
+        ('repeat', repeat),
+        ('benchmarks', results),
+    ])
+
+
+def _describe(name, r):
+    wpv = r['wall_per_virtual_sec']
+    return ("%s: %.2fs (%.1fs virtual, %s per virtual second), "
+            "%i events (%.0f/s), %i packets (%.0f/s), %s peak RSS" %
+            (name, r['wall_time'], r['virtual_time'],
+             "-" if wpv is None else "%.4fs" % (wpv, ),
+             r['events'], r['events_per_sec'],
+             r['packets'], r['packets_per_sec'],
+             "-" if r['peak_rss_mb'] is None
+             else "%.1fMB" % (r['peak_rss_mb'], )))
+
+
+def compare(doc, baseline, threshold=0.1):
+    """
+    Compares results against a baseline, printing what changed.
+
+    Returns the number of regressions.
+
+    """
+    regressions = 0
+    for key in ('python', 'seed', 'router'):
+        if doc[key] != baseline.get(key):
+            print("Note: baseline has %s %s, not %s" %
+                  (key, baseline.get(key), doc[key]))
+    for name, r in doc['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if r is None or base is None:
+            continue
+        print("%s:" % (name, ))
+        if (r['events'], r['packets']) != (base['events'], base['packets']):
+            print("  Note: %i events and %i packets vs %i and %i in the "
+                  "baseline, so it's not the same run" %
+                  (r['events'], r['packets'], base['events'],
+                   base['packets']))
+        too_quick = min(r['wall_time'], base['wall_time']) < MIN_WALL_TIME
+        if too_quick:
+            print("  Note: too quick to compare timings")
+        for metric, (bigger_is_better, timing) in METRICS.items():
+            new = r.get(metric)
+            old = base.get(metric)
+            if not new or not old or (timing and too_quick):
+                continue
+            change = (new - old) / float(old)
+            worse = -change if bigger_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("  %-22s %14.4f vs %14.4f  %+6.1f%%%s" %
+                  (metric, new, old, change * 100, flag))
+    print("%i regression%s" % (regressions, "" if regressions == 1 else "s"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the simulator.")
+    parser.add_argument('names', nargs='*', metavar='benchmark',
+                        help="benchmarks to run (default all): %s" %
+                        (", ".join(BENCHMARKS), ))
+    parser.add_argument('--save', metavar='FILE',
+                        help="write results as JSON to FILE")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare results to a baseline saved earlier")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="fraction worse which counts as a regression")
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help="number of times to run each (best counts)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--router', default='dv_router',
+                        help="switch type for scenarios which route")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="show the simulator's output")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        r = _run_here(options.child, options.seed, options.router)
+        with open(options.result, 'w') as f:
+            json.dump(r, f)
+        return
+
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error("no such benchmark as '%s'" % (name, ))
+    names = options.names or list(BENCHMARKS)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    doc = run(names, options.seed, options.router, options.repeat,
+              options.verbose)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(doc, f, indent=2)
+
+    status = 0
+    if None in doc['benchmarks'].values():
+        status = 1
+    if baseline is not None:
+        print()
+        if compare(doc, baseline, options.threshold):
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
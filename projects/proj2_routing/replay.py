@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Plays a recorded simulation back to NetVis.
+
+Record a simulation with --record, e.g.:
+
+  python simulator.py --record=run.rec --virtual-time topos.rand
+
+and then run this on the recording, and connect NetVis to it just as if it
+were the simulator.  It shows NetVis the simulation as it was at --start
+(in simulated seconds), and then plays it from there, at --speed times
+real time (or as fast as it can, with --speed=0), until --end.
+
+With --node (as many times as you like), only things involving the
+Entities whose names match (as shell-style patterns, like "s1*") are
+shown: their links (and whatever's on the other end), packets to and from
+them, and their log messages.
+
+--print writes what NetVis would get to stdout (as JSON lines) instead of
+waiting for it to connect, and --info just says what's in the recording.
+
+Remote interface commands which would change the simulation (pinging,
+adding links, etc.) are ignored, since what's recorded is recorded.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import errno
+import fnmatch
+import json
+import logging
+import re
+import socket
+import sys
+import threading
+import time
+
+import sim.recorder as recorder
+import sim.wire as wire
+
+_node_name = re.compile(r"[^:\s]+")  # How log messages start
+
+
+class Viewer(object):
+    """A remote interface (e.g., NetVis) connected to us."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.protocol = wire.JSON
+        self.closed = threading.Event()
+        self._lock = threading.Lock()
+        self._node_ids = {}  # Name -> ID for the binary protocol
+        self._thread = threading.Thread(target=self._read_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_loop(self):
+        lines = wire.LineSplitter()
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.error:
+                break
+            if not data:
+                break
+            for line in lines.feed(data):
+                try:
+                    msg = json.loads(line.decode())
+                except ValueError:
+                    continue
+                if msg.get('type') == 'hello':
+                    self._hello(msg.get('protocols', ()))
+        self.closed.set()
+
+    def _hello(self, protocols):
+        protocol = wire.BINARY if wire.BINARY in protocols else wire.JSON
+        with self._lock:
+            self._send(wire.json_line({'type': 'hello',
+                                       'protocol': protocol}))
+            self.protocol = protocol
+
+    def _send(self, data):
+        try:
+            self.sock.sendall(data)
+        except socket.error:
+            self.closed.set()
+
+    def send(self, msg):
+        with self._lock:
+            if self.protocol == wire.JSON:
+                data = wire.json_line(msg)
+            elif msg['type'] == 'packet':
+                ids = []
+                frames = []
+                for name in (msg['node1'], msg['node2']):
+                    node_id = self._node_ids.get(name)
+                    if node_id is None:
+                        node_id = self._node_ids[name] = len(self._node_ids)
+                        frames.append(wire.name_frame(node_id, name))
+                    ids.append(node_id)
+                frames.append(wire.packet_frame(
+                    ids[0], ids[1], msg['duration'], msg['stroke'],
+                    msg['fill'], msg['drop']))
+                data = b"".join(frames)
+            else:
+                data = wire.json_frame(msg)
+            self._send(data)
+
+
+class Player(object):
+    """
+    Plays a Recording, giving the messages to send().
+
+    The messages are the ones the simulator would have sent a remote
+    interface.
+
+    """
+
+    def __init__(self, recording, send, speed=1.0, start=0.0, end=None,
+                 nodes=None):
+        self.recording = recording
+        self.send = send
+        self.speed = speed
+        self.start = start
+        self.end = end
+        self.nodes = nodes  # Patterns for names to show, or None for all
+        self.entities = {}  # Name -> "host" or "switch"
+        self.links = set()  # See recorder.link_key()
+        self.shown = set()  # Names of the Entities shown
+        self.time = start  # Simulated time we're up to
+
+    def _wanted(self, name):
+        if self.nodes is None:
+            return True
+        for pattern in self.nodes:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def _wanted_link(self, link):
+        return self._wanted(link[0]) or self._wanted(link[2])
+
+    def _shape(self, name):
+        return 'square' if self.entities.get(name) == 'switch' else 'circle'
+
+    def _show(self, name):
+        if name not in self.shown:
+            self.shown.add(name)
+            self.send({'type': 'addEntity', 'kind': self._shape(name),
+                       'label': name})
+
+    def play(self):
+        offset, self.entities, self.links = self.recording.seek(self.start)
+        links = sorted(l for l in self.links if self._wanted_link(l))
+        self.shown = set(n for n in self.entities if self._wanted(n))
+        for link in links:
+            self.shown.update((link[0], link[2]))
+        self.send({
+            'type': 'initialize',
+            'entities': dict((n, self._shape(n)) for n in self.shown),
+            'links': [list(l) for l in links],
+        })
+
+        wall_start = time.time()
+        for t, kind, args in self.recording.events(offset):
+            if self.end is not None and t > self.end:
+                break
+            if self.speed:
+                delay = ((t - self.start) / self.speed
+                         - (time.time() - wall_start))
+                if delay > 0:
+                    time.sleep(delay)
+            self.time = t
+            getattr(self, "_play_" + kind)(*args)
+
+    def _play_entity_up(self, name, kind):
+        self.entities[name] = kind
+        if self._wanted(name):
+            self._show(name)
+
+    def _play_entity_down(self, name):
+        self.entities.pop(name, None)
+        if name in self.shown:
+            self.shown.discard(name)
+            self.send({'type': 'delEntity', 'node': name})
+
+    def _play_link(self, msg_type, a, a_port, b, b_port):
+        recorder.apply_topology(self.entities, self.links,
+                                'link_up' if msg_type == 'link'
+                                else 'link_down', (a, a_port, b, b_port))
+        if not (self._wanted(a) or self._wanted(b)):
+            return
+        if msg_type == 'link':
+            self._show(a)
+            self._show(b)
+        self.send({'type': msg_type, 'node1': a, 'node2': b,
+                   'node1_port': a_port, 'node2_port': b_port})
+
+    def _play_link_up(self, *args):
+        self._play_link('link', *args)
+
+    def _play_link_down(self, *args):
+        self._play_link('unlink', *args)
+
+    def _play_packet(self, n1, n2, latency, stroke, fill, drop):
+        if not (self._wanted(n1) or self._wanted(n2)):
+            return
+        duration = latency * 1000
+        if self.speed:
+            duration /= self.speed
+        self.send({'type': 'packet', 'node1': n1, 'node2': n2,
+                   'duration': duration, 'stroke': stroke, 'fill': fill,
+                   'drop': drop})
+
+    def _play_log(self, level, name, created, message):
+        if self.nodes is not None:
+            node = _node_name.match(message)
+            if node is None or not self._wanted(node.group()):
+                return
+        asctime = time.strftime("%Y-%m-%d %H:%M:%S",
+                                time.localtime(created))
+        self.send({'type': 'log', 'message': message, 'levelno': level,
+                   'levelname': logging.getLevelName(level), 'name': name,
+                   'created': created, 'simtime': self.time,
+                   'asctime': "%s,%03d" % (asctime, (created % 1) * 1000)})
+
+
+def info(recording):
+    """Prints what's in a recording."""
+    counts = collections.Counter()
+    first = last = None
+    for t, kind, args in recording.events():
+        counts[kind] += 1
+        if first is None:
+            first = t
+        last = t
+    print("%s:%s" % (recording.filename, "" if recording.complete
+                     else " (incomplete; the recording wasn't closed)"))
+    if first is None:
+        print("  Nothing recorded")
+        return
+    print("  Simulated time %.3f to %.3f" % (first, last))
+    for kind in recorder.EVENT_KINDS:
+        print("  %-12s %10i" % (kind, counts[kind]))
+    print("  %-12s %10i" % ("names", len(recording.names)))
+    print("  %-12s %10i" % ("index", len(recording.index)))
+
+
+def serve(player, address, port):
+    """Waits for a remote interface to connect, and plays to it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((address, port))
+    sock.listen(1)
+    print("Waiting for NetVis on %s:%i" % (address, port), file=sys.stderr)
+    conn, _ = sock.accept()
+    sock.close()
+    viewer = Viewer(conn)
+    player.send = viewer.send
+    player.play()
+    print("Done at %.3f; waiting for NetVis to disconnect" % (player.time, ),
+          file=sys.stderr)
+    while not viewer.closed.wait(1):
+        pass  # (Waiting in little bits so ^C works)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Plays a recorded simulation back to NetVis.")
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="times real time to play at (0 means as fast "
+                        "as possible)")
+    parser.add_argument('--start', type=float, default=0.0,
+                        help="simulated time to start at")
+    parser.add_argument('--end', type=float,
+                        help="simulated time to stop at")
+    parser.add_argument('--node', action='append', dest='nodes',
+                        metavar='PATTERN',
+                        help="only show what involves Entities whose names "
+                        "match")
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4444)
+    parser.add_argument('--print', action='store_true', dest='print_',
+                        help="write messages to stdout (as fast as "
+                        "possible) instead of to NetVis")
+    parser.add_argument('--info', action='store_true',
+                        help="say what's in the recording and quit")
+    options = parser.parse_args()
+
+    recording = recorder.Recording(options.recording)
+    if options.info:
+        info(recording)
+        return
+
+    player = Player(recording, None, options.speed, options.start,
+                    options.end, options.nodes)
+    try:
+        if options.print_:
+            player.speed = 0
+
+            def write(msg):
+                sys.stdout.write(json.dumps(msg) + "\n")
+
+            player.send = write
+            player.play()
+        else:
+            serve(player, options.address, options.port)
+    except KeyboardInterrupt:
+        pass
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise  # (A closed pipe just means whoever's reading is done)
+    finally:
+        recording.close()
+
+
+if __name__ == '__main__':
+    main()
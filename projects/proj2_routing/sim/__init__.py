@@ -26,9 +26,33 @@ class SimConfiguration(object):
 
     debug_startup = False
 
+    # Make Entities available everywhere by name (through builtins)?  None
+    # means only when interactive.
+    entity_builtins = None
+
+    scheduler = "heap"  # Event queue (see sim.scheduler)
+    speed = 1.0  # Real time runs this many times faster than the wall clock
+    timer_resolution = 0.01  # Tick length of the World's TimerWheel
+
+    trace_mode = "full"  # Record packet paths?  "full", "sampled", or "off"
+    trace_sample_rate = 0.01  # Fraction of packets traced if "sampled"
+
+    profile = None  # Profile and write results to files named this (or not)
+
+    metrics = None  # File to record metrics to (see sim.metrics), if any
+    metrics_interval = 1.0  # Simulated seconds between metrics snapshots
+
+    record = None  # File to record the simulation to (see sim.recorder)
+
+    # Event kind -> most of them per second sent to remote interfaces
+    event_rate_limits = {}
+
     remote_interface = "tcp"  # Probably "tcp", "udp", or None
     remote_interface_address = "127.0.0.1"
     remote_interface_port = 4444
+    remote_flush_interval = 0.02  # Seconds to collect messages to write
+    remote_queue_size = 1000  # Max packet animations queued per connection
+    remote_drop_policy = "oldest"  # Or "sample" (see comm_tcp)
 
     @property
     def default_switch_type(self):
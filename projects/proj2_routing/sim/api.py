@@ -27,6 +27,18 @@ def get_name(entity):
         print("Trying to get_name() of a", type(entity))
 
 
+def get_entity_count():
+    """
+    Returns how many entity IDs have been handed out so far.
+
+    Every Entity has an entity_id, and they're numbered from zero in the
+    order the Entities were created.  So a list with this many elements can
+    have a spot for every Entity.
+
+    """
+    return len(core.registry.nodes)
+
+
 def create_timer(seconds,
                  target,
                  recurring=True,
@@ -125,11 +137,10 @@ def current_time():
     """
     Returns the current time.
 
-    Appears bananas, but works.
+    That's the current World's time (see sim.core.current_world()).
 
     """
-    import sim.api as api
-    return api.current_time()
+    return core.world.time
 
 
 def run_tasklet(_generator, *_args, **_kw):
@@ -167,6 +178,65 @@ def run_tasklet(_generator, *_args, **_kw):
     iterate()
 
 
+def checkpoint():
+    """
+    Freezes a copy of the simulation as it is now, to restore later.
+
+    Returns a sim.core.Checkpoint.  Most of the time, branch() is easier.
+
+    """
+    return core.world.checkpoint()
+
+
+def branch(branches, jobs=1):
+    """
+    Carries on the simulation separately for each of branches.
+
+    The simulation is copied (by forking) once for each item of branches,
+    and in each copy, branch() returns that item.  Up to jobs copies run at
+    a time.  Meanwhile, the original waits for all of them to finish and
+    then ends, logging an error for each copy which logged any.  This means
+    a test can let routing converge just once, and then try lots of things
+    starting from there.
+
+    Example:
+    def test_tasklet():
+      yield 20  # Wait for routing to converge
+      a, b = api.branch([(s1, s2), (s2, s3), (s3, s1)])
+      a.unlinkTo(b)
+      ...
+
+    """
+    branches = list(branches)
+    cp = core.world.checkpoint()
+    if cp.restored:
+        return branches[cp.branch]
+
+    failed = []
+    running = []  # (index, pid)
+
+    def finish_one():
+        i, pid = running.pop(0)
+        status = cp.wait(pid)
+        if status != 0:
+            failed.append((i, status))
+
+    try:
+        for i in range(len(branches)):
+            if len(running) >= max(1, jobs):
+                finish_one()
+            running.append((i, cp.restore(i)))
+        while running:
+            finish_one()
+    finally:
+        cp.close()
+
+    for i, status in sorted(failed):
+        simlog.error("Branch %s failed (exit status %s)", branches[i], status)
+    import sys
+    sys.exit(1 if failed else 0)  # End this simulation
+
+
 def hsv_to_rgb(h, s, v, a=1):
     """Convert hue, saturation, value (0..1) to RGBA."""
     # Why aren't we using colorsys.hsv_to_rgb() here?  What is the sound of
@@ -193,9 +263,26 @@ def hsv_to_rgb(h, s, v, a=1):
     return [r, g, b, a]
 
 
+def _random_color():
+    return hsv_to_rgb(rand(), rand() * .8 + .2, rand() * .5 + .5, .75)
+
+
 class Packet(object):
     DEFAULT_TTL = 20
 
+    # Bytes for the addresses, TTL, and so on (see wire_size)
+    HEADER_SIZE = 20
+
+    _outer_color = None
+    _inner_color = None
+    # Until its outer color is settled, a packet and its copies share this:
+    # a list holding the color they'll all get, or None if nobody has looked
+    # yet (see sim.core._packet_copier).
+    _color_cell = None
+
+    _trace_path = 0  # ID of the path so far (see trace), or None
+    _trace_list = None
+
     def __init__(self, dst=NullAddress, src=NullAddress):
         """
         Base class for all packets.
@@ -214,16 +301,94 @@ class Packet(object):
         self.dst = dst
         # Decremented for each entity we go through.
         self.ttl = self.DEFAULT_TTL
-        # List of entities we've been sent through.  For debugging.
-        self.trace = []
+        # List of entities we've been sent through (see trace below).
+        # Whether we keep one depends on the World's trace mode (with no
+        # World, we do).
+        world = core.current_world()
+        if world is not None:
+            rate = world._trace_sample_rate
+            if rate is None:
+                if world._trace_path is None:
+                    self._trace_path = None  # Not tracing at all
+            elif world._trace_random() >= rate:
+                self._trace_path = None  # Not in the sample
+
+        # The colors (see outer_color and inner_color below) are only made
+        # up if someone actually looks at them.
+
+    # When using NetVis, packets are visible, and you can set the color.
+    # color is a list of red, green, blue, and (optionally) alpha values.
+    # Each value is between 0 and 1.  alpha of 0 is transparent.  1 is
+    # opaque.
+
+    @property
+    def outer_color(self):
+        """Color of the packet's outline.  Defaults to something random."""
+        if self._outer_color is None:
+            cell = self._color_cell
+            if cell is None:
+                self._outer_color = _random_color()
+            else:
+                # Same as our copies, but a list of our own
+                if cell[0] is None:
+                    cell[0] = _random_color()
+                self._outer_color = list(cell[0])
+        return self._outer_color
+
+    @outer_color.setter
+    def outer_color(self, color):
+        self._outer_color = color
+
+    @property
+    def inner_color(self):
+        """Color of the inside of the packet.  Defaults to transparent."""
+        if self._inner_color is None:
+            self._inner_color = [0, 0, 0, 0]
+        return self._inner_color
+
+    @inner_color.setter
+    def inner_color(self, color):
+        self._inner_color = color
 
-        # When using NetVis, packets are visible, and you can set the color.
-        # color is a list of red, green, blue, and (optionally) alpha values.
-        # Each value is between 0 and 1.  alpha of 0 is transparent.  1 is
-        # opaque.
-        self.outer_color = hsv_to_rgb(rand(), rand() * .8 + .2,
-                                      rand() * .5 + .5, .75)
-        self.inner_color = [0, 0, 0, 0]  # transparent
+    @property
+    def wire_size(self):
+        """
+        About how many bytes this packet would take up on a real wire.
+
+        Cables which model bandwidth (see sim.cable) use this.  It's just
+        the HEADER_SIZE here, so if you add fields to a packet type, you may
+        want to override this to count them.
+
+        """
+        return self.HEADER_SIZE
+
+    @property
+    def trace(self):
+        """
+        List of entities we've been sent through.  For debugging.
+
+        Depending on the trace mode (see --trace-mode), this may always
+        start out empty, or empty for all but a sample of packets (but
+        it's always a list of the packet's own, which keeps whatever's
+        added to it).  Paths are actually kept as IDs into the World's
+        PathTrie (which copies of a packet can share), and only made into a
+        list if someone looks at one.
+
+        """
+        if self._trace_list is None:
+            if not self._trace_path:
+                # Not being traced (at least until now), or not sent yet
+                self._trace_list = []
+                self._trace_path = None
+                return self._trace_list
+            self._trace_list = core.world.trace_paths.get(self._trace_path)
+            self._trace_path = None
+        return self._trace_list
+
+    @trace.setter
+    def trace(self, trace):
+        self._trace_list = trace
+        self._trace_path = None
 
     def _notify_rx(self, srcEnt, srcPort, dstEnt, dstPort, drop):
         """
@@ -233,7 +398,11 @@ class Packet(object):
 
         """
         if not drop:
-            self.trace.append(dstEnt)
+            if self._trace_path is not None:
+                self._trace_path = core.current_world().trace_paths.extend(
+                    self._trace_path, dstEnt)
+            elif self._trace_list is not None:
+                self._trace_list.append(dstEnt)
 
     def _notify_tx(self, srcEnt, srcPort, dstEnt, dstPort, drop):
         """
@@ -252,6 +421,7 @@ class Packet(object):
 class Entity(object):
     """Base class for all entities (switches, hosts, etc.)."""
     name = "Unnamed"  # Gets set later
+    entity_id = None  # Dense integer ID; gets set later (see get_entity_count)
     NO_LOG = False  # Can be used to force off the log for this entity
     LOG_LEVEL = "debug"  # Default level for .log()
 
@@ -47,7 +47,8 @@ class BasicHost(api.HostEntity):
             if isinstance(packet, Ping) and self.ENABLE_PONG:
                 # Trace this path
                 import sim.core as core
-                core.events.highlight_path([packet.src] + packet.trace)
+                if core.events.wants_highlight:
+                    core.events.highlight_path([packet.src] + packet.trace)
                 # Send a pong response
                 self.send(Pong(packet), port)
 
@@ -64,6 +65,13 @@ class Ping(api.Packet):
             for i, c in enumerate(color):
                 self.outer_color[i] = c
 
+    @property
+    def wire_size(self):
+        size = super(Ping, self).wire_size
+        if self.data is not None:
+            size += len(str(self.data))
+        return size
+
     def __repr__(self):
         d = self.data
         if d is not None:
@@ -92,6 +100,11 @@ class Pong(api.Packet):
         self.outer_color = original.inner_color
         self.inner_color = original.outer_color
 
+    @property
+    def wire_size(self):
+        # Carries the whole original
+        return super(Pong, self).wire_size + self.original.wire_size
+
     def __repr__(self):
         return "<Pong " + str(self.original) + ">"
 
@@ -114,6 +127,11 @@ class RoutePacket(api.Packet):
         self.outer_color = [1, 0, 1, 1]
         self.inner_color = [1, 0, 1, 1]
 
+    @property
+    def wire_size(self):
+        # A destination address and a cost
+        return super(RoutePacket, self).wire_size + 8
+
     def __repr__(self):
         return "<RoutePacket to %s at cost %s>" % (self.destination,
                                                    self.latency)
@@ -52,13 +52,20 @@ Good luck!
 """.strip()
 
 
-def main():
+def parse_commandline(argv):
+    """
+    Splits up a commandline (without the program name).
+
+    Returns a dict of the simulator's options and a list of (module name,
+    dict of its options) pairs.
+
+    """
     modules = []
     cmd = None  # Special
     args = {}
     general_args = args
 
-    for arg in sys.argv[1:]:
+    for arg in argv:
         if arg.startswith("--"):
             # An option
             arg = arg[2:]
@@ -78,6 +85,16 @@ def main():
             args = {}
             modules.append((cmd, args))
 
+    return general_args, modules
+
+
+def setup(general_args, modules):
+    """
+    Sets up the simulator and launches the modules.
+
+    Returns a list of (name, module) pairs, or None if something failed.
+
+    """
     remaining = pre_options(**general_args)
 
     pymods = []
@@ -85,11 +102,21 @@ def main():
         m = launch_module(name, args)
         if not m:
             _fail("Could not launch all modules.")
-            return
+            return None
         pymods.append((name, m))
 
     post_options(**remaining)
 
+    return pymods
+
+
+def main():
+    general_args, modules = parse_commandline(sys.argv[1:])
+
+    pymods = setup(general_args, modules)
+    if pymods is None:
+        return
+
     import sim.api
     sim.api.netvis.info = _netvis_welcome
 
@@ -104,6 +131,7 @@ def main():
         variables['api'] = sim.api
         variables['topos'] = topo_package
         variables['basics'] = sim.basics
+        variables['metrics'] = core.world.metrics
         for k, v in pymods:
             if "." in k:
                 variables[k.rsplit(".")[-1]] = v
@@ -119,7 +147,8 @@ def main():
         # Non-interactive always starts automatically
         import sim.core as core
         core.world.start(threaded=False)
-        sys.exit(0 if core.error_counter.count == 0 else 1)
+        core.events.flush()
+        sys.exit(0 if core.world.error_count == 0 else 1)
 
 
 def pre_options(default_host_type=None,
@@ -130,10 +159,23 @@ def pre_options(default_host_type=None,
                 remote_interface="tcp",
                 remote_interface_port=4444,
                 remote_interface_address="127.0.0.1",
+                remote_flush_interval=0.02,
+                remote_queue_size=1000,
+                remote_drop_policy="oldest",
                 interactive=True,
+                entity_builtins=None,
                 very_quiet=False,
                 readline=True,
                 virtual_time=False,
+                scheduler="heap",
+                speed=1.0,
+                trace_mode="full",
+                trace_sample_rate=0.01,
+                profile=None,
+                metrics=None,
+                metrics_interval=1.0,
+                record=None,
+                event_rate_limits=None,
                 poison_mode=None,
                 **kw):
     """
@@ -159,7 +201,29 @@ def pre_options(default_host_type=None,
     sim.config.console_log = console_log
     sim.config.debug_startup = debug_startup
     sim.config.interactive = interactive
+    sim.config.entity_builtins = entity_builtins
     sim.config.readline = readline
+    sim.config.scheduler = scheduler
+    sim.config.speed = float(speed)
+    sim.config.trace_mode = trace_mode
+    sim.config.trace_sample_rate = float(trace_sample_rate)
+    if profile is True:
+        profile = "profile"  # Just --profile
+    sim.config.profile = profile or None
+    if metrics is True:
+        metrics = "metrics.jsonl"  # Just --metrics
+    sim.config.metrics = metrics or None
+    sim.config.metrics_interval = float(metrics_interval)
+    if record is True:
+        record = "recording.rec"  # Just --record
+    sim.config.record = record or None
+    if event_rate_limits:
+        # Like "packet:500,log:100"
+        limits = {}
+        for limit in event_rate_limits.split(","):
+            kind, rate = limit.split(":")
+            limits[kind.strip()] = float(rate)
+        sim.config.event_rate_limits = limits
 
     sim.config.default_host_type = default_host_type
     sim.config.default_switch_type = default_switch_type
@@ -170,6 +234,9 @@ def pre_options(default_host_type=None,
     sim.config.remote_interface = remote_interface
     sim.config.remote_interface_port = remote_interface_port
     sim.config.remote_interface_address = remote_interface_address
+    sim.config.remote_flush_interval = float(remote_flush_interval)
+    sim.config.remote_queue_size = int(remote_queue_size)
+    sim.config.remote_drop_policy = remote_drop_policy
 
     if interactive:
         print(_console_welcome)
@@ -178,6 +245,10 @@ def pre_options(default_host_type=None,
     global w
     w = core.World()
     w.virtual_time = virtual_time
+    w.speed = sim.config.speed
+    if interactive:
+        # Commands typed at the console can schedule more events
+        w.add_producer("console")
     global simlog
     simlog = core.simlog
 
@@ -0,0 +1,328 @@
+"""
+Carries events from the simulator to remote interfaces (NetVis, etc.).
+
+The simulator publishes things like packets moving and links going up by
+calling the methods of core.events, which is an EventBus.  Interfaces
+(see sim.comm) subscribe to just the kinds of event they care about.
+
+Publishing an event nobody has subscribed to just checks a flag (for
+example, wants_packet), and the more expensive call sites check it
+themselves before building anything.  Events which are wanted are put on
+a queue and handed to subscribers by a thread of the bus's own, so a slow
+subscriber never holds up the simulation.  If that queue gets long, or an
+event kind is over its rate limit, events of the less important kinds
+get dropped (and counted in EventBus.dropped).
+
+A subscriber can instead subscribe synchronously, in which case it's
+called right away, by whatever thread published the event, and never has
+events dropped.  That's for things like recording (see sim.recorder) which
+need every event, and need it while the World's clock still says when it
+happened.  They'd better be quick.
+
+Log records are published as they come from the logging module, and only
+turned into messages for subscribers (by log_message()) on the delivery
+thread.
+"""
+
+import collections
+import logging
+import threading
+import time
+import traceback
+
+
+# Event kind -> name of the method subscribers get it through
+kinds = collections.OrderedDict([
+    ('console', 'send_console'),
+    ('console_more', 'send_console_more'),
+    ('log', 'send_log'),
+    ('entity_up', 'send_entity_up'),
+    ('entity_down', 'send_entity_down'),
+    ('link_up', 'send_link_up'),
+    ('link_down', 'send_link_down'),
+    ('info', 'send_info'),
+    ('packet', 'packet'),
+    ('highlight', 'highlight_path'),
+    ('debug', 'set_debug'),
+])
+
+# Event kinds which are okay to drop.  The rest change what a remote
+# interface thinks the topology looks like, so they always get through.
+lossy_kinds = frozenset(['console', 'console_more', 'log', 'packet',
+                         'highlight', 'debug'])
+
+
+# LogRecord attributes which go in log messages
+_log_attributes = [
+    'created',
+    'filename',
+    'funcName',
+    'levelname',
+    'levelno',
+    'lineno',
+    'module',
+    'msecs',
+    'name',
+    'pathname',
+    'process',
+    'processName',
+    'relativeCreated',
+    'thread',
+    'threadName',
+    'args',
+]
+
+
+def log_message(record):
+    """
+    Turns a logging.LogRecord into a log message for remote interfaces.
+
+    The record's message should already have been rendered (by
+    record.getMessage()) into record.message.
+    """
+    if isinstance(record, dict):
+        return record  # Already a message
+    fmt = logging._defaultFormatter
+    text = record.message
+    if record.exc_info:
+        if not record.exc_text:
+            record.exc_text = fmt.formatException(record.exc_info)
+        text += "\n" + record.exc_text
+    elif record.exc_text:
+        text += "\n" + record.exc_text
+    if getattr(record, 'stack_info', None):
+        text += "\n" + fmt.formatStack(record.stack_info)
+    o = {'message': text, 'type': 'log'}
+    for attr in _log_attributes:
+        if hasattr(record, attr):
+            o[attr] = getattr(record, attr)
+    o['asctime'] = fmt.formatTime(record)
+    if record.exc_info:
+        o['exc_info'] = [str(record.exc_info[0]),
+                         str(record.exc_info[1]),
+                         traceback.format_tb(record.exc_info[2], 1)]
+        o['exc'] = traceback.format_exception(*record.exc_info)
+    return o
+
+
+class RateLimit(object):
+    """A token bucket allowing rate events per (wall clock) second."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+
+    def allow(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class EventBus(object):
+    """
+    Delivers simulator events to the interfaces subscribed to them.
+
+    The publishing methods have the same names and arguments as the
+    methods of comm.NullInterface, and subscribers get events through
+    those same methods.
+    """
+
+    def __init__(self, max_pending=10000, thread_init=None, on_change=None):
+        """
+        thread_init, if given, is called by the delivery thread when it
+        starts (the World uses it to make itself current there).
+        on_change, if given, is called when subscriptions change.
+        """
+        self.max_pending = max_pending
+        self._thread_init = thread_init
+        self._on_change = on_change
+        self._subscribers = dict((k, ()) for k in kinds)
+        self._synchronous = dict((k, ()) for k in kinds)
+        self._limits = {}
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._idle = False
+        self._busy = False
+        self._thread = None
+        self.published = collections.Counter()
+        self.dropped = collections.Counter()
+        for kind in kinds:
+            setattr(self, "wants_" + kind, False)
+
+    def subscribe(self, subscriber, event_kinds=None, synchronous=False):
+        """
+        Starts delivering events of the given kinds to subscriber.
+
+        event_kinds defaults to all of them.  If synchronous, subscriber
+        gets them straight from the publisher (see the module docs), and
+        log events are the logging.LogRecord rather than a message.
+        """
+        if event_kinds is None:
+            event_kinds = kinds
+        subscribers = self._synchronous if synchronous else self._subscribers
+        for kind in event_kinds:
+            if kind not in kinds:
+                raise RuntimeError("No such event kind as '%s'" % (kind, ))
+            if subscriber not in subscribers[kind]:
+                # Replaced rather than modified so the delivery thread
+                # never sees a list change under it
+                subscribers[kind] += (subscriber, )
+            setattr(self, "wants_" + kind, True)
+        if self._on_change is not None:
+            self._on_change()
+        if synchronous:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver_loop)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def unsubscribe(self, subscriber, event_kinds=None):
+        """Stops delivering events of the given kinds (or all) to subscriber."""
+        if event_kinds is None:
+            event_kinds = kinds
+        for kind in event_kinds:
+            subs = tuple(s for s in self._subscribers[kind]
+                         if s is not subscriber)
+            self._subscribers[kind] = subs
+            sync = tuple(s for s in self._synchronous[kind]
+                         if s is not subscriber)
+            self._synchronous[kind] = sync
+            setattr(self, "wants_" + kind, bool(subs or sync))
+        if self._on_change is not None:
+            self._on_change()
+
+    def set_rate_limit(self, kind, rate, burst=None):
+        """
+        Allows at most rate events of the given kind per second.
+
+        Only works for kinds in lossy_kinds.  A rate of None removes the
+        limit.
+        """
+        if kind not in lossy_kinds:
+            raise RuntimeError("Can't rate limit '%s' events" % (kind, ))
+        if rate is None:
+            self._limits.pop(kind, None)
+        else:
+            self._limits[kind] = RateLimit(rate, burst)
+
+    def publish(self, kind, *args):
+        """Queues an event for delivery.  Never blocks."""
+        if not getattr(self, "wants_" + kind):
+            return
+        self._publish(kind, args)
+
+    def _publish(self, kind, args):
+        for s in self._synchronous[kind]:
+            try:
+                getattr(s, kinds[kind])(*args)
+            except Exception:
+                traceback.print_exc()
+        if not self._subscribers[kind]:
+            return
+        if kind in lossy_kinds:
+            limit = self._limits.get(kind)
+            if ((limit is not None and not limit.allow())
+                    or len(self._pending) >= self.max_pending):
+                self.dropped[kind] += 1
+                return
+        self.published[kind] += 1
+        self._pending.append((kind, args))
+        if self._idle:
+            with self._cond:
+                self._cond.notify()
+
+    def flush(self, timeout=1):
+        """Waits (up to timeout seconds) for queued events to be delivered."""
+        end = time.time() + timeout
+        while (self._pending or self._busy) and time.time() < end:
+            time.sleep(0.01)
+
+    def _deliver_loop(self):
+        if self._thread_init is not None:
+            self._thread_init()
+        pending = self._pending
+        while True:
+            with self._cond:
+                self._idle = True
+                while not pending:
+                    # In case of a missed notify
+                    self._cond.wait(1)
+                self._idle = False
+            self._busy = True
+            while pending:
+                kind, args = pending.popleft()
+                method = kinds[kind]
+                if kind == 'log':
+                    try:
+                        args = (log_message(args[0]), )
+                    except Exception:
+                        traceback.print_exc()
+                        continue
+                for s in self._subscribers[kind]:
+                    try:
+                        getattr(s, method)(*args)
+                    except Exception:
+                        traceback.print_exc()
+            self._busy = False
+
+    # Publishing methods.  These are what the rest of the simulator calls.
+
+    def send_console(self, text):
+        if self.wants_console:
+            self._publish('console', (text, ))
+
+    def send_console_more(self, text):
+        if self.wants_console_more:
+            self._publish('console_more', (text, ))
+
+    def send_log(self, record):
+        """record is a logging.LogRecord (see log_message())."""
+        if self.wants_log:
+            self._publish('log', (record, ))
+
+    def send_entity_down(self, name):
+        if self.wants_entity_down:
+            self._publish('entity_down', (name, ))
+
+    def send_entity_up(self, name, kind):
+        if self.wants_entity_up:
+            self._publish('entity_up', (name, kind))
+
+    def send_link_up(self, srcid, sport, dstid, dport):
+        if self.wants_link_up:
+            self._publish('link_up', (srcid, sport, dstid, dport))
+
+    def send_info(self, msg):
+        if self.wants_info:
+            self._publish('info', (msg, ))
+
+    def packet(self, n1, n2, packet, duration, drop=False):
+        if self.wants_packet:
+            # Settle the colors here rather than on the delivery thread
+            packet.outer_color
+            packet.inner_color
+            self._publish('packet', (n1, n2, packet, duration, drop))
+
+    def send_link_down(self, srcid, sport, dstid, dport):
+        if self.wants_link_down:
+            self._publish('link_down', (srcid, sport, dstid, dport))
+
+    def highlight_path(self, nodes):
+        """Sends a path to the GUI to be highlighted."""
+        if self.wants_highlight:
+            self._publish('highlight', (list(nodes), ))
+
+    def set_debug(self, nodeid, msg):
+        if self.wants_debug:
+            self._publish('debug', (nodeid, msg))
@@ -1,7 +1,7 @@
 """Cables are how Entities are connected."""
 
+import collections
 import random
-import sim.core as core
 
 
 class Cable(object):
@@ -19,15 +19,15 @@ class Cable(object):
 
     def initialize(self, src, srcport, dst, dstport):
         """Called to set up the ends."""
-        for a in ['src', 'srcPort', 'srcEntity', 'dst', 'dstPort',
-                  'dstEntity']:
-            setattr(self, a, None)
+        self.srcEntity = None
+        self.dstEntity = None
         self.src = src
         self.srcPort = srcport
         self.srcEnt = src.entity
         self.dst = dst
         self.dstPort = dstport
         self.dstEnt = dst.entity
+        self.world = src.world
 
     def transfer(self, packet):
         """Implement this in subclasses."""
@@ -59,12 +59,18 @@ class DumbCable(Cable):
             packet._notify_rx(self.srcEnt, self.srcPort, self.dstEnt,
                               self.dstPort, False)
 
-            self.dstEnt.handle_rx(packet, self.dstPort)
+            self.dst.packets_rx += 1
+            profiler = self.world.profiler
+            if profiler is None:
+                self.dstEnt.handle_rx(packet, self.dstPort)
+            else:
+                profiler.call(self.dstEnt.handle_rx, (packet, self.dstPort),
+                              packet=packet)
 
-        core.world.doLater(self.latency, rx)
+        self.world.doLater(self.latency, rx)
 
-        core.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
-                           self.latency)
+        self.world.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
+                                 self.latency)
         packet._notify_tx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
                           False)
 
@@ -77,42 +83,121 @@ class BasicCable(DumbCable):
     packets which were on the wire when a link goes down (which is
     pretty important for sensible link down behavior).
 
+    The queue can be limited to queue_size packets and/or queue_bytes
+    bytes (see api.Packet.wire_size).  It holds packets until they're
+    delivered, so it counts those still on the wire too.  Packets which
+    don't fit are dropped.
+
+    Keeps counts of what it has sent and dropped (and why), how long
+    packets have waited to be transmitted (see also utilization), and how
+    long the queue has gotten.
+
     """
     DEFAULT_QUEUE_SIZE = None  # Unlimited
+    DEFAULT_QUEUE_BYTES = None  # Unlimited
     DEFAULT_TX_TIME = 0.1  # Transmission delay
 
+    # Check that the queue is in delivery order whenever it changes.  This
+    # makes every send O(n log n), so it's just for debugging.
+    CHECK_QUEUE = False
+
     def __init__(self, *args, **kw):
         self.size = kw.pop("queue_size", self.DEFAULT_QUEUE_SIZE)
-        self.queue = []  # time, packet
+        self.size_bytes = kw.pop("queue_bytes", self.DEFAULT_QUEUE_BYTES)
+        self.tx_time = kw.pop("tx_time", self.DEFAULT_TX_TIME)
+
+        # (delivery time, packet, size).  Packets go out one after another,
+        # so they're (nearly always) added in delivery order.
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+
+        # Counters
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.bytes_by_type = collections.defaultdict(int)  # Packet class ->
+        self.packets_dropped = 0
+        self.bytes_dropped = 0
+        self.dropped_full = 0  # Packets which didn't fit in the queue
+        self.dropped_lost = 0  # Packets lost on purpose (UnreliableCable)
+        self.dropped_down = 0  # Packets queued when the link went down
+        self.max_queue_depth = 0
+        self.busy_time = 0  # Total transmission time
+        self.total_queue_delay = 0  # Total time spent waiting to transmit
+        self.max_queue_delay = 0
+
+        # Time of the deliver() event which is due first, if there is one.
+        # Superseded (later) deliver() events may still be in the World's
+        # queue, but when their time comes, they see that they aren't this
+        # one, and do nothing.
         self.next_delivery = None
 
         super(BasicCable, self).__init__(*args, **kw)
 
-        self.tx_time = kw.pop("tx_time", self.DEFAULT_TX_TIME)
-
         self._tx_stop = None  # Time at which current transfer ends (or None)
 
-    def drop(self):
-        del self.queue[-1]  # Tail drop
+    def initialize(self, src, srcport, dst, dstport):
+        super(BasicCable, self).initialize(src, srcport, dst, dstport)
+        self.start_time = self.world.time
+
+    def get_tx_time(self, packet, size):
+        """Returns how long it takes to transmit a packet of size bytes."""
+        return self.tx_time
+
+    @property
+    def utilization(self):
+        """Fraction of the time since we were connected spent transmitting."""
+        now = self.world.time
+        elapsed = now - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        busy = self.busy_time
+        if self._tx_stop is not None and self._tx_stop > now:
+            busy -= self._tx_stop - now  # Hasn't happened yet
+        return busy / float(elapsed)
+
+    @property
+    def mean_queue_delay(self):
+        if not self.packets_sent:
+            return 0.0
+        return self.total_queue_delay / float(self.packets_sent)
+
+    def drop(self, packet, size, lost=False):
+        """
+        Drops a packet which doesn't fit in the queue.
+
+        Or, if lost, one which is being lost on purpose.
+
+        """
+        self.packets_dropped += 1
+        self.bytes_dropped += size
+        if lost:
+            self.dropped_lost += 1
+        else:
+            self.dropped_full += 1
+        self.world.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
+                                 self.latency, drop=True)
 
     def sched(self):
         if not self.queue:
             return
-        assert [
-            x[0] for x in self.queue
-        ] == [
-            x[0] for x in sorted(
-                self.queue, key=self._queue_key)
-        ]
-        # self.queue.sort() # We could do better than this! (And have,
-        # apparently)
+        if self.CHECK_QUEUE:
+            assert [
+                x[0] for x in self.queue
+            ] == [
+                x[0] for x in sorted(
+                    self.queue, key=self._queue_key)
+            ]
         t = self.queue[0][0]
-        self.next_delivery = None
         if self.next_delivery is None or t < self.next_delivery:
+            # (If there's already a later event, it'll find nothing due and
+            # do nothing.)
             self.next_delivery = t
-            core.world.doAt(t, self.deliver)
+            self.world.doAt(t, self.deliver)
 
     def deliver(self):
+        now = self.world.time
+        if self.next_delivery is None or now < self.next_delivery:
+            return  # Superseded by an earlier event
         if self.src:
             self.old_src = self.src
         if self.dst:
@@ -125,10 +210,12 @@ class BasicCable(DumbCable):
                 drop = True
                 return
 
-        while self.queue:
-            if self.queue[0][0] > core.world.time:
+        queue = self.queue
+        while queue:
+            if queue[0][0] > now:
                 break
-            p = self.queue.pop(0)[1]
+            _, p, size = queue.popleft()
+            self.queued_bytes -= size
             self._do_deliver(p, drop)
         self.sched()
 
@@ -136,11 +223,25 @@ class BasicCable(DumbCable):
         p._notify_rx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
                      drop)
         if not drop:
-            self.dstEnt.handle_rx(p, self.dstPort)
+            self.dst.packets_rx += 1
+            profiler = self.world.profiler
+            if profiler is None:
+                self.dstEnt.handle_rx(p, self.dstPort)
+            else:
+                profiler.call(self.dstEnt.handle_rx, (p, self.dstPort),
+                              packet=p)
 
     def transfer(self, packet):
-        now = core.world.time
-        tx_time = self.tx_time
+        queue = self.queue
+        size = packet.wire_size
+        if ((self.size is not None and len(queue) >= self.size) or
+                (self.size_bytes is not None and
+                 self.queued_bytes + size > self.size_bytes)):
+            self.drop(packet, size)  # Tail drop
+            return
+
+        now = self.world.time
+        tx_time = self.get_tx_time(packet, size)
         if self._tx_stop is None or now >= self._tx_stop:
             # Not transferring
             tx_at = now
@@ -150,26 +251,45 @@ class BasicCable(DumbCable):
             tx_at = self._tx_stop
             self._tx_stop += tx_time
 
-        self.queue.append((tx_at + tx_time + self.latency, packet))
-        if self.size is not None and len(self.queue) > self.size:
-            self.drop()
-
-        if len(self.queue) >= 2:
-            if self.queue[-1][0] < self.queue[-2][0]:
-                # Deliver last before second-to-last?
-                # Simple answer: just sort
-                self.queue.sort(key=self._queue_key)
+        self.packets_sent += 1
+        self.bytes_sent += size
+        self.bytes_by_type[type(packet)] += size
+        self.busy_time += tx_time
+        delay = tx_at - now
+        self.total_queue_delay += delay
+        if delay > self.max_queue_delay:
+            self.max_queue_delay = delay
+
+        t = tx_at + tx_time + self.latency
+        self.queued_bytes += size
+        if queue and t < queue[-1][0]:
+            # Deliver this before something already queued?  That only
+            # happens if the latency got lowered.  Simple answer: just sort
+            # (in place, since deliver() may be going through this deque).
+            queue.append((t, packet, size))
+            items = sorted(queue, key=self._queue_key)
+            queue.clear()
+            queue.extend(items)
+        else:
+            queue.append((t, packet, size))
+        if len(queue) > self.max_queue_depth:
+            self.max_queue_depth = len(queue)
 
         self.sched()
 
-        core.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
-                           self.latency)
+        self.world.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
+                                 self.latency)
 
         packet._notify_tx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
                           False)
 
     def _handle_disconnect(self):
-        del self.queue[:]
+        # Whatever was queued or on the wire is gone
+        self.packets_dropped += len(self.queue)
+        self.bytes_dropped += self.queued_bytes
+        self.dropped_down += len(self.queue)
+        self.queue.clear()
+        self.queued_bytes = 0
 
     @staticmethod
     def _queue_key(queue_item):
@@ -204,9 +324,30 @@ class UnreliableCable(BasicCable):
         if random.random() >= self.drop_rate:
             super(UnreliableCable, self).transfer(packet)
         else:
-            core.events.packet(
-                self.srcEnt.name,
-                self.dstEnt.name,
-                packet,
-                self.latency,
-                drop=True)
+            self.drop(packet, packet.wire_size, lost=True)
+
+
+class BandwidthCable(BasicCable):
+    """
+    A BasicCable where transmission time depends on the packet's size.
+
+    It takes wire_size * 8 / bandwidth seconds to transmit a packet, where
+    bandwidth is in bits per second.
+
+    """
+    DEFAULT_BANDWIDTH = 1000000  # 1 Mbps
+
+    @classmethod
+    def pair(cls, bandwidth=None, latency=None, **kw):
+        """Create a pair of these (one for each direction)."""
+        return (cls(bandwidth=bandwidth, latency=latency, **kw),
+                cls(bandwidth=bandwidth, latency=latency, **kw))
+
+    def __init__(self, bandwidth=None, *args, **kw):
+        if bandwidth is None:
+            bandwidth = self.DEFAULT_BANDWIDTH
+        self.bandwidth = bandwidth
+        super(BandwidthCable, self).__init__(*args, **kw)
+
+    def get_tx_time(self, packet, size):
+        return size * 8.0 / self.bandwidth
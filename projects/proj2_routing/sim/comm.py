@@ -1,5 +1,9 @@
 """This simulator can call methods in this class to inform external programs
-that various events have occurred."""
+that various events have occurred.
+
+Interfaces don't get these calls unless they subscribe to them with
+core.events.subscribe() (see sim.bus).  The calls come from the event bus's
+delivery thread, not the simulation thread."""
 
 
 class NullInterface(object):
@@ -3,18 +3,64 @@ viewer and NetVis."""
 
 import sim
 import sim.comm as comm
+import sim.wire as wire
+import collections
+import itertools
 import socket
 import json
 import threading
+import time
 import traceback
 
 import sim.core as core
 
 
 class StreamingConnection(comm.NullInterface):
+    """
+    A connection to a remote interface.
+
+    We speak the JSON line protocol unless the remote side asks for the
+    binary one (see sim.wire).
+
+    Outgoing messages are queued and written by a thread of our own, which
+    waits for sim.config.remote_flush_interval after the first message so
+    it can write a bunch of them at once.  Messages which are okay to lose
+    (packet animations) go in a separate queue which holds at most
+    sim.config.remote_queue_size of them.  When it's full, the
+    remote_drop_policy decides what happens: "oldest" drops the oldest
+    message, and "sample" drops every other message in the queue.  Those
+    messages may thus get written a bit later than others sent after them.
+    """
+
     def __init__(self, parent, sock):
         self.sock = sock
         self.parent = parent
+        self.world = parent.world
+
+        self.flush_interval = sim.config.remote_flush_interval
+        self.queue_size = sim.config.remote_queue_size
+        self.drop_policy = sim.config.remote_drop_policy
+        if self.drop_policy not in ("oldest", "sample"):
+            raise RuntimeError("No such drop policy as '%s'"
+                               % (self.drop_policy, ))
+        self._out = []  # Encoded messages to write
+        self._lossy = collections.deque()  # Same, but droppable
+        self._out_cond = threading.Condition()
+        self.closed = False
+        self.protocol = wire.JSON
+        self._names_sent = set()  # Node IDs we've sent FRAME_NAMEs for
+
+        # Counters
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.messages_dropped = 0
+
+        self.writer = threading.Thread(target=self._writeLoop)
+        self.writer.daemon = True
+        self.writer.start()
+
+        # We feed commands from the remote side into the simulation
+        core.world.add_producer(self)
         self.thread = threading.Thread(target=self._recvLoop)
         self.thread.daemon = True
         self.thread.start()
@@ -27,19 +73,19 @@ class StreamingConnection(comm.NullInterface):
             return (b, B, a, A)
 
         links = set()
-        for te in core.topo.values():
+        for te in core.registry.values():
             for n, p in enumerate(te.ports):
                 if p is None:
                     continue
                 links.add(make(te, n, p.dst, p.dstPort))
         links = [list(e) for e in links]
 
-        import sim.api
+        import sim.api as api
         msg = {
             'type': 'initialize',
             'entities': dict([(n.entity.name, 'circle'
-                               if isinstance(n.entity, sim.api.HostEntity) else
-                               'square') for n in core.topo.values()]),
+                               if isinstance(n.entity, api.HostEntity) else
+                               'square') for n in core.registry.values()]),
             #      'entities': {},
             'links': links,
         }
@@ -50,7 +96,8 @@ class StreamingConnection(comm.NullInterface):
 
     def _recvLoop(self):
         import select
-        d = bytes()
+        self.world.activate()
+        lines = wire.LineSplitter()
         retry = 0
         while True:
             try:
@@ -71,12 +118,10 @@ class StreamingConnection(comm.NullInterface):
                         continue
                     else:
                         retry = 0
-                    d = d + r
                 except:
                     # TODO: reopen
                     break
-                while d.find('\n'.encode()) >= 0:
-                    l, d = d.split('\n'.encode(), 1)
+                for l in lines.feed(r):
                     l = l.decode().strip()
                     if len(l) == 0:
                         continue
@@ -87,11 +132,27 @@ class StreamingConnection(comm.NullInterface):
                             data.get('type', "<UNDEFINED>")
                         m = getattr(self, methodName)
                         del data['type']
-                        core.world.doLater(0, m, **data)
+                        if methodName == "_handle_hello":
+                            # Has to happen before we send anything else
+                            m(**data)
+                        else:
+                            core.world.doLater(0, m, **data)
                     except:
                         core.simlog.error("Error dispatching " + methodName)
                         traceback.print_exc()
-        core.events._disconnect(self)
+        self.parent._disconnect(self)
+
+    def _handle_hello(self, protocols=(), **kw):
+        """The remote side tells us which protocols it can speak."""
+        protocol = wire.BINARY if wire.BINARY in protocols else wire.JSON
+        with self._out_cond:
+            # Everything already queued goes out in the old protocol
+            self._out.extend(self._lossy)
+            self._lossy.clear()
+            self._out.append(wire.json_line({'type': 'hello',
+                                             'protocol': protocol}))
+            self.protocol = protocol
+            self._out_cond.notify()
 
     def _handle_ping(self, node1, node2):
         import sim.basics as basics
@@ -129,22 +190,117 @@ class StreamingConnection(comm.NullInterface):
         if node:
             node.disconnect()
 
-    def send_raw(self, msg):
+    @property
+    def queue_depth(self):
+        """The number of messages waiting to be written."""
+        return len(self._out) + len(self._lossy)
+
+    def send_message(self, msg, droppable=False, encoded=None):
+        """
+        Queues a message to be written.  Never blocks.
+
+        encoded is a dict in which encodings of msg can be shared between
+        connections.
+        """
+        if encoded is None:
+            encoded = {}
+        with self._out_cond:
+            if self.closed:
+                return
+            if self.protocol == wire.JSON:
+                data = encoded.get(wire.JSON)
+                if data is None:
+                    data = encoded[wire.JSON] = wire.json_line(msg)
+            elif msg.get('type') == 'packet':
+                ids = []
+                for name in (msg['node1'], msg['node2']):
+                    node_id = self.parent.node_id(name)
+                    if node_id not in self._names_sent:
+                        self._names_sent.add(node_id)
+                        self._out.append(wire.name_frame(node_id, name))
+                    ids.append(node_id)
+                data = encoded.get(wire.BINARY)
+                if data is None:
+                    data = encoded[wire.BINARY] = wire.packet_frame(
+                        ids[0], ids[1], msg['duration'], msg['stroke'],
+                        msg['fill'], msg['drop'])
+            else:
+                data = encoded.get(wire.BINARY)
+                if data is None:
+                    data = encoded[wire.BINARY] = wire.json_frame(msg)
+            self._queue(data, droppable)
+
+    def send_raw(self, msg, droppable=False):
+        """Queues an already encoded message to be written.  Never blocks."""
+        with self._out_cond:
+            if self.closed:
+                return
+            self._queue(msg, droppable)
+
+    def _queue(self, msg, droppable):
+        # Call with _out_cond held
+        if not droppable:
+            self._out.append(msg)
+        else:
+            lossy = self._lossy
+            if len(lossy) >= self.queue_size:
+                if self.drop_policy == "oldest":
+                    lossy.popleft()
+                    self.messages_dropped += 1
+                else:
+                    keep = list(lossy)[1::2]
+                    self.messages_dropped += len(lossy) - len(keep)
+                    self._lossy = lossy = collections.deque(keep)
+            lossy.append(msg)
+        self._out_cond.notify()
+
+    def close(self):
+        with self._out_cond:
+            self.closed = True
+            self._out_cond.notify()
         try:
-            self.sock.send(msg.encode())
+            self.sock.close()
         except:
+            pass
+
+    def _writeLoop(self):
+        self.world.activate()
+        while True:
+            with self._out_cond:
+                while not (self._out or self._lossy or self.closed):
+                    self._out_cond.wait()
+                if self.closed:
+                    break
+            if self.flush_interval:
+                # Let some more pile up
+                time.sleep(self.flush_interval)
+            with self._out_cond:
+                out = self._out
+                out.extend(self._lossy)
+                self._out = []
+                self._lossy.clear()
+            data = b"".join(out)
             try:
-                self.sock.close()
+                self.sock.sendall(data)
             except:
-                pass
-            self.sock = None
-            # TODO: reopen?
-            pass
+                # TODO: reopen?
+                break
+            self.bytes_sent += len(data)
+            self.messages_sent += len(out)
+        if not self.closed:
+            self.parent._disconnect(self)
 
 
 class StreamingInterface(object):
+    # The sim.bus event kinds we send on to our connections
+    EVENT_KINDS = ['log', 'entity_up', 'entity_down', 'link_up', 'link_down',
+                   'info', 'packet', 'debug']
+
     def __init__(self):
+        self.world = core.current_world()  # The one we're the interface of
         self.connections = []
+        self._node_ids = {}  # Node name -> ID for the binary protocol
+        self._next_node_id = itertools.count()
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -155,8 +311,15 @@ class StreamingInterface(object):
         self.thread.daemon = True
         self.thread.start()
 
+    def node_id(self, name):
+        node_id = self._node_ids.get(name)
+        if node_id is None:
+            node_id = self._node_ids.setdefault(name, next(self._next_node_id))
+        return node_id
+
     def _listenLoop(self):
         import select
+        self.world.activate()
         try:
             while True:
                 (rx, tx, xx) = select.select([self.sock], [], [self.sock])
@@ -164,6 +327,8 @@ class StreamingInterface(object):
                     break
                 sock, addr = self.sock.accept()
                 # print "connect",addr
+                if not self.connections:
+                    core.events.subscribe(self, self.EVENT_KINDS)
                 self.connections.append(StreamingConnection(self, sock))
         except:
             traceback.print_exc()
@@ -171,30 +336,24 @@ class StreamingInterface(object):
         core.simlog.debug("No longer listening for remote interfaces")
 
     def _disconnect(self, con):
-        try:
-            con.sock.close()
-        except:
-            pass
+        core.world.remove_producer(con)
+        con.close()
         try:
             self.connections.remove(con)
             # print "con closed"
         except:
             pass
+        if not self.connections:
+            core.events.unsubscribe(self)
 
-    def send(self, msg, connections=None):
+    def send(self, msg, connections=None, droppable=False):
         if connections is None:
             connections = self.connections
         elif not isinstance(connections, list):
             connections = [connections]
-        r = json.dumps(msg, default=repr) + "\n"
-        bad = []
+        encoded = {}
         for c in connections:
-            try:
-                c.send_raw(r)
-            except:
-                bad.append(c)
-        for c in bad:
-            self._disconnect(c)
+            c.send_message(msg, droppable, encoded)
 
     def send_console(self, text):
         # self.send({'type':'console','msg':text})
@@ -233,6 +392,8 @@ class StreamingInterface(object):
         })
 
     def packet(self, n1, n2, packet, duration, drop=False):
+        if not self.connections:
+            return
         m = {
             "type": "packet",
             "node1": n1,
@@ -244,7 +405,7 @@ class StreamingInterface(object):
         }
         # if color is not None:
         #  m['stroke'] = color
-        self.send(m)
+        self.send(m, droppable=True)
 
     def send_link_down(self, srcid, sport, dstid, dport):
         self.send({
@@ -10,61 +10,92 @@ project.  Also, pieces of the implementation will change during grading.
 from __future__ import print_function
 import sys
 import sim
+import sim.bus
 import copy
+import collections
+import gc
+import heapq
+import itertools
+import math
+import os
+import pickle
+import random
+import signal
+import struct
 import threading
 try:
-    import queue as Queue
+    from threading import get_ident as _get_ident
 except ImportError:
-    import Queue
+    from thread import get_ident as _get_ident
 import time
-import weakref
 
 import logging
 import traceback
 
 
 class EventLogger(logging.Handler):
-    _attributes = [
-        'created',
-        'filename',
-        'funcName',
-        'levelname',
-        'levelno',
-        'lineno',
-        'module',
-        'msecs',
-        'name',
-        'pathname',
-        'process',
-        'processName',
-        'relativeCreated',
-        'thread',
-        'threadName',
-        'args',
-    ]
-
-    # def __init__ (self, *args, **kw):
-    #  logging.Handler.__init__(self, *args, **kw)
+    """
+    Sends log records to the current World's log viewers.
+
+    The only thing done here is rendering the message (its arguments might
+    change by later).  Turning the record into what a viewer gets (see
+    sim.bus.log_message()) happens on the event bus's delivery thread, and
+    if no viewer is subscribed, the record is just ignored.
+
+    """
 
     def emit(self, record):
-        o = {'message': self.format(record)}
-        o['type'] = 'log'
-        if True:
-            for attr in self._attributes:
-                if hasattr(record, attr):
-                    o[attr] = getattr(record, attr)
-            fmt = self.formatter
-            if fmt is None:
-                fmt = logging._defaultFormatter
-            o['asctime'] = fmt.formatTime(record)
-            if record.exc_info:
-                o['exc_info'] = [str(record.exc_info[0]),
-                                 str(record.exc_info[1]),
-                                 traceback.format_tb(record.exc_info[2], 1)]
-                o['exc'] = traceback.format_exception(*record.exc_info)
-        events.send_log(o)
+        w = current_world()
+        if w is None or not w.events.wants_log:
+            return
+        try:
+            record.message = record.getMessage()
+        except Exception:
+            self.handleError(record)
+            return
+        w.events.send_log(record)
+
+
+class JitterStats(object):
+    """
+    Keeps track of how late events get dispatched in real time.
+
+    Lateness is in wall-clock seconds.  There's one of these at
+    world.jitter.
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0  # For Welford's running variance
+        self.max = 0.0
+
+    def add(self, lateness):
+        self.count += 1
+        delta = lateness - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (lateness - self.mean)
+        if lateness > self.max:
+            self.max = lateness
+
+    @property
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.count - 1))
+
+    def __str__(self):
+        return ("%i events dispatched, lateness mean %.3fms stddev %.3fms "
+                "max %.3fms" % (self.count, self.mean * 1000,
+                                self.stddev * 1000, self.max * 1000))
+
 
 class EventCounter(logging.Handler):
+    """Counts records, in all (count) and per World (World.error_count)."""
 
     def __init__(self, *args, **kw):
         logging.Handler.__init__(self, *args, **kw)
@@ -72,6 +103,9 @@ class EventCounter(logging.Handler):
 
     def emit(self, record):
         self.count += 1
+        w = current_world()
+        if w is not None:
+            w.error_count += 1
 
 if sim.config.console_log:
     logging.basicConfig(level=logging.DEBUG)
@@ -90,7 +124,9 @@ userlog = logging.getLogger("user")
 class stdout_wrapper:
     def write(self, s):
         sys.__stdout__.write(s)
-        events.send_console(s)
+        w = current_world()
+        if w is not None:
+            w.events.send_console(s)
 
 
 if sim.config.gui_log:
@@ -118,6 +154,9 @@ if sim.config.gui_log:
 
 def _catch(_f, *_args, **_kw):
     try:
+        profiler = current_world().profiler
+        if profiler is not None:
+            return profiler.call(_f, _args, _kw)
         return _f(*_args, **_kw)
     except Exception:
         args = ", ".join(str(v) for v in _args)
@@ -138,28 +177,35 @@ class Timer(object):
 
     def __init__(self, seconds, target=None, args=(), kw={}, passSelf=False):
         self.seconds = seconds
-        world.doLater(seconds, self.timeout)
         self.func = target
         self.stopped = False
         self.args = list(args)
         self.kw = dict(kw)
         if passSelf:
             self.args = [self] + self.args
+        self._slot = None  # Belongs to the World's TimerWheel
+        self.world = current_world()
+        self.world.add_timer(self, seconds)
 
     def cancel(self):
         self.stopped = True
+        self.world.cancel_timer(self)
 
     def timer(self):
         if self.func:
-            self.func(*self.args, **self.kw)
+            profiler = self.world.profiler
+            if profiler is None:
+                self.func(*self.args, **self.kw)
+            else:
+                profiler.call(self.func, self.args, self.kw)
 
     def timeout(self):
         if self.stopped:
             return
         try:
             rv = self.timer()
-            if rv is not False:
-                world.doLater(self.seconds, self.timeout)
+            if rv is not False and not self.stopped:
+                self.world.add_timer(self, self.seconds)
         except Exception:
             simlog.exception("Exception while executing a timer")
             # traceback.print_exc()
@@ -183,22 +229,171 @@ class OneShot(Timer):
             # traceback.print_exc()
 
 
-world = None
-events = None
+class PathTrie(object):
+    """
+    Interns the paths packets take.
 
+    Each path (a sequence of entities) gets an integer ID, with 0 being the
+    empty path.  A path is stored as the ID of the path without its last
+    hop plus that last hop, so paths share their common prefixes, and
+    extending a path by a hop is a dictionary lookup.  Packets just keep
+    the ID of their path so far (see api.Packet.trace).
 
-class World(object):
-    """Mostly this dispatches events in the simulator."""
+    """
 
     def __init__(self):
-        global world
-        world = self
+        self._parent = [None]  # Path ID -> ID of path minus its last hop
+        self._last = [None]  # Path ID -> last hop
+        self._ids = {}  # (Parent path ID, hop) -> path ID
+
+    def __len__(self):
+        return len(self._last)
+
+    def extend(self, path, hop):
+        """Returns the ID of the given path with the given hop added."""
+        key = (path, hop)
+        i = self._ids.get(key)
+        if i is None:
+            i = len(self._last)
+            self._ids[key] = i
+            self._parent.append(path)
+            self._last.append(hop)
+        return i
+
+    def get(self, path):
+        """Returns the path with the given ID as a (new) list."""
+        hops = []
+        while path:
+            hops.append(self._last[path])
+            path = self._parent[path]
+        hops.reverse()
+        return hops
+
+
+class _Context(threading.local):
+    world = None
+
+
+_context = _Context()
+_last_world = None  # The World made most recently
+
+
+def current_world():
+    """
+    Returns the World the calling thread is working with.
+
+    That's the one whose simulation it's running, or that it made or
+    activate()d last.  Threads which have none get the World made most
+    recently, so with just one World, it's always that one.
+
+    """
+    return _context.world or _last_world
+
+
+class _Current(object):
+    """
+    Stands in for the current World (see current_world()) or an attribute
+    of it, so that core.world, core.events, etc. always mean the current
+    World's.
+    """
+    __slots__ = ('_attr', )
+
+    def __init__(self, attr=None):
+        object.__setattr__(self, '_attr', attr)
+
+    def _get(self):
+        w = current_world()
+        if w is None or self._attr is None:
+            return w
+        return getattr(w, self._attr)
+
+    def __getattr__(self, name):
+        # (Same as _get(), but this gets called a lot)
+        w = _context.world or _last_world
+        if self._attr is not None:
+            w = getattr(w, self._attr)
+        return getattr(w, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+    def __bool__(self):
+        return bool(self._get())
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        return len(self._get())
+
+    def __contains__(self, item):
+        return item in self._get()
+
+    def __repr__(self):
+        return repr(self._get())
+
+
+world = _Current()
+events = _Current('events')  # The World's sim.bus.EventBus
+interface = _Current('interface')  # The remote interface (see sim.comm)
+registry = _Current('registry')  # The World's EntityRegistry
+
+
+class World(object):
+    """
+    Mostly this dispatches events in the simulator.
+
+    Each World has its own Entities, remote interface, and clock, so
+    there can be several of them (one after another, or at the same time in
+    different threads).  Making a World makes it the current one for the
+    thread that made it (see current_world()).
 
-        self.queue = Queue.PriorityQueue()
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        suffix = "." + name if name else ""
+        self.simlog = logging.getLogger("simulator" + suffix)
+        self.userlog = logging.getLogger("user" + suffix)
+        self.error_count = 0  # Errors logged while we were current
+
+        self.registry = EntityRegistry()
+        self.events = self._make_event_bus()
+        self.update_log_level()
+        self.interface = None
+        self._branch = False  # Whether we're a branch of a Checkpoint
+
+        global _last_world
+        _last_world = self
+        self.activate()
+
+        self.queue = None  # Created by start()
         self._thread = None
-        self._count = 0
+        self._thread_ident = None
+        self._count = itertools.count()
         self.ended = False
 
+        # The queue isn't thread-safe.  Events scheduled from other threads
+        # are dropped in here, and the simulation thread moves them into the
+        # queue.  The run loops wait on _cond, which is notified when that
+        # happens.
+        self._inbox = collections.deque()
+        self._cond = threading.Condition()
+
+        # Things outside the simulation thread which may still schedule
+        # events (see add_producer()).
+        self._producers = set()
+
+        # Timers live in a TimerWheel (created by start()) rather than the
+        # queue.  The queue just has an event for the earliest one, whose
+        # (time, sequence number) is _timer_event_at, and maybe some
+        # superseded ones, which do nothing.  _timer_events has the (time,
+        # sequence number) of each.
+        self._timers = None
+        self._timer_event_at = None
+        self._timer_events = set()
+        # (timer, seconds, length of the prelist then) added before start()
+        self._pretimers = []
+
         # When the world isn't running, items are put in the prelist.
         # They're added to the queue when the world is started, and
         # their start times are adjusted so that they are relative to
@@ -216,20 +411,48 @@ class World(object):
 
         self._time = 0.0  # For virtual time
         self.max_timeout = 10
+        self.event_count = 0  # Events dispatched
+
+        # For real time.  Time passes at _speed times the wall clock, and
+        # was _time_base at the wall clock time _wall_base.
+        self._wall_base = self._time_base = time.time()
+        self._speed = 1.0
+        self.jitter = JitterStats()
+
+        self.trace_paths = PathTrie()
+        # How packets made while this World is current are traced (see
+        # _set_trace_mode()).  Sampling has its own random numbers, so it
+        # doesn't disturb anyone else's.
+        self._trace_path = 0  # Path ID new packets start with, or None
+        self._trace_sample_rate = None
+        self._trace_random = random.Random().random
 
         self.trace = False
+        self.profiler = None  # A sim.profiler.Profiler, if profiling
+        from sim.metrics import Metrics
+        self.metrics = Metrics(self)
+        if sim.config.metrics:
+            self.metrics.record(sim.config.metrics,
+                                sim.config.metrics_interval)
+        if sim.config.profile:
+            from sim.profiler import Profiler
+            self.profiler = Profiler(self, sim.config.profile)
+        self.recorder = None  # A sim.recorder.Recorder, if recording
+        if sim.config.record:
+            from sim.recorder import Recorder
+            self.recorder = Recorder(self, sim.config.record)
         self._running = True
 
         self.virtual_time = False
 
         import sim.api as api
-        api.netvis._a = lambda: _getEntByName(self.a)
-        api.netvis._b = lambda: _getEntByName(self.b)
-        api.netvis._selected = lambda: _getEntByName(self.selected)
-        api.netvis._info = (lambda: self._info, lambda v: self._set_info(v))
+        api.netvis._a = lambda: _getEntByName(world.a)
+        api.netvis._b = lambda: _getEntByName(world.b)
+        api.netvis._selected = lambda: _getEntByName(world.selected)
+        api.netvis._info = (lambda: world._info, lambda v: world._set_info(v))
 
         def set_function_callback(which, callback):
-            self.function_handler[which] = callback
+            world.function_handler[which] = callback
 
         api.netvis.set_function_callback = set_function_callback
 
@@ -237,26 +460,63 @@ class World(object):
             def selection_callback(update, selected, unselected, a, b):
                 callback(update)
 
-            self.function_handler['selection'] = selection_callback
+            world.function_handler['selection'] = selection_callback
 
         api.netvis.set_selection_callback = set_selection_callback
 
-        sim.api.current_time = lambda: self.time
+        self._set_trace_mode(sim.config.trace_mode,
+                             sim.config.trace_sample_rate)
 
-        global events
         should_sleep = sim.config.interactive
         if sim.config.remote_interface == "tcp":
-            import sim.comm_tcp as interface
+            import sim.comm_tcp as iface_module
         elif sim.config.remote_interface == "udp":
-            import sim.comm_udp as interface
+            import sim.comm_udp as iface_module
         else:
-            import sim.comm as interface
+            import sim.comm as iface_module
             should_sleep = False
-        events = interface.interface()
+        # The interface subscribes itself to the events it wants
+        self.interface = iface_module.interface()
         if should_sleep:
             # Sleep a sec to allow remote to possibly connect
             time.sleep(1)
 
+    def activate(self):
+        """Makes this the current World for the calling thread."""
+        _context.world = self
+
+    def update_log_level(self):
+        """
+        Works out log_level, the lowest level of log message anything wants.
+
+        That's the lowest level of a handler which would get messages from
+        userlog (counting the one for log viewers only if one is
+        subscribed), or userlog's own level if that's higher.  Entities'
+        log() throws away anything below it before doing any work.
+
+        This is called when the simulation starts and when log viewers come
+        and go, so call it if you change logging's setup after that.
+        """
+        levels = []
+        logger = self.userlog
+        while logger is not None:
+            for h in logger.handlers:
+                if isinstance(h, EventLogger) and not self.events.wants_log:
+                    continue
+                levels.append(h.level)
+            if not logger.propagate:
+                break
+            logger = logger.parent
+        level = min(levels) if levels else logging.CRITICAL + 1
+        self.log_level = max(level, self.userlog.getEffectiveLevel())
+
+    def _make_event_bus(self):
+        events = sim.bus.EventBus(thread_init=self.activate,
+                                  on_change=self.update_log_level)
+        for kind, rate in sim.config.event_rate_limits.items():
+            events.set_rate_limit(kind, rate)
+        return events
+
     @property
     def virtual_time(self):
         return self._get_time == self._get_time_virtual
@@ -264,16 +524,46 @@ class World(object):
     @virtual_time.setter
     def virtual_time(self, virtual_time):
         extra = "_virtual" if virtual_time else "_real"
-        for attr in "_get_time run".split():
+        for attr in "_get_time run _real_doLater".split():
             prefix = "" if attr.startswith("_") else "_"
             setattr(self, attr, getattr(self, prefix + attr + extra))
 
+    def _set_trace_mode(self, mode, sample_rate):
+        if mode == "full":
+            self._trace_path = 0
+            self._trace_sample_rate = None
+        elif mode == "sampled":
+            self._trace_path = None
+            self._trace_sample_rate = float(sample_rate)
+        elif mode == "off":
+            self._trace_path = None
+            self._trace_sample_rate = None
+        else:
+            raise RuntimeError("No such trace mode as '%s'" % (mode, ))
+
     def stop(self):
         self._running = False
+        with self._cond:
+            self._cond.notify()
+
+    @property
+    def speed(self):
+        """How fast real time passes relative to the wall clock."""
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        speed = float(speed)
+        assert speed > 0
+        now = self.time
+        self._wall_base = time.time()
+        self._time_base = now
+        self._speed = speed
+        with self._cond:
+            self._cond.notify()  # Whatever it's waiting for is now sooner/later
 
     def _get_time_real(self):
-        # if self._start_time is None:
-        return time.time()
+        return self._time_base + (time.time() - self._wall_base) * self._speed
 
     def _get_time_virtual(self):
         return self._time
@@ -287,7 +577,8 @@ class World(object):
         if f:
             f()
         else:
-            simlog.info("Function '%s' is not assigned", function_number)
+            self.simlog.info("Function '%s' is not assigned",
+                             function_number)
 
     def do_selection(self,
                      update=None,
@@ -302,13 +593,129 @@ class World(object):
         if f:
             f(update, selected, unselected, a, b)
 
-    def _real_doLater(_self, _seconds, _method, *_args, **_kw):
+    def _real_doLater_real(_self, _seconds, _method, *_args, **_kw):
         t = _self.time + _seconds
         _self._real_doAt(t, _method, *_args, **_kw)
 
+    def _real_doLater_virtual(_self, _seconds, _method, *_args, **_kw):
+        # Same as _real_doAt, but this is the most common way to schedule
+        # something, so it's worth avoiding the extra call.
+        event = (_self._time + _seconds, next(_self._count), _method, _args,
+                 _kw)
+        if _get_ident() == _self._thread_ident:
+            _self.queue.push(event)
+        else:
+            _self._post(event)
+
     def _real_doAt(_self, _t, _method, *_args, **_kw):
-        _self.queue.put((_t, _self._count, _method, _args, _kw))
-        _self._count += 1
+        event = (_t, next(_self._count), _method, _args, _kw)
+        if _get_ident() == _self._thread_ident:
+            _self.queue.push(event)
+        else:
+            _self._post(event)
+
+    def _post(self, event):
+        """Hands an event from some other thread to the simulation thread."""
+        self._inbox.append(event)
+        with self._cond:
+            self._cond.notify()
+
+    def add_producer(self, producer):
+        """
+        Registers something outside the simulation thread as a source of events.
+
+        In virtual time, the simulation ends as soon as there's nothing left
+        to do -- unless there are producers, in which case it waits up to
+        max_timeout (wall clock) seconds for one of them to schedule
+        something.  producer can be any hashable object (a connection, a
+        thread, ...); call remove_producer() with it when it's done.
+
+        """
+        self._producers.add(producer)
+
+    def remove_producer(self, producer):
+        self._producers.discard(producer)
+        with self._cond:
+            self._cond.notify()  # Maybe nobody's left; let the loop check
+
+    def add_timer(self, timer, seconds):
+        """Arms a Timer so that its timeout() is called after seconds."""
+        if self._thread is None:
+            self._pretimers.append((timer, seconds, len(self._prelist)))
+        elif _get_ident() == self._thread_ident:
+            self._arm_timer(timer, self.time + seconds)
+        else:
+            self.doLater(0, self._arm_timer, timer, self.time + seconds)
+
+    def cancel_timer(self, timer):
+        """Disarms a Timer."""
+        if self._thread is None:
+            pass  # It's stopped, so it won't be armed by start()
+        elif _get_ident() == self._thread_ident:
+            self._timers.remove(timer)
+        else:
+            self.doLater(0, self._timers.remove, timer)
+
+    def _arm_timer(self, timer, deadline):
+        if timer.stopped:
+            return
+        self._timers.add(timer, deadline, next(self._count))
+        if (self._timer_event_at is None
+                or (deadline, timer._seq) < self._timer_event_at):
+            self._schedule_timers(timer)
+
+    def _schedule_timers(self, timer):
+        """
+        Makes sure there's an event to fire timers when timer expires.
+
+        The event gets the timer's own sequence number, so it's dispatched
+        in just the order the timer would have been if it were an event.
+
+        """
+        key = self._timer_event_at = (timer._deadline, timer._seq)
+        if key in self._timer_events:
+            return  # Superseded once, but still queued
+        self._timer_events.add(key)
+        event = key + (self._fire_timers, (key, ), {})
+        if _get_ident() == self._thread_ident:
+            self.queue.push(event)
+        else:
+            self._post(event)
+
+    def _fire_timers(self, key):
+        self._timer_events.discard(key)
+        if key != self._timer_event_at:
+            # An earlier timer got this event superseded
+            self.event_count -= 1  # So it wasn't really an event
+            return
+        due = self._timers.expire(self.time)
+        # Each timer counts as an event, rather than this one
+        self.event_count += len(due) - 1
+        for timer in due:
+            timer.timeout()
+        timer = self._timers.next_timer()
+        if timer is None:
+            self._timer_event_at = None
+        else:
+            self._schedule_timers(timer)
+
+    def _drain_inbox(self):
+        inbox = self._inbox
+        push = self.queue.push
+        while inbox:
+            push(inbox.popleft())
+
+    @property
+    def queue_depth(self):
+        """How many events are waiting to be dispatched."""
+        depth = len(self._inbox)
+        if self.queue is not None:
+            depth += len(self.queue)
+        return depth
+
+    def _make_queue(self):
+        import sim.scheduler
+        return sim.scheduler.make_event_queue(sim.config.scheduler)
 
     @property
     def info(self):
@@ -317,7 +724,7 @@ class World(object):
     def _set_info(self, text):
         self._info = str(text)
         # TODO: Restore on reconnect
-        events.send_info(self._info)
+        self.events.send_info(self._info)
 
     @info.setter
     def info(self, text):
@@ -325,19 +732,169 @@ class World(object):
 
     def start(self, threaded=True):
         assert self._thread is None
-        simlog.info("Starting simulation.")
+        self.simlog.info("Starting simulation.")
+        self.update_log_level()
 
-        for a, b, c, d in self._prelist:
+        self.queue = self._make_queue()
+        import sim.scheduler
+        self._timers = sim.scheduler.TimerWheel(sim.config.timer_resolution,
+                                                self.time)
+
+        if threaded:
+            self._thread = threading.Thread(target=self._run_thread)
+            self._thread.daemon = True
+        else:
+            self._thread = threading.current_thread()
+            self._thread_ident = self._thread.ident
+            self.activate()
+
+        # Anything from the prelist goes through the inbox (if we're in
+        # virtual time) and gets picked up when the run loop starts.
+        # Timers are armed in between, in the order they were created, so
+        # they get the same order relative to the rest as if they were in
+        # the prelist too.
+        pretimers = self._pretimers
+        self._pretimers = []
+        for i, (a, b, c, d) in enumerate(self._prelist):
+            while pretimers and pretimers[0][2] <= i:
+                timer, seconds, _ = pretimers.pop(0)
+                self._arm_timer(timer, self.time + seconds)
             self._real_doLater(a, b, *c, **d)
         self._prelist = []
+        for timer, seconds, _ in pretimers:
+            self._arm_timer(timer, self.time + seconds)
+
+        # No more need for the prelist
+        self.doLater = self._real_doLater
+        self.doAt = self._real_doAt
 
         if threaded:
-            self._thread = threading.Thread(target=self.run)
-            self._thread.daemon = True
             self._thread.start()
         else:
-            self._thread = threading.current_thread()
             self.run()
+            self._run_ended()
+
+    def _run_thread(self):
+        self._thread_ident = _get_ident()
+        self.activate()
+        self.run()
+        self._run_ended()
+
+    def _run_ended(self):
+        if self.profiler is not None:
+            self.profiler.run_ended()
+        self.metrics.run_ended()
+        if self.recorder is not None:
+            self.recorder.run_ended()
+        if self._branch:
+            # A branch's process only exists to run its simulation, so it
+            # mustn't go back to whatever the original went on to do
+            self.events.flush()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0 if self.error_count == 0 else 1)
+
+    def checkpoint(self):
+        """
+        Makes a Checkpoint of the simulation as it is right now.
+
+        Must be called from within the simulation (e.g., from a tasklet or
+        a timer), and needs os.fork().  Returns the Checkpoint -- here, and
+        again in each branch restored from it, where its branch is set.
+
+        """
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Checkpoints need os.fork()")
+        if self._thread_ident != _get_ident():
+            raise RuntimeError("Checkpoints can only be made from within "
+                               "the simulation")
+        now = self.time
+        sys.stdout.flush()
+        sys.stderr.flush()
+        requests_r, requests_w = os.pipe()
+        replies_r, replies_w = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(requests_r)
+            os.close(replies_w)
+            return Checkpoint(self, now, pid, requests_w, replies_r)
+
+        # We're the frozen copy
+        os.close(requests_w)
+        os.close(replies_r)
+        branch = self._keep_checkpoint(requests_r, replies_w)
+
+        # We're a new branch
+        self._become_branch(now)
+        return Checkpoint(self, now, branch=branch)
+
+    def _keep_checkpoint(self, requests, replies):
+        """
+        Forks off branches for a Checkpoint when asked to.
+
+        Runs in the checkpoint's frozen copy.  Only returns in a new branch
+        (what it returns being what restore() was given).
+
+        """
+        branches = set()
+        status = 0
+        try:
+            while True:
+                try:
+                    request = _recv_message(requests)
+                except EOFError:
+                    break  # Closed, or the original is gone
+                if request[0] == "restore":
+                    pid = os.fork()
+                    if not pid:
+                        os.close(requests)
+                        os.close(replies)
+                        return request[1]
+                    branches.add(pid)
+                    _send_message(replies, pid)
+                elif request[0] == "wait":
+                    pid = request[1]
+                    if pid not in branches:
+                        _send_message(replies, None)
+                        continue
+                    _, st = os.waitpid(pid, 0)
+                    branches.discard(pid)
+                    if os.WIFEXITED(st):
+                        _send_message(replies, os.WEXITSTATUS(st))
+                    else:
+                        _send_message(replies, -os.WTERMSIG(st))
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        # Nobody's left to wait for any branches still running
+        for pid in branches:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        os._exit(status)
+
+    def _become_branch(self, now):
+        """Gets a newly forked branch ready to carry on the simulation."""
+        self._branch = True
+        # The threads feeding us events were left behind in the original
+        self._producers.clear()
+        # And the remote interface is the original's
+        self.events = self._make_event_bus()
+        self.update_log_level()
+        import sim.comm
+        self.interface = sim.comm.NullInterface()
+        if self.profiler is not None and self.profiler.filename:
+            # Don't overwrite the original's profile
+            self.profiler.filename += ".%i" % (os.getpid(), )
+        self.metrics.branched()
+        if self.recorder is not None:
+            self.recorder.branched()
+        if not self.virtual_time:
+            # Pick up where the checkpoint was, not where the clock is now
+            self._wall_base = time.time()
+            self._time_base = now
 
     def do(self, _method, *args, **kw):
         self.doLater(0, _method, *args, **kw)
@@ -373,42 +930,32 @@ class World(object):
         event.wait()
 
     def _run_real(self):
-        timeout = None
-        waiting = Queue.PriorityQueue()
+        simlog = self.simlog
+        inbox = self._inbox
+        cond = self._cond
+        queue = self.queue
+        jitter = self.jitter
 
         try:
             while self._running:
-                try:
-                    t = self.time
-                    while not waiting.empty():
-                        o = waiting.get()
-                        if o[0] <= t:
-                            self.queue.put(o)
-                            timeout = None
-                        else:
-                            waiting.put(o)
-                            o = waiting.get()
-                            waiting.put(o)
-                            timeout = o[0] - t
-                            break
-                    #print("World waiting for",timeout)
-
-                    o = self.queue.get(True, 5 if timeout is None else timeout)
-                except Exception:
-                    # print("empty")
-                    continue
-
+                if inbox:
+                    self._drain_inbox()
+                o = queue.peek()
                 t = self.time
-                if o[0] > t:
-                    # Hasn't expired yet...
-                    # print("recycle")
-                    waiting.put(o)
-                    o = waiting.get()
-                    waiting.put(o)
-                    timeout = o[0] - t
+                if o is None or o[0] > t:
+                    # Sleep until it's due or something new shows up (which
+                    # might be due sooner)
+                    with cond:
+                        if not inbox and self._running:
+                            if o is None:
+                                cond.wait()
+                            else:
+                                cond.wait((o[0] - t) / self._speed)
                     continue
-                # Expired
-                timeout = None
+                queue.pop()
+                self.event_count += 1
+                jitter.add((t - o[0]) / self._speed)
+
                 if self.trace:
                     if hasattr(o[2], "__self__"):
                         print(
@@ -418,7 +965,10 @@ class World(object):
                     else:
                         print(o[2], end='')
                     print(o[3], o[4] if len(o[4]) else '')
-                o[2](*o[3], **o[4])
+                if self.profiler is None:
+                    o[2](*o[3], **o[4])
+                else:
+                    self.profiler.dispatch(o)
                 self._post_hook()
         except KeyboardInterrupt:
             pass
@@ -428,33 +978,48 @@ class World(object):
             simlog.exception("Simulation ended due to exception")
         finally:
             simlog.debug("Simulation ended")
+            simlog.debug("Dispatch timing: %s", jitter)
             self.ended = True
 
     def _run_virtual(self):
-        max_timeout = 10
+        max_timeout = self.max_timeout
         timeout = max_timeout
         warned = False
-        simlog = sim.core.simlog
+        simlog = self.simlog
+        inbox = self._inbox
+        cond = self._cond
+        pop = self.queue.pop
 
         try:
             while self._running:
+                if inbox:
+                    self._drain_inbox()
                 try:
-                    o = self.queue.get(True, 1)
-                    timeout = max_timeout
-                    warned = False
-                except Exception:
-                    timeout -= 1
-                    if timeout < 0:
+                    o = pop()
+                except IndexError:
+                    if not self._producers and not inbox:
+                        # Nothing to do and nobody to give us anything
                         simlog.debug("No more events.  Simulation over.")
                         break
-                    elif not warned and timeout < (max_timeout / 2):
-                        warned = True
-                        simlog.debug("Waiting for events...")
+                    # See if another thread gives us something
+                    with cond:
+                        if not inbox:
+                            cond.wait(1)
+                    if inbox:
+                        timeout = max_timeout
+                        warned = False
+                    else:
+                        timeout -= 1
+                        if timeout < 0:
+                            simlog.debug("No more events.  Simulation over.")
+                            break
+                        elif not warned and timeout < (max_timeout / 2):
+                            warned = True
+                            simlog.debug("Waiting for events...")
                     continue
-                except Exception:
-                    break
 
                 self._time = o[0]
+                self.event_count += 1
                 if self.trace:
                     if hasattr(o[2], "__self__"):
                         print(
@@ -464,7 +1029,10 @@ class World(object):
                     else:
                         print(o[2], end='')
                     print(o[3], o[4] if len(o[4]) else '')
-                o[2](*o[3], **o[4])
+                if self.profiler is None:
+                    o[2](*o[3], **o[4])
+                else:
+                    self.profiler.dispatch(o)
                 self._post_hook()
         except KeyboardInterrupt:
             pass
@@ -480,6 +1048,112 @@ class World(object):
         pass
 
 
+_message_length = struct.Struct("<I")
+
+
+def _send_message(fd, obj):
+    data = pickle.dumps(obj, 2)
+    data = _message_length.pack(len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _read_exactly(fd, n):
+    data = b""
+    while len(data) < n:
+        more = os.read(fd, n - len(data))
+        if not more:
+            raise EOFError()
+        data += more
+    return data
+
+
+def _recv_message(fd):
+    n = _message_length.unpack(_read_exactly(fd, _message_length.size))[0]
+    return pickle.loads(_read_exactly(fd, n))
+
+
+class Checkpoint(object):
+    """
+    A frozen copy of a simulation, which can be restored any number of times.
+
+    Made by World.checkpoint().  The copy is a process forked off at the
+    time, which just waits.  Each restore() has it fork a "branch", which
+    carries on the simulation from the checkpoint with its own
+    copy-on-write copy of all of it -- the event queue, timers, Entities,
+    cables and packets in flight.  In the branch, World.checkpoint()
+    returns again, with branch set to whatever was passed to restore().
+
+    A branch's process ends when its simulation does, with exit status 0
+    if it logged no errors (see wait()).  Branches don't have a remote
+    interface.
+
+    """
+
+    def __init__(self, world, time, pid=None, requests=None, replies=None,
+                 branch=None):
+        self.world = world
+        self.time = time  # When it was made
+        self.branch = branch
+        self._pid = pid  # The frozen copy
+        self._requests = requests
+        self._replies = replies
+
+    @property
+    def restored(self):
+        """True in a branch (as opposed to where the checkpoint was made)."""
+        return self._pid is None
+
+    def _call(self, *request):
+        if self._requests is None:
+            raise RuntimeError("Checkpoint can't be restored here")
+        _send_message(self._requests, request)
+        return _recv_message(self._replies)
+
+    def restore(self, branch=None):
+        """Starts a branch.  Returns its process ID (see wait())."""
+        return self._call("restore", branch)
+
+    def wait(self, pid):
+        """Waits for a branch to end.  Returns its exit status."""
+        return self._call("wait", pid)
+
+    def close(self):
+        """Gets rid of the frozen copy, and kills unwaited-for branches."""
+        if self._requests is None:
+            return
+        os.close(self._requests)
+        os.close(self._replies)
+        self._requests = self._replies = None
+        os.waitpid(self._pid, 0)
+
+
+_cable = None  # sim.cable, once _cables() has imported it
+
+
+def _cables():
+    # sim.cable imports us, so we can't import it up top
+    global _cable
+    if _cable is None:
+        import sim.cable as _cable
+    return _cable
+
+
+def _make_cable(c, default_cable_type, latency, le, lp, re, rp):
+    """Makes (if needed) and sets up one end of a link (see linkTo())."""
+    cable = _cable or _cables()
+    if c is None:
+        c = default_cable_type
+    # Add latency if the c is BasicCable - Kaifei
+    # Chen(kaifei@berkeley.edu)
+    if isinstance(c, type) and issubclass(c, cable.BasicCable):
+        c = c(latency=latency)
+    elif isinstance(c, type) and issubclass(c, cable.Cable):
+        c = c()
+    c.initialize(le, lp, re, rp)
+    return c
+
+
 class TopoNode(object):
     """A container for an Entity that connects it to other Entities and
     provides some infrastructure functionality."""
@@ -505,6 +1179,12 @@ class TopoNode(object):
         self.ports = [None] * numPorts
         self.growPorts = growPorts
         self.entity = None
+        self.world = current_world()
+
+        # Counters (see sim.metrics)
+        self.packets_rx = 0  # Counted by the cables
+        self.packets_tx = 0
+        self.ttl_expired = 0
 
     def linkTo(self, topoEntity, cable=None, fillEmpty=True, latency=None):
         """
@@ -519,30 +1199,10 @@ class TopoNode(object):
         None)); b.linkTo(a, (D, None)) and  a.linkTo(b, (C, D))
 
         """
-        from sim.cable import Cable, BasicCable
-        default_cable_type = self.DEFAULT_CABLE_TYPE or BasicCable
-        if cable is None:
-            cable = (default_cable_type, default_cable_type)
-        elif isinstance(cable, Cable):
-            raise RuntimeError(
-                "Can't share a single Cable in both directions!")
-        elif isinstance(cable, tuple):
-            pass
-#    elif isinstance(cable, BidirectionalCable):
-        else:
-            cable = (cable, cable)
+        default_cable_type, cable = self._cable_pair(cable)
 
         def fixCableEnd(c, le, lp, re, rp):
-            if c is None:
-                c = default_cable_type
-            # Add latency if the c is BasicCable - Kaifei
-            # Chen(kaifei@berkeley.edu)
-            if isinstance(c, type) and issubclass(c, BasicCable):
-                c = c(latency=latency)
-            elif isinstance(c, type) and issubclass(c, Cable):
-                c = c()
-            c.initialize(le, lp, re, rp)
-            return c
+            return _make_cable(c, default_cable_type, latency, le, lp, re, rp)
 
         topoEntity = topoOf(topoEntity)
 
@@ -558,8 +1218,11 @@ class TopoNode(object):
         remotePort = getPort(topoEntity)
         localPort = getPort(self)
 
-        world.doLater(0, events.send_link_up, self.entity.name, localPort,
-                      topoEntity.entity.name, remotePort)
+        world = self.world
+        events = world.events
+        if events.wants_link_up:
+            world.doLater(0, events.send_link_up, self.entity.name, localPort,
+                          topoEntity.entity.name, remotePort)
 
         if cable[0] is not None:
             c = fixCableEnd(cable[0], self, localPort, topoEntity, remotePort)
@@ -576,8 +1239,31 @@ class TopoNode(object):
 
         return (localPort, remotePort)
 
+    def _cable_pair(self, cable):
+        """
+        Works out what cables to use from linkTo()'s cable argument.
+
+        Returns the default cable type and a (forward, reverse) pair.
+
+        """
+        cables = _cable or _cables()
+        default_cable_type = self.DEFAULT_CABLE_TYPE or cables.BasicCable
+        if cable is None:
+            cable = (default_cable_type, default_cable_type)
+        elif isinstance(cable, cables.Cable):
+            raise RuntimeError(
+                "Can't share a single Cable in both directions!")
+        elif isinstance(cable, tuple):
+            pass
+#    elif isinstance(cable, BidirectionalCable):
+        else:
+            cable = (cable, cable)
+        return default_cable_type, cable
+
     def unlinkTo(self, topoEntity, right_now=False):
         topoEntity = topoOf(topoEntity)
+        world = self.world
+        events = world.events
 
         def goDown(index):
             port = self.ports[index]  # Actually the cable
@@ -627,8 +1313,10 @@ class TopoNode(object):
         if self.ENABLE_TTL:
             packet.ttl -= 1
             if packet.ttl == 0:
-                simlog.warning("Expired %s / %s", packet,
-                               ','.join(e.name for e in packet.trace))
+                self.ttl_expired += 1
+                self.world.simlog.warning(
+                    "Expired %s / %s", packet,
+                    ','.join(e.name for e in packet.trace))
                 return
 
         if (packet.src is None):  # or (packet.src is NullAddress):
@@ -644,30 +1332,69 @@ class TopoNode(object):
         if flood:
             ports = [p for p in range(0, len(self.ports)) if p not in ports]
 
+        duplicate = None
+        sent = 0
         for remote in ports:
             if remote >= 0 and remote < len(self.ports):
                 remote = self.ports[remote]
                 if remote is not None:
-                    p = _duplicate_packet(packet)
-                    remote.transfer(p)
+                    if duplicate is None:
+                        duplicate = _packet_copier(packet)
+                    remote.transfer(duplicate())
+                    sent += 1
+        self.packets_tx += sent
+
+
+# Types whose own constructors copy them faster than copy.copy() does
+_plain_types = frozenset([dict, list, set])
+
+# Packet fields which copies share even though they're mutable
+_shared_packet_fields = frozenset(['_color_cell'])
+
+
+def _packet_copier(p):
+    """
+    Returns a function which makes copies of p.
+
+    Flooding makes lots of copies of the same packet, so this figures out
+    which of its fields need copying just once.  Copies share everything
+    except containers, which a handler is allowed to change: the packet
+    type's own fields, and the colors and trace, but only if they've been
+    made (see api.Packet).  Colors which haven't been made yet are shared
+    through a "cell", so whichever copy is looked at first picks the
+    color for all of them.
+
+    """
+    state = p.__dict__
+    if state.get('_outer_color') is None and p._color_cell is None:
+        p._color_cell = [None]
+    cls = type(p)
+    # (field, value, how to copy it)
+    mutable = [(k, v, type(v) if type(v) in _plain_types else copy.copy)
+               for k, v in state.items()
+               if isinstance(v, (dict, list, set))
+               and k not in _shared_packet_fields]
+
+    def duplicate():
+        n = cls.__new__(cls)
+        d = n.__dict__
+        d.update(state)
+        for k, v, copier in mutable:
+            d[k] = copier(v)
+        return n
+
+    return duplicate
 
 
 def _duplicate_packet(p):
-    n = type(p).__new__(type(p))
-    for k, v in vars(p).items():
-        if isinstance(v, (dict, tuple, list, set)):
-            setattr(n, k, copy.copy(v))
-        else:
-            setattr(n, k, v)
-    return n
+    return _packet_copier(p)()
 
 
 _builtin = sys.modules.get('__builtin__', sys.modules.get('builtins')).__dict__
 
 
 def _getByName(name):
-    # Ugh.
-    return topoOf(_builtin.get(name, None))
+    return registry.get(name)
 
 
 def _getEntByName(name):
@@ -677,7 +1404,76 @@ def _getEntByName(name):
     return t.entity
 
 
-topo = weakref.WeakValueDictionary()
+class EntityRegistry(object):
+    """
+    Keeps track of the Entities (well, their TopoNodes) by name.
+
+    Each one also gets a dense integer ID, in the order they're created,
+    which is its entity_id.  So things can be kept in arrays indexed by
+    ID.  IDs aren't reused, so a removed Entity just leaves a None.
+
+    """
+
+    def __init__(self):
+        self._ids = {}  # Name -> ID
+        self.nodes = []  # ID -> TopoNode (or None if removed)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def add(self, name, node):
+        """Adds a TopoNode with the given name, returning its ID."""
+        if name in self._ids:
+            raise NameError(str(name) + " already exists")
+        i = len(self.nodes)
+        self._ids[name] = i
+        self.nodes.append(node)
+        return i
+
+    def remove(self, name):
+        i = self._ids.pop(name, None)
+        if i is not None:
+            self.nodes[i] = None
+
+    def get_id(self, name):
+        return self._ids.get(name)
+
+    def get(self, name):
+        """Returns the TopoNode with the given name (or None)."""
+        i = self._ids.get(name)
+        if i is None:
+            return None
+        return self.nodes[i]
+
+    def node_of(self, entity):
+        """
+        Returns the TopoNode of an Entity (or None if it isn't in here).
+
+        Entities of other Worlds have IDs too, which may be past the end of
+        nodes, or belong to some other Entity here.
+
+        """
+        i = getattr(entity, 'entity_id', None)
+        if i is None or i >= len(self.nodes):
+            return None
+        node = self.nodes[i]
+        if node is None or node.entity is not entity:
+            return None
+        return node
+
+    def values(self):
+        """Returns a list of all the TopoNodes."""
+        return [n for n in self.nodes if n is not None]
+
+
+def _use_builtins():
+    """Should Entities be put in the builtins so they can be used by name?"""
+    if sim.config.entity_builtins is None:
+        return sim.config.interactive
+    return sim.config.entity_builtins
 
 
 def CreateEntity(_name, _kind, *args, **kw):
@@ -689,9 +1485,34 @@ def CreateEntity(_name, _kind, *args, **kw):
     containing the new Entity.
 
     """
-    if _name in _builtin:
-        raise NameError(str(_name) + " already exists")
     import sim.api as api
+    world = current_world()
+    e = _new_entity(_name, _kind, args, kw)
+    kind = "host" if isinstance(e, api.HostEntity) else "switch"
+    if world.events.wants_entity_up:
+        world.do(world.events.send_entity_up, e.name, kind)
+    world.simlog.info(e.name + " up!")
+    return e
+
+
+# Entity.log() level -> logging level
+_log_levels = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL,
+    'exception': logging.ERROR,
+}
+
+
+def _new_entity(_name, _kind, args, kw):
+    """Does CreateEntity()'s work except for announcing the new Entity."""
+    world = current_world()
+    registry = world.registry
+    use_builtins = _use_builtins()
+    if _name in registry or (use_builtins and _name in _builtin):
+        raise NameError(str(_name) + " already exists")
 
     e = _kind(*args, **kw)
     setattr(e, 'name', _name)
@@ -703,10 +1524,7 @@ def CreateEntity(_name, _kind, *args, **kw):
 
     te = TopoNode(numPorts, growPorts)
     te.entity = e
-
-    kind = "host" if isinstance(e, api.HostEntity) else "switch"
-    world.do(events.send_entity_up, e.name, kind)
-    simlog.info(e.name + " up!")
+    e.entity_id = registry.add(_name, te)
 
     # Add working methods
     setattr(e, 'get_port_count', lambda: len(te.ports))
@@ -718,21 +1536,26 @@ def CreateEntity(_name, _kind, *args, **kw):
 
     def set_debug(*args):
         #print(e.name + ':', ' '.join((str(s) for s in args)))
-        world.do(events.set_debug, e.name, ' '.join((str(s) for s in args)))
+        events = world.events  # (Which a checkpoint branch replaces)
+        if events.wants_debug:
+            world.do(events.set_debug, e.name,
+                     ' '.join((str(s) for s in args)))
 
     setattr(e, 'set_debug', set_debug)
 
     def log(msg, *args, **kw):
-        if getattr(e, 'NO_LOG', False):
-            return
-        level = getattr(e, 'LOG_LEVEL', "debug")
-        if "level" in kw:
-            level = kw["level"].lower()
-            del kw["level"]
-        if level not in ['debug', 'info', 'warning', 'error', 'critical',
-                         'exception']:
+        level = kw.pop("level", None)
+        if level is None:
+            level = getattr(e, 'LOG_LEVEL', "debug")
+        else:
+            level = level.lower()
+        levelno = _log_levels.get(level)
+        if levelno is None:
             level = "debug"
-        func = getattr(userlog, level)
+            levelno = logging.DEBUG
+        if levelno < world.log_level or getattr(e, 'NO_LOG', False):
+            return  # Nothing wants it
+        func = getattr(world.userlog, level)
         msg = "%s:" + msg  # Black magic
         args = tuple([e.name] + list(args))
         func(msg, *args, **kw)
@@ -744,24 +1567,156 @@ def CreateEntity(_name, _kind, *args, **kw):
 
     def remove():
         te.disconnect()
-        world.do(events.send_entity_down, _name)
-        try:
+        world.do(world.events.send_entity_down, _name)
+        registry.remove(_name)
+        if _builtin.get(_name) is e:
             del _builtin[_name]
-        except Exception:
-            pass
 
     setattr(e, 'remove', remove)
 
-    # Make a global variable with the right name
-    #sys.modules['__main__'].__dict__[_name] = e
-    #sim.__dict__[_name] = e
-    _builtin[_name] = e
+    if use_builtins:
+        # Make a global variable with the right name
+        #sys.modules['__main__'].__dict__[_name] = e
+        #sim.__dict__[_name] = e
+        _builtin[_name] = e
 
-    # This is so we can find its TopoNode
-    topo[e] = te
     return e
 
 
+def build_topology(nodes, edges, latencies=None, cables=None):
+    """
+    Creates lots of Entities and links between them all at once.
+
+    This is the same as calling create() for each node and then linkTo()
+    for each edge (and the Entities get the same handle_link_up() calls),
+    but it's a lot quicker for big topologies.
+
+    nodes is a list with an element for each node, which is either an
+    Entity which already exists or a (name, kind) pair, where kind is an
+    Entity subclass to create one of.  edges is a list of (i, j) pairs of
+    indexes into nodes.  latencies and cables are optional lists with an
+    element for each edge, which are like linkTo()'s latency and cable
+    arguments (None gets the default).
+
+    Returns a list of the Entities.
+
+    """
+    # All the objects made here are long-lived, so having the garbage
+    # collector keep looking through them just wastes time.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _build_topology(nodes, edges, latencies, cables)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _build_topology(nodes, edges, latencies, cables):
+    import sim.api as api
+    world = current_world()
+    events = world.events
+
+    entities = []
+    created = []
+    for n in nodes:
+        if isinstance(n, api.Entity):
+            entities.append(n)
+        else:
+            name, kind = n
+            e = _new_entity(name, kind, (), {})
+            entities.append(e)
+            created.append(e)
+    tnodes = [topoOf(e) for e in entities]
+
+    # Give every node all the ports it could need up front.  Like linkTo(),
+    # each link takes the lowest empty port, and a port stays empty (and
+    # gets used by the next link) if its direction of the link has no cable.
+    degree = [0] * len(tnodes)
+    for a, b in edges:
+        degree[a] += 1
+        degree[b] += 1
+    free = []  # Per node, a heap of empty ports
+    lengths = []  # Per node, how many ports linkTo() would have made
+    for te, d in zip(tnodes, degree):
+        ports = te.ports
+        lengths.append(len(ports))
+        holes = [i for i, p in enumerate(ports) if p is None] if ports else []
+        if d > len(holes):
+            n = len(ports)
+            ports.extend([None] * (d - len(holes)))
+            holes.extend(range(n, len(ports)))
+        free.append(holes)  # Sorted, so already a heap
+
+    link_ups = []  # (handle_link_up, port, latency) in the order to call them
+    gui_links = [] if events.wants_link_up else None
+    for k, (a, b) in enumerate(edges):
+        src = tnodes[a]
+        dst = tnodes[b]
+        assert src is not dst
+        dst_port = heapq.heappop(free[b])
+        if dst_port >= lengths[b]:
+            assert src.growPorts  # (Sic; same as linkTo())
+            lengths[b] = dst_port + 1
+        src_port = heapq.heappop(free[a])
+        if src_port >= lengths[a]:
+            assert src.growPorts
+            lengths[a] = src_port + 1
+
+        latency = latencies[k] if latencies is not None else None
+        default_cable_type, cable = src._cable_pair(
+            cables[k] if cables is not None else None)
+
+        if gui_links is not None:
+            gui_links.append((src.entity.name, src_port, dst.entity.name,
+                              dst_port))
+        if cable[0] is not None:
+            c = _make_cable(cable[0], default_cable_type, latency,
+                            src, src_port, dst, dst_port)
+            src.ports[src_port] = c
+            link_ups.append((src.entity.handle_link_up, src_port, c.latency))
+        else:
+            heapq.heappush(free[a], src_port)
+        if cable[1] is not None:
+            c = _make_cable(cable[1], default_cable_type, latency,
+                            dst, dst_port, src, src_port)
+            dst.ports[dst_port] = c
+            link_ups.append((dst.entity.handle_link_up, dst_port, c.latency))
+        else:
+            heapq.heappush(free[b], dst_port)
+
+    for te, n in zip(tnodes, lengths):
+        del te.ports[n:]  # Ports we turned out not to need
+
+    if created and events.wants_entity_up:
+        world.do(_send_entity_ups, created)
+    if gui_links:
+        world.do(_send_link_ups, gui_links)
+    if link_ups:
+        world.do(_call_link_ups, link_ups)
+
+    world.simlog.info("Built %i new entities and %i links", len(created),
+                      len(edges))
+    return entities
+
+
+def _send_entity_ups(entities):
+    import sim.api as api
+    for e in entities:
+        kind = "host" if isinstance(e, api.HostEntity) else "switch"
+        events.send_entity_up(e.name, kind)
+
+
+def _send_link_ups(links):
+    for link in links:
+        events.send_link_up(*link)
+
+
+def _call_link_ups(link_ups):
+    for handle_link_up, port, latency in link_ups:
+        _catch(handle_link_up, port, latency)
+
+
 def topoOf(entity):
     """
     Get TopoNode that contains entity.
@@ -772,5 +1727,4 @@ def topoOf(entity):
     if isinstance(entity, TopoNode):
         # We were actually passed a topo object
         return entity
-    t = topo.get(entity, None)
-    return t
+    return registry.node_of(entity)
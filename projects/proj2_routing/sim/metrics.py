@@ -0,0 +1,247 @@
+"""
+Counters for what's going on in a simulation.
+
+Every World has a Metrics (World.metrics), which gathers up the counters
+kept by the World, its Entities, and the cables between them:
+
+  world   events (dispatched so far), queue_depth (events waiting to be),
+          timers, entities
+  entity  rx and tx (packets received and sent), ttl_expired
+  cable   packets, bytes, dropped (all of them, and then by why:
+          dropped_full for not fitting in the queue, dropped_lost for
+          UnreliableCable losses, dropped_down for being queued when the
+          link went down), queue_depth, max_queue_depth
+
+The counters themselves are just attributes of the World, the TopoNodes
+and the cables, which count as they go, so they cost next to nothing.  A
+Metrics only looks at them when asked.
+
+At the interactive console, metrics.show() prints them.  For example:
+  metrics.show("cables", sort="dropped", top=10)
+
+With --metrics=FILE, a snapshot of all of them is written to FILE every
+--metrics-interval (default 1) seconds of simulated time, and when the
+simulation ends.  FILE is JSON lines (an object for each World, Entity or
+cable per snapshot, with time, kind and name), or if it ends with .csv,
+CSV with the columns time, kind, name, metric and value.  Checkpoint
+branches (see api.branch()) each carry on in their own copy of FILE,
+named FILE.<pid>.
+
+"""
+
+import collections
+import csv
+import fnmatch
+import json
+import os
+import sys
+
+_kinds = {
+    "world": "world", "worlds": "world",
+    "entity": "entity", "entities": "entity",
+    "cable": "cable", "cables": "cable",
+}
+
+# (metric, attribute) for cables.  Cables without the attribute (e.g.,
+# DumbCables) don't have the metric.
+_cable_counters = [
+    ("packets", "packets_sent"),
+    ("bytes", "bytes_sent"),
+    ("dropped", "packets_dropped"),
+    ("dropped_full", "dropped_full"),
+    ("dropped_lost", "dropped_lost"),
+    ("dropped_down", "dropped_down"),
+    ("max_queue_depth", "max_queue_depth"),
+]
+
+
+class Metrics(object):
+    """A World's metrics (see the module docs)."""
+
+    def __init__(self, world):
+        self.world = world
+        self.filename = None  # Where we're recording to, if anywhere
+        self.interval = None
+        self._file = None
+        self._csv = None  # A csv.writer if we're writing CSV
+        self._last_time = None  # Of the last snapshot recorded
+        self._token = None  # Identifies the current recording's _tick()s
+
+    def collect(self, kinds=("world", "entity", "cable")):
+        """Yields (kind, name, OrderedDict of metrics) for everything."""
+        world = self.world
+        kinds = set(_kinds[k] for k in kinds)
+        if "world" in kinds:
+            m = collections.OrderedDict()
+            m["events"] = world.event_count
+            m["queue_depth"] = world.queue_depth
+            if world._timers is not None:
+                m["timers"] = len(world._timers)
+            else:
+                m["timers"] = len(world._pretimers)
+            m["entities"] = len(world.registry)
+            yield "world", world.name or "world", m
+        if "entity" in kinds:
+            for te in world.registry.values():
+                m = collections.OrderedDict()
+                m["rx"] = te.packets_rx
+                m["tx"] = te.packets_tx
+                m["ttl_expired"] = te.ttl_expired
+                yield "entity", te.entity.name, m
+        if "cable" in kinds:
+            for te in world.registry.values():
+                for port, c in enumerate(te.ports):
+                    if c is None:
+                        continue
+                    m = collections.OrderedDict()
+                    for metric, attr in _cable_counters:
+                        value = getattr(c, attr, None)
+                        if value is not None:
+                            m[metric] = value
+                    queue = getattr(c, "queue", None)
+                    if queue is not None:
+                        m["queue_depth"] = len(queue)
+                    name = "%s:%i->%s:%i" % (te.entity.name, port,
+                                             c.dstEnt.name, c.dstPort)
+                    yield "cable", name, m
+
+    def query(self, kind="world", match=None, sort=None, top=None):
+        """
+        Returns a list of (name, metrics) of one kind.
+
+        match is a shell-style pattern (like "s1*") the names have to
+        match, sort is a metric to sort by (biggest first), and top is how
+        many to return (all by default).
+
+        """
+        if kind not in _kinds:
+            raise RuntimeError("No such kind of metrics as '%s'" % (kind, ))
+        rows = [(name, m) for _, name, m in self.collect([kind])
+                if match is None or fnmatch.fnmatchcase(name, match)]
+        if sort is not None:
+            rows.sort(key=lambda row: row[1].get(sort, 0), reverse=True)
+        if top is not None:
+            rows = rows[:top]
+        return rows
+
+    def show(self, kind="world", match=None, sort=None, top=20):
+        """Prints a table of metrics (see query())."""
+        rows = self.query(kind, match, sort, top)
+        if not rows:
+            print("No %s metrics" % (_kinds[kind], ))
+            return
+        columns = []
+        for _, m in rows:
+            for metric in m:
+                if metric not in columns:
+                    columns.append(metric)
+        width = max(len(name) for name, _ in rows)
+        print("%-*s %s" % (width, "", " ".join("%12s" % (c, )
+                                               for c in columns)))
+        for name, m in rows:
+            print("%-*s %s" % (width, name,
+                               " ".join("%12s" % (m.get(c, "-"), )
+                                        for c in columns)))
+
+    def snapshot(self):
+        """Returns a list of records of everything's metrics right now."""
+        now = self.world.time
+        records = []
+        for kind, name, m in self.collect():
+            record = collections.OrderedDict()
+            record["time"] = now
+            record["kind"] = kind
+            record["name"] = name
+            record.update(m)
+            records.append(record)
+        return records
+
+    def record(self, filename, interval=1.0):
+        """
+        Starts recording snapshots to filename every interval seconds.
+
+        Seconds of simulated time, that is.  It's CSV if filename ends with
+        .csv, and JSON lines otherwise.
+
+        """
+        self.stop_recording()
+        self.filename = filename
+        self.interval = float(interval)
+        self._open("w", filename.lower().endswith(".csv"))
+        if self._csv is not None:
+            self._csv.writerow(["time", "kind", "name", "metric", "value"])
+            self._file.flush()
+        self._last_time = None
+        self._token = object()
+        self.world.doLater(self.interval, self._tick, self._token)
+
+    def _open(self, mode, is_csv):
+        if is_csv:
+            if sys.version_info[0] < 3:
+                self._file = open(self.filename, mode + "b")
+            else:
+                self._file = open(self.filename, mode, newline="")
+            self._csv = csv.writer(self._file)
+        else:
+            self._file = open(self.filename, mode)
+            self._csv = None
+
+    def stop_recording(self):
+        if self._file is None:
+            return
+        self._write()
+        self._file.close()
+        self._file = None
+        self._csv = None
+        self._token = None
+        self.filename = None
+
+    def _write(self):
+        now = self.world.time
+        if now == self._last_time:
+            return
+        self._last_time = now
+        records = self.snapshot()
+        if self._csv is not None:
+            for r in records:
+                for metric, value in r.items():
+                    if metric not in ("time", "kind", "name"):
+                        self._csv.writerow([r["time"], r["kind"], r["name"],
+                                            metric, value])
+        else:
+            for r in records:
+                self._file.write(json.dumps(r) + "\n")
+        self._file.flush()
+
+    def _tick(self, token):
+        if token is not self._token:
+            return  # Stopped (or restarted) since this was scheduled
+        self._write()
+        world = self.world
+        # Don't keep a simulation which is otherwise done going forever
+        if world.queue_depth or world._producers:
+            world.doLater(self.interval, self._tick, token)
+
+    def branched(self):
+        """
+        Carries on recording in a newly forked branch.
+
+        It goes to a copy of the file so far, named FILE.<pid>.
+
+        """
+        if self._file is None:
+            return
+        # Everything's been flushed, so this is where the file was when we
+        # were forked.  (The original may have written more since.)
+        size = self._file.tell()
+        # Closing it doesn't write anything, and the original has its own.
+        self._file.close()
+        with open(self.filename, "rb") as f:
+            data = f.read(size)
+        self.filename = "%s.%i" % (self.filename, os.getpid())
+        with open(self.filename, "wb") as f:
+            f.write(data)
+        self._open("a", self._csv is not None)
+
+    def run_ended(self):
+        self.stop_recording()
@@ -0,0 +1,237 @@
+"""
+Finds out what the simulator spends its time on.
+
+When a World has a Profiler (World.profiler, set up by --profile), every
+event it dispatches is timed, and so is every call it makes into an
+Entity's handlers (handle_rx(), handle_link_up(), handle_link_down(), and
+timer callbacks like handle_timer()).  Time is added up by:
+
+  event     What the event called (e.g., BasicCable.deliver)
+  entity    Which Entity's handlers were running
+  type      The Entity's class
+  handler   Which handler it was
+  packet    What class of packet handle_rx() was given
+
+Times are cumulative (they include any handlers called from inside).  It
+also keeps track of how late events are dispatched: in real time, that's
+how far behind its scheduled time the simulation is; in virtual time, it's
+how long (in wall clock time) an event waited behind others scheduled for
+the same time.
+
+report() gives all that as text, sorted with the most time first, and
+collapsed() gives the time in each stack of event, entity type, entity,
+handler and packet class in the "collapsed" format flame graph tools
+(e.g., flamegraph.pl or speedscope) read.  With --profile=NAME, they're
+written to NAME.txt and NAME.collapsed when the simulation ends.
+
+Profiling slows the simulator down somewhat, so the times are mostly
+useful in comparison to each other.
+
+"""
+
+import collections
+import math
+import time
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+def _callback_name(f):
+    owner = getattr(f, "__self__", None)
+    name = getattr(f, "__name__", None)
+    if name is None:
+        return type(f).__name__
+    if owner is not None and not isinstance(owner, type):
+        return "%s.%s" % (type(owner).__name__, name)
+    return name
+
+
+class Profiler(object):
+    """Collects where the time goes (see the module docs)."""
+
+    def __init__(self, world, filename=None):
+        self.world = world
+        self.filename = filename  # Where to save when the World's done
+
+        # Name -> [calls, seconds]
+        self.events = collections.defaultdict(lambda: [0, 0.0])
+        self.entities = collections.defaultdict(lambda: [0, 0.0])
+        self.types = collections.defaultdict(lambda: [0, 0.0])
+        self.handlers = collections.defaultdict(lambda: [0, 0.0])
+        self.packets = collections.defaultdict(lambda: [0, 0.0])
+        self.stacks = collections.defaultdict(float)  # Stack -> self time
+
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_histogram = collections.Counter()  # Power of 10 -> count
+
+        self._frames = []  # The current stack
+        self._child_time = []  # Time in calls below each frame
+        self._due = None  # Virtual time of the events being dispatched
+        self._due_wall = 0.0  # When we got to it
+
+        import sim.api as api
+        import sim.core as core
+        self._entity_type = api.Entity
+        self._catch = core._catch
+
+    def _lag(self, scheduled, now):
+        world = self.world
+        if world.virtual_time:
+            if scheduled != self._due:
+                self._due = scheduled
+                self._due_wall = now
+            lag = now - self._due_wall
+        else:
+            lag = max(0.0, (world.time - scheduled) / world.speed)
+        self.lag_count += 1
+        self.lag_total += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+        if lag <= 0:
+            self.lag_histogram[None] += 1
+        else:
+            self.lag_histogram[int(math.floor(math.log10(lag)))] += 1
+
+    def _push(self, frame):
+        self._frames.append(frame)
+        self._child_time.append(0.0)
+
+    def _pop(self, elapsed):
+        child_time = self._child_time.pop()
+        self.stacks[";".join(self._frames)] += elapsed - child_time
+        self._frames.pop()
+        if self._child_time:
+            self._child_time[-1] += elapsed
+
+    def dispatch(self, event):
+        """Dispatches an event from the World's queue."""
+        scheduled, _, f, args, kw = event
+        if f is self._catch and args:
+            name = _callback_name(args[0])  # What it's catching for
+        else:
+            name = _callback_name(f)
+        self._push(name)
+        start = _clock()
+        self._lag(scheduled, start)
+        try:
+            f(*args, **kw)
+        finally:
+            elapsed = _clock() - start
+            self._pop(elapsed)
+            stats = self.events[name]
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def call(self, f, args=(), kw=None, packet=None):
+        """Calls one of an Entity's handlers (or some other function)."""
+        entity = getattr(f, "__self__", None)
+        if not isinstance(entity, self._entity_type):
+            entity = None
+        handler = getattr(f, "__name__", None) or type(f).__name__
+        labels = []
+        if entity is not None:
+            entity_type = type(entity).__name__
+            labels += [entity_type, str(entity.name)]
+        labels.append(handler)
+        if packet is not None:
+            packet_type = type(packet).__name__
+            labels.append(packet_type)
+        self._push(";".join(labels))
+
+        start = _clock()
+        try:
+            return f(*args, **(kw or {}))
+        finally:
+            elapsed = _clock() - start
+            self._pop(elapsed)
+
+            if entity is not None:
+                for stats in (self.entities[str(entity.name)],
+                              self.types[entity_type]):
+                    stats[0] += 1
+                    stats[1] += elapsed
+                stats = self.handlers[handler]
+                stats[0] += 1
+                stats[1] += elapsed
+            if packet is not None:
+                stats = self.packets[packet_type]
+                stats[0] += 1
+                stats[1] += elapsed
+
+    def report(self, top=30):
+        """Returns a text report, showing at most top rows per table."""
+        total = sum(t for _, t in self.events.values())
+        count = sum(c for c, _ in self.events.values())
+        lines = ["Profile: %i events dispatched in %.3fs" % (count, total)]
+        if self.lag_count:
+            lines.append("Lag: mean %s, max %s" %
+                         (_us(self.lag_total / self.lag_count),
+                          _us(self.lag_max)))
+            for power in sorted(self.lag_histogram,
+                                key=lambda p: -1000 if p is None else p):
+                if power is None:
+                    label = "0"
+                else:
+                    label = "< %s" % (_us(10.0 ** (power + 1)), )
+                lines.append("  %12s %10i" %
+                             (label, self.lag_histogram[power]))
+        for title, table in (("event", self.events),
+                             ("entity", self.entities),
+                             ("entity type", self.types),
+                             ("handler", self.handlers),
+                             ("packet type", self.packets)):
+            if not table:
+                continue
+            lines.append("")
+            lines.append("By %s:" % (title, ))
+            lines.append("  %10s %10s %6s %10s  %s" %
+                         ("calls", "seconds", "%", "mean", title))
+            rows = sorted(table.items(), key=lambda kv: (-kv[1][1], kv[0]))
+            for name, (calls, seconds) in rows[:top]:
+                lines.append("  %10i %10.4f %6.1f %10s  %s" %
+                             (calls, seconds,
+                              100.0 * seconds / total if total else 0,
+                              _us(seconds / calls), name))
+            if len(rows) > top:
+                lines.append("  (and %i more)" % (len(rows) - top, ))
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self):
+        """
+        Returns the stacks in collapsed format.
+
+        Each line is a stack, with frames separated by ;, and then the
+        number of microseconds spent in (just) the last frame.
+
+        """
+        lines = []
+        for stack, seconds in sorted(self.stacks.items()):
+            us = int(round(seconds * 1e6))
+            if us > 0:
+                lines.append("%s %i" % (stack.replace(" ", "_"), us))
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename=None):
+        """Writes filename.txt and filename.collapsed."""
+        filename = filename or self.filename
+        with open(filename + ".txt", "w") as f:
+            f.write(self.report())
+        with open(filename + ".collapsed", "w") as f:
+            f.write(self.collapsed())
+        self.world.simlog.info("Wrote profile to %s.txt and %s.collapsed",
+                               filename, filename)
+
+    def run_ended(self):
+        if self.filename:
+            self.save()
+
+
+def _us(seconds):
+    """Formats a short time nicely."""
+    if seconds >= 1:
+        return "%.2fs" % (seconds, )
+    if seconds >= 1e-3:
+        return "%.2fms" % (seconds * 1e3, )
+    return "%.1fus" % (seconds * 1e6, )
@@ -0,0 +1,390 @@
+"""
+Records simulations to files so they can be watched later.
+
+With --record=FILE, a Recorder writes everything a remote interface like
+NetVis would have been told about -- Entities and links going up and
+down, packets (including dropped ones), and log messages -- to FILE, along
+with the simulated time each happened at.  Unlike a remote interface, it
+never drops anything, and it costs little: it gets events straight from
+the World's event bus (synchronously; see sim.bus), and writes them as
+small binary records into a memory-mapped file.  Names are written once
+and referred to by number after that.
+
+replay.py plays recordings back to NetVis, and Recording reads them.
+
+The file format (all little-endian) is:
+
+  header    "SIMREC1\\n", and then the offset of the index (8 bytes), or
+            0 if the recording wasn't closed (e.g., the simulator died)
+  records   Each is a header -- kind (1 byte), length of the payload (4
+            bytes), simulated time (8-byte double) -- and a payload.
+            After the last one, there's either the end of the file or
+            zeros (in which case the kind is 0).
+
+The payloads of the kinds of record are:
+
+  NAME         ID (4 bytes), name (UTF-8).  Names the ID.
+  ENTITY_UP    ID (4), whether it's a switch (1)
+  ENTITY_DOWN  ID (4)
+  LINK_UP      ID (4), port (2), other ID (4), other port (2)
+  LINK_DOWN    Same as LINK_UP
+  PACKET       Sending ID (4), receiving ID (4), latency in seconds (4-byte
+               float), stroke and fill colors (4 bytes each; RGBA from 0
+               to 255), whether it was dropped (1)
+  LOG          Level (1), logger name's ID (4), wall clock time (8), message
+               (UTF-8)
+  INDEX        Simulated time (8), offset (8), ... for the first record in
+               every index_interval seconds of simulated time, so playing
+               from a time can start near it.
+  TOPOLOGY     Offset (8), ... of every NAME, ENTITY and LINK record, so
+               the topology as of a time can be worked out without reading
+               all of the packets and log messages before it.  This comes
+               right after the INDEX, and is the last record.
+
+"""
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+
+import sim.bus
+import sim.comm as comm
+import sim.wire as wire
+
+MAGIC = b"SIMREC1\n"
+
+NAME = 1
+ENTITY_UP = 2
+ENTITY_DOWN = 3
+LINK_UP = 4
+LINK_DOWN = 5
+PACKET = 6
+LOG = 7
+INDEX = 8
+TOPOLOGY = 9
+
+# Kinds of records which make up the topology (see TOPOLOGY)
+_topology_kinds = frozenset([NAME, ENTITY_UP, ENTITY_DOWN, LINK_UP,
+                             LINK_DOWN])
+
+_file_header = struct.Struct("<8sQ")  # Magic, offset of the index
+_record = struct.Struct("<BId")  # Kind, payload length, simulated time
+_id = struct.Struct("<I")
+_entity_up = struct.Struct("<IB")
+_link = struct.Struct("<IHIH")
+_packet = struct.Struct("<IIf4B4B?")
+_log = struct.Struct("<BId")  # Level, logger name ID, wall clock time
+_index_entry = struct.Struct("<dQ")
+_offset = struct.Struct("<Q")
+
+_chunk_size = 1 << 20  # The file starts this big and doubles as needed
+
+# The sim.bus event kinds which get recorded
+EVENT_KINDS = ['entity_up', 'entity_down', 'link_up', 'link_down', 'packet',
+               'log']
+
+
+def _utf8(s):
+    if not isinstance(s, (bytes, type(u""))):
+        s = str(s)
+    if not isinstance(s, bytes):
+        s = s.encode("utf-8", "replace")
+    return s
+
+
+class Recorder(comm.NullInterface):
+    """Records a World's events to a file (see the module docs)."""
+
+    def __init__(self, world, filename, index_interval=1.0):
+        self.world = world
+        self.filename = filename
+        self.index_interval = float(index_interval)
+        self.index = []  # (simulated time, offset) (see INDEX)
+        self.topology = []  # Offsets (see TOPOLOGY)
+        self.records = 0  # Written so far
+        self._next_index = None  # Time of the next index entry
+        self._names = {}  # Name -> ID
+        self._lock = threading.RLock()  # Log messages come from anywhere
+        self._file = None
+        self._map = None
+        self._size = 0
+        self._pos = 0
+        self._open(filename, _file_header.pack(MAGIC, 0))
+        world.events.subscribe(self, EVENT_KINDS, synchronous=True)
+
+    def _open(self, filename, data):
+        self._file = open(filename, "w+b")
+        self._map = None
+        self._size = 0
+        self._pos = 0
+        self._put(data)
+
+    def _grow(self, need):
+        size = max(self._size * 2, _chunk_size)
+        while size < self._pos + need:
+            size *= 2
+        if self._map is not None:
+            self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._size = size
+
+    def _put(self, data):
+        end = self._pos + len(data)
+        if end > self._size:
+            self._grow(len(data))
+        self._map[self._pos:end] = data
+        self._pos = end
+
+    def _write(self, kind, payload):
+        # Call with _lock held
+        if self._map is None:
+            return  # Closed
+        t = self.world.time
+        if self._next_index is None or t >= self._next_index:
+            self.index.append((t, self._pos))
+            self._next_index = ((math.floor(t / self.index_interval) + 1)
+                                * self.index_interval)
+        if kind in _topology_kinds:
+            self.topology.append(self._pos)
+        self._put(_record.pack(kind, len(payload), t) + payload)
+        self.records += 1
+
+    def _name_id(self, name):
+        # Call with _lock held
+        name_id = self._names.get(name)
+        if name_id is None:
+            name_id = self._names[name] = len(self._names)
+            self._write(NAME, _id.pack(name_id) + _utf8(name))
+        return name_id
+
+    def send_entity_up(self, name, kind):
+        with self._lock:
+            self._write(ENTITY_UP, _entity_up.pack(self._name_id(name),
+                                                   kind == "switch"))
+
+    def send_entity_down(self, name):
+        with self._lock:
+            self._write(ENTITY_DOWN, _id.pack(self._name_id(name)))
+
+    def send_link_up(self, srcid, sport, dstid, dport):
+        with self._lock:
+            self._write(LINK_UP, _link.pack(self._name_id(srcid), sport,
+                                            self._name_id(dstid), dport))
+
+    def send_link_down(self, srcid, sport, dstid, dport):
+        with self._lock:
+            self._write(LINK_DOWN, _link.pack(self._name_id(srcid), sport,
+                                              self._name_id(dstid), dport))
+
+    def packet(self, n1, n2, packet, duration, drop=False):
+        colors = (list(wire.color_bytes(packet.outer_color)) +
+                  list(wire.color_bytes(packet.inner_color)))
+        with self._lock:
+            self._write(PACKET, _packet.pack(
+                self._name_id(n1), self._name_id(n2), duration,
+                *(colors + [bool(drop)])))
+
+    def send_log(self, record):
+        if record.exc_info or getattr(record, "message", None) is None:
+            message = sim.bus.log_message(record)['message']
+        else:
+            message = record.message
+        with self._lock:
+            self._write(LOG, _log.pack(min(record.levelno, 255),
+                                       self._name_id(record.name),
+                                       record.created) + _utf8(message))
+
+    def branched(self):
+        """Carries on in a newly forked branch, in a copy of the file."""
+        with self._lock:
+            data = self._map[:self._pos]
+            # The original still has the file, so just let go of it
+            self._map.close()
+            self._file.close()
+            self.filename += ".%i" % (os.getpid(), )
+            self._open(self.filename, data)
+        self.world.events.subscribe(self, EVENT_KINDS, synchronous=True)
+
+    def close(self):
+        """Writes the indexes and finishes the file."""
+        with self._lock:
+            if self._map is None:
+                return
+            self.world.events.unsubscribe(self)
+            index_offset = self._pos
+            self._write(INDEX, b"".join([_index_entry.pack(t, offset)
+                                         for t, offset in self.index]))
+            self._write(TOPOLOGY, b"".join([_offset.pack(offset)
+                                            for offset in self.topology]))
+            _file_header.pack_into(self._map, 0, MAGIC, index_offset)
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._pos)
+            self._file.close()
+        self.world.simlog.info("Recorded %i events to %s", self.records,
+                               self.filename)
+
+    def run_ended(self):
+        self.close()
+
+
+class Recording(object):
+    """
+    A recording made by a Recorder, for reading.
+
+    names has the name for each ID in the NAME records read so far.  index
+    and topology are as in the INDEX and TOPOLOGY records.
+
+    """
+
+    def __init__(self, filename, index_interval=1.0):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset = _file_header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise RuntimeError("%s isn't a recording" % (filename, ))
+        self.names = {}
+        self.complete = index_offset != 0  # Was it closed properly?
+        if self.complete:
+            self.end = index_offset
+            m = self._map
+            _, length, _ = _record.unpack_from(m, index_offset)
+            start = index_offset + _record.size
+            self.index = [_index_entry.unpack_from(m, start + i)
+                          for i in range(0, length, _index_entry.size)]
+            offset = start + length
+            _, length, _ = _record.unpack_from(m, offset)
+            start = offset + _record.size
+            self.topology = [_offset.unpack_from(m, start + i)[0]
+                             for i in range(0, length, _offset.size)]
+        else:
+            # So there are no indexes, and we have to make our own
+            self.end = len(self._map)
+            self.index = []
+            self.topology = []
+            next_index = None
+            for offset, kind, t, _, _ in self._records():
+                if next_index is None or t >= next_index:
+                    self.index.append((t, offset))
+                    next_index = ((math.floor(t / index_interval) + 1)
+                                  * index_interval)
+                if kind in _topology_kinds:
+                    self.topology.append(offset)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _records(self, offset=_file_header.size):
+        """Yields (offset, kind, time, payload start, payload end)."""
+        m = self._map
+        end = self.end
+        while offset + _record.size <= end:
+            kind, length, t = _record.unpack_from(m, offset)
+            start = offset + _record.size
+            if kind == 0 or start + length > end:
+                break  # The rest was never written
+            yield offset, kind, t, start, start + length
+            offset = start + length
+
+    def _decode(self, kind, start, end):
+        """Returns a record as (event kind, arguments), or None."""
+        m = self._map
+        names = self.names
+        if kind == PACKET:
+            v = _packet.unpack_from(m, start)
+            return 'packet', (names[v[0]], names[v[1]], v[2],
+                              [c / 255.0 for c in v[3:7]],
+                              [c / 255.0 for c in v[7:11]], v[11])
+        elif kind == LOG:
+            level, name_id, created = _log.unpack_from(m, start)
+            message = m[start + _log.size:end].decode("utf-8", "replace")
+            return 'log', (level, names[name_id], created, message)
+        elif kind == NAME:
+            name_id, = _id.unpack_from(m, start)
+            names[name_id] = m[start + _id.size:end].decode("utf-8")
+            return None
+        elif kind == ENTITY_UP:
+            name_id, switch = _entity_up.unpack_from(m, start)
+            return 'entity_up', (names[name_id],
+                                 "switch" if switch else "host")
+        elif kind == ENTITY_DOWN:
+            name_id, = _id.unpack_from(m, start)
+            return 'entity_down', (names[name_id], )
+        elif kind in (LINK_UP, LINK_DOWN):
+            a, a_port, b, b_port = _link.unpack_from(m, start)
+            return ('link_up' if kind == LINK_UP else 'link_down',
+                    (names[a], a_port, names[b], b_port))
+        return None  # (Including INDEX and TOPOLOGY)
+
+    def events(self, offset=_file_header.size):
+        """
+        Yields (simulated time, event kind, arguments) from offset on.
+
+        The kinds and arguments are as for the methods of the same names in
+        sim.bus.EventBus, except that packets are (sending name, receiving
+        name, latency, stroke color, fill color, dropped?) and log messages
+        are (level, logger name, wall clock time, message).
+        """
+        decode = self._decode
+        for _, kind, t, start, end in self._records(offset):
+            e = decode(kind, start, end)
+            if e is not None:
+                yield t, e[0], e[1]
+
+    def seek(self, t):
+        """
+        Finds simulated time t in the recording.
+
+        Returns the offset of the first record at or after t (to give to
+        events()), and the topology as of then: the Entities (a dict of
+        name -> "host" or "switch") and the links (a set of (name, port,
+        other name, other port), with the names in order).  Only the
+        records in the topology index before t, and the ones between the
+        nearest index entry before t and t, get read.
+        """
+        m = self._map
+        decode = self._decode
+        entities = {}
+        links = set()
+        for offset in self.topology:
+            kind, length, rt = _record.unpack_from(m, offset)
+            if rt >= t:
+                break
+            start = offset + _record.size
+            e = decode(kind, start, start + length)
+            if e is not None:
+                apply_topology(entities, links, e[0], e[1])
+
+        i = bisect.bisect_right([index_time for index_time, _ in self.index],
+                                t)
+        skip_to = self.index[i - 1][1] if i else _file_header.size
+        for offset, kind, rt, _, _ in self._records(skip_to):
+            if rt >= t:
+                return offset, entities, links
+        return self.end, entities, links
+
+
+def link_key(a, a_port, b, b_port):
+    """Returns a link's (name, port, other name, other port) in order."""
+    if a <= b:
+        return (a, a_port, b, b_port)
+    return (b, b_port, a, a_port)
+
+
+def apply_topology(entities, links, kind, args):
+    """Updates Entities and links (see Recording.seek()) for an event."""
+    if kind == 'entity_up':
+        entities[args[0]] = args[1]
+    elif kind == 'entity_down':
+        entities.pop(args[0], None)
+    elif kind == 'link_up':
+        links.add(link_key(*args))
+    elif kind == 'link_down':
+        links.discard(link_key(*args))
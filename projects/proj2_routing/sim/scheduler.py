@@ -0,0 +1,487 @@
+"""
+Event queues for the simulator's World.
+
+The World keeps its pending events in one of these.  An event is a tuple
+whose first two items are the time at which it should run and a sequence
+number which is unique and increasing, so tuples always compare on those two
+and events at the same time run in the order they were scheduled.
+
+None of these are thread-safe.  The World only touches them from the
+simulation thread (other threads hand their events over through an inbox),
+which is what lets them get away without any locking.
+
+Which one is used is chosen with --scheduler=<name> (see the schedulers
+dict for the names).
+
+"""
+
+import functools
+import heapq
+import math
+
+
+class EventQueue(object):
+    """Base class for event queues."""
+
+    def push(self, event):
+        """Adds an event."""
+        raise NotImplementedError()
+
+    def pop(self):
+        """
+        Removes and returns the earliest event.
+
+        Raises IndexError if there are no events.
+
+        """
+        raise NotImplementedError()
+
+    def peek(self):
+        """Returns the earliest event without removing it (or None)."""
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __bool__(self):
+        return len(self) != 0
+
+    __nonzero__ = __bool__
+
+
+class HeapEventQueue(EventQueue):
+    """
+    A plain binary heap.
+
+    A good choice almost all of the time.
+
+    """
+
+    def __init__(self):
+        self._heap = []
+        # Bind these directly; saves a method call on every event.
+        self.push = functools.partial(heapq.heappush, self._heap)
+        self.pop = functools.partial(heapq.heappop, self._heap)
+
+    def peek(self):
+        return self._heap[0] if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class CalendarEventQueue(EventQueue):
+    """
+    A calendar queue (R. Brown, CACM 31(10), 1988).
+
+    Events are hashed into a ring of "days" (buckets) of fixed width by their
+    time, and dequeueing walks around the calendar a day at a time.  The
+    number of days and their width are re-estimated whenever the queue grows
+    or shrinks by a factor of two, which keeps the number of events per day
+    roughly constant.  The width is also re-estimated whenever a dequeue
+    goes a whole year without finding anything (say, because a burst of
+    events at nearly the same time made the days tiny), rather than leaving
+    every dequeue after that to search all of the days.  This gives O(1)
+    enqueue and dequeue when events are spread fairly evenly in time.
+
+    Each day is a small heap, so lots of events at identical times are still
+    handled gracefully.
+
+    """
+    MIN_BUCKETS = 2
+    SAMPLE_SIZE = 25
+
+    def __init__(self, width=1.0):
+        self._size = 0
+        self._width = float(width)
+        self._buckets = [[] for _ in range(self.MIN_BUCKETS)]
+        self._day = 0  # Absolute (not wrapped) number of the current day
+        self._grow_at = 2 * self.MIN_BUCKETS
+        self._shrink_at = 0
+
+    def _day_of(self, t):
+        return int(math.floor(t / self._width))
+
+    def push(self, event):
+        day = self._day_of(event[0])
+        buckets = self._buckets
+        heapq.heappush(buckets[day % len(buckets)], event)
+        self._size += 1
+        if day < self._day:
+            # Earlier than where we are; back up to it.
+            self._day = day
+        if self._size > self._grow_at:
+            self._resize(2 * len(buckets))
+
+    def pop(self):
+        if not self._size:
+            raise IndexError("pop from empty queue")
+        event = heapq.heappop(self._find())
+        self._size -= 1
+        if self._size < self._shrink_at:
+            self._resize(len(self._buckets) // 2)
+        return event
+
+    def peek(self):
+        if not self._size:
+            return None
+        return self._find()[0]
+
+    def _find(self):
+        """
+        Returns the day (bucket) holding the earliest event, moving to it.
+
+        Call only when the queue isn't empty.
+
+        """
+        buckets = self._buckets
+        n = len(buckets)
+        day = self._day
+        end = day + n
+        while day < end:
+            bucket = buckets[day % n]
+            if bucket and self._day_of(bucket[0][0]) <= day:
+                self._day = day
+                return bucket
+            day += 1
+        # Nothing this year, so the days are too short for how spread out
+        # the events are now.  Re-estimate the width (Brown's rule), which
+        # also puts us on the day of the earliest event.
+        self._resize(n)
+        buckets = self._buckets
+        return buckets[self._day % len(buckets)]
+
+    def __len__(self):
+        return self._size
+
+    def _resize(self, nbuckets):
+        nbuckets = max(nbuckets, self.MIN_BUCKETS)
+        events = [e for b in self._buckets for e in b]
+        self._width = self._estimate_width(events, nbuckets)
+        self._buckets = [[] for _ in range(nbuckets)]
+        self._grow_at = 2 * nbuckets
+        self._shrink_at = nbuckets // 2 if nbuckets > self.MIN_BUCKETS else 0
+        day_of = self._day_of
+        buckets = self._buckets
+        for e in events:
+            buckets[day_of(e[0]) % nbuckets].append(e)
+        for b in buckets:
+            heapq.heapify(b)
+        if events:
+            self._day = day_of(min(events)[0])
+
+    def _estimate_width(self, events, nbuckets):
+        """
+        Picks a new day width based on the spacing of the earliest events.
+
+        This is the heuristic from Brown's paper: three times the average
+        separation, after throwing out separations that are much larger than
+        average.  But it's never so narrow that a year doesn't cover all of
+        the events, since when the earliest events are bunched up, that
+        would leave dequeues searching empty years.  (Days which are too
+        wide only cost a bigger heap per day.)
+
+        """
+        sample = [e[0] for e in heapq.nsmallest(self.SAMPLE_SIZE, events)]
+        gaps = [b - a for a, b in zip(sample, sample[1:])]
+        if not gaps:
+            return self._width
+        avg = sum(gaps) / len(gaps)
+        gaps = [g for g in gaps if g <= 2 * avg]
+        avg = sum(gaps) / len(gaps) if gaps else 0
+        span = (max(events)[0] - sample[0]) / nbuckets
+        width = max(3 * avg, span)
+        if width <= 0:
+            # All the same time; any width works as well as any other.
+            return self._width
+        return width
+
+
+class _Rung(object):
+    """One rung of a ladder queue."""
+    __slots__ = ['start', 'width', 'cur', 'buckets']
+
+    def __init__(self, start, width, nbuckets):
+        self.start = start
+        self.width = width
+        self.cur = 0  # Index of the next bucket to be consumed
+        self.buckets = [[] for _ in range(nbuckets)]
+
+    def index_of(self, t):
+        """Bucket index for time t, or -1 if before this rung."""
+        if t < self.start:
+            return -1
+        i = int((t - self.start) / self.width)
+        return min(i, len(self.buckets) - 1)
+
+
+class LadderEventQueue(EventQueue):
+    """
+    A ladder queue (Tang, Goh and Thng, ACM TOMACS 15(3), 2005).
+
+    New events that are further out than anything seen so far are just
+    appended to an unsorted "top" list.  When the events that have already
+    been sorted run out, the top is spread into a "rung" of buckets; the
+    earliest bucket is either moved into a small sorted "bottom" or, if it
+    holds too many events, spread into a finer rung of its own.  Nothing is
+    sorted until it is about to be needed, which makes this good for large
+    queues where many events are scheduled at nearly the same time.
+
+    """
+    THRESHOLD = 50  # Spread buckets holding more than this many events
+    MAX_RUNGS = 8
+
+    def __init__(self):
+        self._top = []
+        self._top_start = float("-inf")  # Events at or past this go in top
+        self._top_max = float("-inf")
+        self._rungs = []
+        self._bottom = []  # A heap
+        self._size = 0
+
+    def push(self, event):
+        t = event[0]
+        self._size += 1
+        if t >= self._top_start:
+            self._top.append(event)
+            if t > self._top_max:
+                self._top_max = t
+            return
+        for rung in self._rungs:
+            i = rung.index_of(t)
+            if i >= rung.cur:
+                rung.buckets[i].append(event)
+                return
+        heapq.heappush(self._bottom, event)
+
+    def pop(self):
+        if not self._bottom:
+            self._refill()
+        event = heapq.heappop(self._bottom)
+        self._size -= 1
+        return event
+
+    def peek(self):
+        if not self._bottom:
+            if not self._size:
+                return None
+            self._refill()
+        return self._bottom[0]
+
+    def __len__(self):
+        return self._size
+
+    def _refill(self):
+        """Moves the next batch of events into the bottom."""
+        rungs = self._rungs
+        while True:
+            if not rungs:
+                top = self._top
+                if not top:
+                    raise IndexError("pop from empty queue")
+                self._top = []
+                self._top_start = self._top_max
+                self._spawn(top)
+                if self._bottom:
+                    return
+                continue
+            rung = rungs[-1]
+            buckets = rung.buckets
+            while rung.cur < len(buckets) and not buckets[rung.cur]:
+                rung.cur += 1
+            if rung.cur == len(buckets):
+                rungs.pop()
+                continue
+            events = buckets[rung.cur]
+            buckets[rung.cur] = []
+            rung.cur += 1
+            if len(events) > self.THRESHOLD and len(rungs) < self.MAX_RUNGS:
+                self._spawn(events)
+                if self._bottom:
+                    return
+            else:
+                heapq.heapify(events)
+                self._bottom = events
+                return
+
+    def _spawn(self, events):
+        """Spreads events into a new rung (or the bottom if that's silly)."""
+        lo = min(e[0] for e in events)
+        hi = max(e[0] for e in events)
+        if hi == lo or len(events) <= self.THRESHOLD:
+            heapq.heapify(events)
+            self._bottom = events
+            return
+        width = (hi - lo) / len(events)
+        rung = _Rung(lo, width, len(events) + 1)
+        buckets = rung.buckets
+        index_of = rung.index_of
+        for e in events:
+            buckets[index_of(e[0])].append(e)
+        self._rungs.append(rung)
+
+
+schedulers = {
+    'heap': HeapEventQueue,
+    'calendar': CalendarEventQueue,
+    'ladder': LadderEventQueue,
+}
+
+
+def make_event_queue(name):
+    """Creates an event queue given its name (see schedulers)."""
+    try:
+        return schedulers[name]()
+    except KeyError:
+        raise RuntimeError("No such scheduler as '%s' (try one of: %s)"
+                           % (name, ", ".join(sorted(schedulers))))
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timing wheel (Varghese and Lauck, SOSP 1987).
+
+    The World keeps timers (see core.Timer) in one of these rather than in
+    its event queue.  Adding and cancelling a timer are O(1) -- cancelled
+    timers are really removed rather than left to expire -- and the World
+    only ever has one event in its queue on the wheel's behalf, for the
+    earliest deadline.
+
+    Time is divided into ticks of the given resolution.  The first level of
+    the wheel has a slot per tick; each further level has a slot per full
+    turn of the level below it, and anything further out than the last level
+    goes in an overflow slot.  When the wheel turns onto a slot of an upper
+    level, its timers are spread out into the lower levels.  Deadlines are
+    kept exactly (ticks are only for bookkeeping), and timers are handed back
+    in (deadline, sequence number) order, just as if they'd been events.
+
+    Each timer gets _deadline, _seq and _slot attributes.
+
+    """
+    BITS = 6  # 64 slots per level
+    LEVELS = 4
+
+    def __init__(self, resolution=0.01, now=0.0):
+        self.resolution = float(resolution)
+        self._levels = [[{} for _ in range(1 << self.BITS)]
+                        for _ in range(self.LEVELS)]
+        self._overflow = {}
+        self._tick = self._tick_of(now)  # The current tick
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _tick_of(self, t):
+        return int(math.floor(t / self.resolution))
+
+    def add(self, timer, deadline, seq):
+        """Adds a timer which expires at the given time."""
+        timer._deadline = deadline
+        timer._seq = seq
+        self._place(timer)
+        self._count += 1
+
+    def remove(self, timer):
+        """Removes a timer (if it's in the wheel)."""
+        slot = timer._slot
+        if slot is not None:
+            del slot[timer]
+            timer._slot = None
+            self._count -= 1
+
+    def _place(self, timer):
+        tick = self._tick_of(timer._deadline)
+        now = self._tick
+        if tick < now:
+            # Already late; goes in the current slot
+            tick = now
+        bits = self.BITS
+        for level, slots in enumerate(self._levels):
+            shift = bits * level
+            if (tick >> (shift + bits)) == (now >> (shift + bits)):
+                slot = slots[(tick >> shift) & ((1 << bits) - 1)]
+                break
+        else:
+            slot = self._overflow
+        slot[timer] = None
+        timer._slot = slot
+
+    def _first(self):
+        """
+        Finds the first non-empty slot.
+
+        Returns (level, index), where level is LEVELS for the overflow slot,
+        or None if the wheel is empty.
+
+        """
+        if not self._count:
+            return None
+        now = self._tick
+        bits = self.BITS
+        mask = (1 << bits) - 1
+        for level, slots in enumerate(self._levels):
+            for i in range((now >> (bits * level)) & mask, 1 << bits):
+                if slots[i]:
+                    return level, i
+        return self.LEVELS, None
+
+    def _slot(self, level, index):
+        if level == self.LEVELS:
+            return self._overflow
+        return self._levels[level][index]
+
+    def next_timer(self):
+        """Returns the timer which expires first (or None if there are
+        none)."""
+        first = self._first()
+        if first is None:
+            return None
+        return min(self._slot(*first), key=lambda t: (t._deadline, t._seq))
+
+    def expire(self, now):
+        """Removes and returns all timers whose deadlines are at or before
+        now."""
+        due = []
+        limit = self._tick_of(now)
+        bits = self.BITS
+        while True:
+            first = self._first()
+            if first is None:
+                break
+            level, i = first
+            slot = self._slot(level, i)
+            if level == 0:
+                # (Late timers are in the current slot even though they're
+                # really from earlier ticks, so check the deadlines.)
+                ready = [t for t in slot if t._deadline <= now]
+                if not ready:
+                    break
+                tick = (self._tick >> bits << bits) | i
+                if tick <= limit:
+                    self._tick = tick
+                for t in ready:
+                    del slot[t]
+                    t._slot = None
+                self._count -= len(ready)
+                due.extend(ready)
+                if slot:
+                    # The rest of this tick is still in the future
+                    break
+                continue
+            # Turn the wheel to the start of the slot and spread it out
+            if level == self.LEVELS:
+                start = min(self._tick_of(t._deadline) for t in slot)
+            else:
+                shift = bits * level
+                start = (self._tick >> (shift + bits) << (shift + bits)
+                         | (i << shift))
+            if start > limit:
+                break
+            self._tick = start
+            timers = list(slot)
+            slot.clear()
+            for t in timers:
+                self._place(t)
+        due.sort(key=lambda t: (t._deadline, t._seq))
+        return due
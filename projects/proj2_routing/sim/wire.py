@@ -0,0 +1,175 @@
+"""
+Encoding and decoding of what goes between the simulator and remote
+interfaces (see comm_tcp).
+
+The original protocol is JSON messages, one per line, and that's what a
+remote interface gets unless it asks for something else.  To ask, it sends
+a line like {"type": "hello", "protocols": ["binary1"]}.  The simulator
+answers with a hello line of its own saying which protocol it picked, and
+if that's "binary1", everything after that line is binary frames:
+
+  4 bytes  length of the rest of the frame (big-endian)
+  1 byte   frame type
+  ...      payload
+
+A FRAME_JSON payload is a JSON message just like in the line protocol.
+Packet animations, which are most of the traffic, are FRAME_PACKETs with
+a fixed layout (see packet_frame()).  Rather than having node names in
+them, they refer to IDs which were given names by an earlier FRAME_NAME.
+Decoder turns all of these back into the same messages the line protocol
+would have carried.
+
+Note that the remote interface's messages to the simulator are always
+JSON lines.
+"""
+
+import json
+import struct
+
+JSON = "json"
+BINARY = "binary1"
+
+FRAME_JSON = 0
+FRAME_NAME = 1
+FRAME_PACKET = 2
+
+_header = struct.Struct("!IB")  # Length (not counting itself), frame type
+_name = struct.Struct("!I")  # ID (followed by the name in UTF-8)
+# node1 ID, node2 ID, duration in ms, stroke RGBA, fill RGBA, dropped?
+_packet = struct.Struct("!IIf4B4B?")
+
+
+def json_line(msg):
+    return (json.dumps(msg, default=repr) + "\n").encode()
+
+
+def json_frame(msg):
+    data = json.dumps(msg, default=repr).encode()
+    return _header.pack(len(data) + 1, FRAME_JSON) + data
+
+
+def name_frame(node_id, name):
+    data = _name.pack(node_id) + name.encode()
+    return _header.pack(len(data) + 1, FRAME_NAME) + data
+
+
+def color_bytes(color):
+    """An RGB(A) color with 0-1 components as four 0-255 ints."""
+    if color is None:
+        return (0, 0, 0, 0)
+    c = [0 if v <= 0 else 255 if v >= 1 else int(round(v * 255))
+         for v in color]
+    if len(c) < 4:
+        c.append(255)
+    return c[:4]
+
+
+def packet_frame(id1, id2, duration, stroke, fill, drop):
+    """
+    Encodes a packet animation.
+
+    duration is in milliseconds.  Colors are sent with one byte per
+    component, so they come out a tiny bit different.
+    """
+    return (_header.pack(_packet.size + 1, FRAME_PACKET) +
+            _packet.pack(id1, id2, duration,
+                         *(list(color_bytes(stroke)) +
+                           list(color_bytes(fill)) + [bool(drop)])))
+
+
+class Decoder(object):
+    """
+    Turns the bytes a remote interface receives back into messages.
+
+    Starts out reading JSON lines.  If it sees the simulator's hello saying
+    it picked the binary protocol, it switches to reading frames.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0  # How far into _buf we've used up
+        self.protocol = JSON
+        self.names = {}  # Node ID -> name
+
+    def feed(self, data):
+        """Adds received bytes, and returns a list of all new messages."""
+        self._buf += data
+        out = []
+        while True:
+            if self.protocol == JSON:
+                end = self._buf.find(b"\n", self._pos)
+                if end == -1:
+                    break
+                line = bytes(self._buf[self._pos:end]).strip()
+                self._pos = end + 1
+                if not line:
+                    continue
+                msg = json.loads(line.decode())
+                if msg.get("type") == "hello":
+                    self.protocol = msg.get("protocol", JSON)
+                out.append(msg)
+            else:
+                msg = self._next_frame()
+                if msg is None:
+                    break
+                if msg is not False:
+                    out.append(msg)
+        # Throw away what we've used (once per feed, not once per message)
+        del self._buf[:self._pos]
+        self._pos = 0
+        return out
+
+    def _next_frame(self):
+        """Returns a message, False for a frame with none, None if no frame."""
+        start = self._pos
+        if len(self._buf) - start < _header.size:
+            return None
+        length, kind = _header.unpack_from(self._buf, start)
+        end = start + 4 + length
+        if len(self._buf) < end:
+            return None
+        self._pos = end
+        buf = self._buf
+        start += _header.size
+        if kind == FRAME_PACKET:
+            v = _packet.unpack_from(buf, start)
+            return {
+                "type": "packet",
+                "node1": self.names.get(v[0]),
+                "node2": self.names.get(v[1]),
+                "duration": v[2],
+                "stroke": [c / 255.0 for c in v[3:7]],
+                "fill": [c / 255.0 for c in v[7:11]],
+                "drop": v[11],
+            }
+        elif kind == FRAME_NAME:
+            node_id, = _name.unpack_from(buf, start)
+            self.names[node_id] = bytes(buf[start + _name.size:end]).decode()
+            return False
+        elif kind == FRAME_JSON:
+            return json.loads(bytes(buf[start:end]).decode())
+        return False  # Unknown; skip it
+
+
+class LineSplitter(object):
+    """Splits received bytes into lines without re-copying the whole buffer."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Adds received bytes, and returns a list of complete lines."""
+        buf = self._buf
+        start = len(buf)
+        buf += data
+        end = buf.find(b"\n", start)
+        if end == -1:
+            return []
+        lines = []
+        pos = 0
+        while end != -1:
+            lines.append(bytes(buf[pos:end]))
+            pos = end + 1
+            end = buf.find(b"\n", pos)
+        del buf[:pos]
+        return lines
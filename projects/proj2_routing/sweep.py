@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+"""
+Runs the simulator over a grid of options, in parallel.
+
+Give it a simulator commandline (after --) in which some options have more
+than one value.  An option given more than once, or with a value containing
+{a,b,c} or {1..10} (like in bash), is swept over all its values, and the
+simulator is run once for every combination.  For example:
+
+  python sweep.py --out=results.jsonl --duration=60 -- \\
+      --default-switch-type=dv_router --poison-mode --no-poison-mode \\
+      topos.rand --switches={10,20,50} --seed={1..100}
+
+That's 600 runs.  Each is done in its own process forked from this one
+(which has already imported the simulator), with up to one per CPU (or
+--jobs) at once.  Runs are non-interactive, in virtual time, and without a
+remote interface, unless the commandline says otherwise.  Each ends when
+its modules end it, after --duration seconds of simulated time, or when
+--timeout seconds of wall clock time have passed.  A run which is still
+going KILL_GRACE seconds after being told to stop at the timeout (e.g.,
+because it's stuck in a handler which never returns) is killed.
+
+Each run adds a line of JSON to the output file as soon as it's done, with
+its parameters, its status ("ok", "errors" if it logged any errors,
+"failed" if it couldn't be run or crashed, or "timeout"), the number of
+errors logged, the wall clock and virtual time it took, the number of
+events processed, the number of packets sent (and dropped, and bytes sent)
+over links which were still up at the end, and the convergence time.  The
+convergence time is when a router last received a route advertisement
+which was different from the previous one it got for that destination on
+that port.
+
+If the output file already exists, runs which it says finished ("ok" or
+"errors") are skipped, so a sweep which was interrupted or had runs which
+failed or timed out can be picked up again by running the same command.
+Records of re-run runs are appended, so use the last record for each id.
+Use --fresh to start over instead.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import select
+import signal
+import sys
+import time
+
+
+# Wall clock seconds a run gets to stop after its timeout before it's killed
+KILL_GRACE = 10
+
+_brace = re.compile(r"\{([^{}]*)\}")
+_brace_range = re.compile(r"^(-?\d+)\.\.(-?\d+)$")
+
+
+def _expand(value):
+    """Expands {a,b} and {1..3} in a value, returning a list of values."""
+    if not isinstance(value, str):
+        return [value]
+    m = _brace.search(value)
+    if not m:
+        return [value]
+    body = m.group(1)
+    r = _brace_range.match(body)
+    if r:
+        lo, hi = int(r.group(1)), int(r.group(2))
+        step = 1 if hi >= lo else -1
+        items = [str(i) for i in range(lo, hi + step, step)]
+    elif "," in body:
+        items = body.split(",")
+    else:
+        return [value]  # Just braces
+    values = []
+    for item in items:
+        values.extend(_expand(value[:m.start()] + item + value[m.end():]))
+    return values
+
+
+def parse_grid(argv):
+    """
+    Parses a commandline with swept options.
+
+    Returns a dict of the simulator's options and a list of (module name,
+    dict of its options) pairs, like boot.parse_commandline(), except that
+    the options' values are lists of the values to sweep over.
+
+    """
+    import sim.boot as boot
+    options = collections.OrderedDict()
+    modules = []
+    args = options
+    for arg in argv:
+        if arg.startswith("--"):
+            parsed = boot.parse_commandline([arg])[0]
+            for k, v in parsed.items():
+                values = args.setdefault(k, [])
+                for v in _expand(v):
+                    if v not in values:
+                        values.append(v)
+        else:
+            args = collections.OrderedDict()
+            modules.append((arg, args))
+    return options, modules
+
+
+def make_runs(options, modules):
+    """
+    Returns a list of runs, one for each combination of values.
+
+    Each run is a dict with an id, the params to run with ("sim" options and
+    "modules"), and the values of the swept options ("swept").
+
+    """
+    axes = []  # (module index or None, name, values)
+    for k, values in options.items():
+        axes.append((None, k, values))
+    for i, (name, args) in enumerate(modules):
+        for k, values in args.items():
+            axes.append((i, k, values))
+
+    runs = []
+    for combo in itertools.product(*[values for _, _, values in axes]):
+        sim_options = {}
+        module_options = [(name, {}) for name, _ in modules]
+        swept = collections.OrderedDict()
+        for (i, k, values), v in zip(axes, combo):
+            if i is None:
+                sim_options[k] = v
+                label = k
+            else:
+                module_options[i][1][k] = v
+                label = "%s:%s" % (modules[i][0], k)
+            if len(values) > 1:
+                swept[label] = v
+        params = {'sim': sim_options,
+                  'modules': [list(m) for m in module_options]}
+        key = json.dumps(params, sort_keys=True).encode()
+        runs.append({'id': hashlib.sha1(key).hexdigest()[:12],
+                     'params': params,
+                     'swept': swept})
+    return runs
+
+
+class _RouteWatcher(object):
+    """
+    Watches route advertisements (basics.RoutePackets) being received to
+    see when routing converged.
+    """
+
+    def __init__(self):
+        self.last = {}  # (receiver, port, destination) -> cost
+        self.packets = 0
+        self.changes = 0
+        self.converged_at = None
+
+    def install(self):
+        import sim.api as api
+        import sim.basics as basics
+        notify_rx = basics.RoutePacket._notify_rx
+        watcher = self
+
+        def _notify_rx(packet, srcEnt, srcPort, dstEnt, dstPort, drop):
+            notify_rx(packet, srcEnt, srcPort, dstEnt, dstPort, drop)
+            if drop:
+                return
+            watcher.packets += 1
+            key = (dstEnt.name, dstPort, api.get_name(packet.destination))
+            if watcher.last.get(key, watcher) != packet.latency:
+                watcher.last[key] = packet.latency
+                watcher.changes += 1
+                watcher.converged_at = api.current_time()
+
+        basics.RoutePacket._notify_rx = _notify_rx
+
+
+def _cable_counters(world):
+    sent = dropped = sent_bytes = 0
+    for te in world.registry.values():
+        for c in te.ports:
+            if c is not None:
+                sent += getattr(c, 'packets_sent', 0)
+                dropped += getattr(c, 'packets_dropped', 0)
+                sent_bytes += getattr(c, 'bytes_sent', 0)
+    return sent, dropped, sent_bytes
+
+
+def _new_record(run):
+    record = collections.OrderedDict()
+    record['id'] = run['id']
+    record['swept'] = run['swept']
+    record['params'] = run['params']
+    record['status'] = 'failed'
+    record['message'] = None
+    return record
+
+
+def _run(job):
+    """Does a run in this process (which should be a fresh fork)."""
+    run, duration, timeout = job
+    import sim.boot as boot
+    import sim.core as core
+
+    record = _new_record(run)
+
+    watcher = _RouteWatcher()
+    watcher.install()
+    timed_out = []
+    start = time.time()
+    try:
+        options = {'interactive': False,
+                   'virtual_time': True,
+                   'remote_interface': 'none'}
+        options.update(run['params']['sim'])
+        modules = [(name, dict(args))
+                   for name, args in run['params']['modules']]
+        if boot.setup(options, modules) is None:
+            record['message'] = 'Could not set up'
+        else:
+            world = core.current_world()
+            if duration is not None:
+                world.doAt(duration, world.stop)
+            if timeout:
+                def on_timeout(signum, frame):
+                    timed_out.append(True)
+                    world.stop()
+                signal.signal(signal.SIGALRM, on_timeout)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            world.start(threaded=False)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            world.events.flush()
+
+            if timed_out:
+                record['status'] = 'timeout'
+            elif world.error_count:
+                record['status'] = 'errors'
+            else:
+                record['status'] = 'ok'
+            record['errors'] = world.error_count
+            record['virtual_time'] = world.time
+            record['events'] = world.event_count
+            sent, dropped, sent_bytes = _cable_counters(world)
+            record['packets_sent'] = sent
+            record['packets_dropped'] = dropped
+            record['bytes_sent'] = sent_bytes
+            record['route_packets'] = watcher.packets
+            record['route_changes'] = watcher.changes
+            record['convergence_time'] = watcher.converged_at
+    except BaseException as e:
+        record['status'] = 'failed'
+        record['message'] = "%s: %s" % (type(e).__name__, e)
+    record['wall_time'] = time.time() - start
+    return record
+
+
+def _fork(job):
+    """Starts a run in a child process.  Returns (pid, fd)."""
+    r, w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.close(w)
+        return pid, r
+
+    # The child
+    status = 1
+    try:
+        os.close(r)
+        record = _run(job)
+        data = (json.dumps(record) + "\n").encode()
+        while data:
+            data = data[os.write(w, data):]
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def _run_all(jobs, max_jobs, timeout):
+    """
+    Does runs in child processes, up to max_jobs at once.
+
+    Yields each one's record as it finishes.  Runs still going KILL_GRACE
+    seconds after their timeout are killed.
+
+    """
+    waiting = list(jobs)
+    running = {}  # fd -> [job, pid, start, data]
+    try:
+        while waiting or running:
+            while waiting and len(running) < max_jobs:
+                job = waiting.pop(0)
+                pid, fd = _fork(job)
+                running[fd] = [job, pid, time.time(), b""]
+
+            wait = None
+            if timeout:
+                deadline = (min(r[2] for r in running.values()) + timeout
+                            + KILL_GRACE)
+                wait = max(0, deadline - time.time())
+            for fd in select.select(list(running), [], [], wait)[0]:
+                data = os.read(fd, 65536)
+                if data:
+                    running[fd][3] += data
+                    continue
+                job, pid, start, data = running.pop(fd)
+                os.close(fd)
+                os.waitpid(pid, 0)
+                try:
+                    record = json.loads(data.decode())
+                except ValueError:
+                    record = _new_record(job[0])
+                    record['message'] = 'Crashed'
+                    record['wall_time'] = time.time() - start
+                yield record
+
+            if not timeout:
+                continue
+            now = time.time()
+            for fd, (job, pid, start, data) in list(running.items()):
+                if now - start >= timeout + KILL_GRACE:
+                    del running[fd]
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    os.close(fd)
+                    record = _new_record(job[0])
+                    record['status'] = 'timeout'
+                    record['message'] = ("Killed after not stopping for %is"
+                                         % (KILL_GRACE, ))
+                    record['wall_time'] = now - start
+                    yield record
+    finally:
+        for fd, (job, pid, start, data) in running.items():
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            os.close(fd)
+
+
+def _prewarm(options, verbose):
+    """
+    Imports what the runs will need, so forked runs start warm.
+
+    The modules being run aren't imported, since their launch() defaults
+    often come from sim.config, which each run sets up differently.
+
+    """
+    import sim
+    if not verbose:
+        sim.config.console_log = False  # (Must be before sim.core import)
+    import sim.api
+    import sim.basics
+    import sim.boot
+    import sim.cable
+    import sim.comm
+    import sim.core
+    import sim.scheduler
+    if not verbose:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+    for name in options.get('default_switch_type', []):
+        try:
+            sim._find_switch_type(name)
+        except Exception:
+            pass  # The run will fail and say why
+    for name in options.get('default_host_type', []):
+        try:
+            sim._find_host_type(name)
+        except Exception:
+            pass
+
+
+def _read_done(filename):
+    """Returns the ids of runs which finished according to filename."""
+    done = set()
+    if not os.path.exists(filename):
+        return done
+    with open(filename) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Probably cut off
+            if record.get('status') in ('ok', 'errors'):
+                done.add(record['id'])
+            else:
+                done.discard(record.get('id'))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the simulator over a grid of options.",
+        usage="%(prog)s [options] -- simulator commandline")
+    parser.add_argument('--out', '-o', default='sweep.jsonl',
+                        help="file to add results to (default sweep.jsonl)")
+    parser.add_argument('--jobs', '-j', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of runs to do at once")
+    parser.add_argument('--duration', type=float,
+                        help="seconds of simulated time to run each for")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="wall clock seconds to give each run")
+    parser.add_argument('--fresh', action='store_true',
+                        help="start over rather than skipping finished runs")
+    parser.add_argument('--dry-run', '-n', action='store_true',
+                        help="just list the runs")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="show the simulator's log output")
+    parser.add_argument('commandline', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    commandline = args.commandline
+    if commandline and commandline[0] == '--':
+        commandline = commandline[1:]
+    if not commandline:
+        parser.error("no simulator commandline")
+
+    options, modules = parse_grid(commandline)
+    runs = make_runs(options, modules)
+
+    if args.dry_run:
+        for run in runs:
+            print(run['id'], json.dumps(run['swept']))
+        print("%i runs" % (len(runs), ))
+        return
+
+    if args.fresh and os.path.exists(args.out):
+        os.remove(args.out)
+    done = _read_done(args.out)
+    todo = [run for run in runs if run['id'] not in done]
+    print("%i runs (%i already done)" % (len(runs), len(runs) - len(todo)),
+          file=sys.stderr)
+
+    _prewarm(options, args.verbose)
+
+    statuses = collections.Counter()
+    start = time.time()
+    jobs = [(run, args.duration, args.timeout) for run in todo]
+    # A new process for each run, so runs can't affect each other
+    with open(args.out, 'a') as out:
+        records = _run_all(jobs, max(1, args.jobs), args.timeout)
+        for n, record in enumerate(records):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            statuses[record['status']] += 1
+            print("[%i/%i] %s %s (%.2fs) %s" %
+                  (n + 1, len(todo), record['id'], record['status'],
+                   record['wall_time'],
+                   " ".join("%s=%s" % kv
+                            for kv in record['swept'].items())),
+                  file=sys.stderr)
+
+    elapsed = time.time() - start
+    print("%i runs in %.2fs: %s" %
+          (len(todo), elapsed,
+           ", ".join("%i %s" % (n, s) for s, n in sorted(statuses.items()))),
+          file=sys.stderr)
+    sys.exit(0 if set(statuses) <= set(['ok', 'errors']) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,22 +5,50 @@ Test runner for dv_router.py and learning_switch.py.
 Add your own tests by creating new files in tests/ and updating main
 below.
 
+Tests run in parallel, each in its own process forked from this one (which
+has already imported the simulator), with no remote interface.  Use --jobs
+to say how many to run at once (the default is one per CPU), and --json to
+also write the results as JSON.  Output from the simulator is only shown
+for tests which fail, unless you use --verbose.
+
 """
 
 from __future__ import print_function
 
+import argparse
+import json
+import multiprocessing
 import os
 import select
+import signal
 import subprocess
+import sys
+import tempfile
 import time
+import traceback
 
 
 def main():
-    t = TestSuite()
+    parser = argparse.ArgumentParser(description="Runs the tests.")
+    parser.add_argument('--jobs', '-j', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of tests to run at once")
+    parser.add_argument('--json', metavar='FILE',
+                        help="write results as JSON to FILE (- for stdout)")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="wall clock seconds to give each test")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="show the output of tests which pass too")
+    options = parser.parse_args()
+
+    t = TestSuite(jobs=options.jobs, timeout=options.timeout,
+                  verbose=options.verbose,
+                  quiet=options.json == '-')
 
     t.test('learning_switch', 'tests.test_learning')
     t.test('dv_router', 'tests.test_simple')
     t.test('dv_router', 'tests.test_failure')
+    t.test('dv_router', 'tests.test_link_failures')
     t.test('dv_router', 'tests.test_initialize_neighbor')
     t.test('dv_router', 'tests.test_no_hairpin')
     t.test('dv_router', 'tests.test_link_weights')
@@ -34,57 +62,259 @@ def main():
 
     t.finish()
 
+    if options.json:
+        t.write_json(options.json)
+
+    sys.exit(0 if t.num_failed == 0 else 1)
+
 
 GREEN = '\033[92m'
 RED = '\033[91m'
 CLEAR = '\033[0m'
 
 
+def _sim_args(router, test_name, extra_args):
+    args = ['--no-interactive', '--virtual-time',
+            '--default-switch-type=%s' % router]
+    if extra_args:
+        args += extra_args
+    return args + [test_name]
+
+
+def _prewarm(routers):
+    """Imports what the tests will need, so forked workers start warm."""
+    import sim
+    import sim.api
+    import sim.basics
+    import sim.boot
+    import sim.cable
+    import sim.comm
+    import sim.core
+    import sim.scheduler
+    for router in routers:
+        try:
+            sim._find_switch_type(router)
+        except Exception:
+            pass  # The test will fail and say why
+
+
+def _run_here(router, test_name, extra_args):
+    """
+    Runs a test in this process, which should be a fresh fork.
+
+    Returns (passed, message, virtual time).
+
+    """
+    import sim.boot as boot
+    import sim.core as core
+    # No remote interface, so no port to bind or remote side to wait for
+    args = ['--remote-interface=none'] + _sim_args(router, test_name,
+                                                   extra_args)
+    general_args, modules = boot.parse_commandline(args)
+    if boot.setup(general_args, modules) is None:
+        return False, 'Could not run', None
+    core.world.start(threaded=False)
+    core.events.flush()
+    return core.world.error_count == 0, None, core.world.time
+
+
 class TestSuite:
     num_passed = 0
     num_failed = 0
+    total_time = 0.0
+
+    def __init__(self, jobs=1, timeout=300, verbose=False, quiet=False):
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.verbose = verbose
+        self.quiet = quiet  # Don't print anything
+        self.tests = []  # (router, test name, extra args)
+        self.results = []
 
     def test(self, router, test_name, extra_args=None):
-        cmd = ['python', 'simulator.py', '--no-interactive', '--virtual-time',
-               '--default-switch-type=%s' % router]
-        if extra_args:
-            cmd += extra_args
-        cmd += [test_name]
-        interactive_cmd = [
-            arg for arg in cmd
-            if arg not in [
-                '--no-interactive', '--virtual-time'
-            ]
-        ]
+        self.tests.append((router, test_name, extra_args))
+
+    def run(self):
+        """Runs all the tests, reporting on each as it finishes."""
+        start = time.time()
+        if hasattr(os, 'fork'):
+            self._run_forked()
+        else:
+            for test in self.tests:
+                self._report(self._run_subprocess(*test))
+        self.total_time = time.time() - start
+
+    def _run_subprocess(self, router, test_name, extra_args):
+        cmd = ['python', 'simulator.py'] + _sim_args(router, test_name,
+                                                     extra_args)
+        start = time.time()
         r = subprocess.call(cmd)
-        if r is False:
-            self.fail(router, test_name, interactive_cmd, 'Timed out')
-        elif r is None:
-            self.fail(router, test_name, interactive_cmd, 'Could not run')
-        elif r == 0:
-            self.succeed(router, test_name)
+        return self._result(router, test_name, extra_args, r == 0, None,
+                            time.time() - start, None, None)
+
+    def _result(self, router, test_name, extra_args, passed, message,
+                wall_time, virtual_time, output):
+        return {
+            'router': router,
+            'test': test_name,
+            'args': extra_args or [],
+            'passed': passed,
+            'message': message,
+            'wall_time': wall_time,
+            'virtual_time': virtual_time,
+            'output': output,
+        }
+
+    def _fork(self, router, test_name, extra_args):
+        """Starts a test in a child process.  Returns (pid, fd, output)."""
+        output = tempfile.TemporaryFile()
+        r, w = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(w)
+            return pid, r, output
+
+        # The child
+        status = 1
+        try:
+            os.close(r)
+            os.dup2(output.fileno(), 1)
+            os.dup2(output.fileno(), 2)
+            result = _run_here(router, test_name, extra_args)
+            os.write(w, json.dumps(result).encode())
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _run_forked(self):
+        _prewarm(set(router for router, _, _ in self.tests))
+
+        waiting = list(self.tests)
+        running = {}  # fd -> [test, pid, output file, start, data]
+        while waiting or running:
+            while waiting and len(running) < self.jobs:
+                test = waiting.pop(0)
+                pid, fd, output = self._fork(*test)
+                running[fd] = [test, pid, output, time.time(), b""]
+
+            deadline = min(r[3] for r in running.values()) + self.timeout
+            ready = select.select(list(running), [], [],
+                                  max(0, deadline - time.time()))[0]
+            for fd in ready:
+                data = os.read(fd, 4096)
+                if data:
+                    running[fd][4] += data
+                    continue
+                test, pid, output, start, data = running.pop(fd)
+                os.close(fd)
+                os.waitpid(pid, 0)
+                if data:
+                    passed, message, virtual_time = json.loads(data.decode())
+                else:
+                    passed, message, virtual_time = False, 'Crashed', None
+                self._finish_test(test, output, passed, message,
+                                  time.time() - start, virtual_time)
+
+            now = time.time()
+            for fd, (test, pid, output, start, data) in list(running.items()):
+                if now - start >= self.timeout:
+                    del running[fd]
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    os.close(fd)
+                    self._finish_test(test, output, False, 'Timed out',
+                                      now - start, None)
+
+    def _finish_test(self, test, output, passed, message, wall_time,
+                     virtual_time):
+        output.seek(0)
+        text = output.read().decode('utf-8', 'replace')
+        output.close()
+        router, test_name, extra_args = test
+        self._report(self._result(router, test_name, extra_args, passed,
+                                  message, wall_time, virtual_time, text))
+
+    def _report(self, result):
+        self.results.append(result)
+        router = result['router']
+        test_name = result['test']
+        if result['passed']:
+            self.num_passed += 1
         else:
-            self.fail(router, test_name, interactive_cmd)
+            self.num_failed += 1
+        if self.quiet:
+            return
+        if result['output'] and (self.verbose or not result['passed']):
+            sys.stdout.write(result['output'])
+        if result['passed']:
+            self.succeed(router, test_name, result['wall_time'],
+                         result['virtual_time'])
+        else:
+            cmd = (['python', 'simulator.py'] +
+                   [arg for arg in _sim_args(router, test_name,
+                                             result['args'])
+                    if arg not in ['--no-interactive', '--virtual-time']])
+            self.fail(router, test_name, cmd, result['wall_time'],
+                      result['message'], result['virtual_time'])
 
-    def succeed(self, router, testname):
-        print('%s*** %s: %s passed ***%s' % (GREEN, router, testname, CLEAR))
-        self.num_passed += 1
+    def succeed(self, router, testname, elapsed, virtual_time=None):
+        print('%s*** %s: %s passed (%s) ***%s' %
+              (GREEN, router, testname, _times(elapsed, virtual_time), CLEAR))
 
-    def fail(self, router, testname, cmd, message=None):
+    def fail(self, router, testname, cmd, elapsed, message=None,
+             virtual_time=None):
+        times = _times(elapsed, virtual_time)
         if message:
-            print('%s*** %s: %s failed: %s ***%s' % (RED, router, testname,
-                                                     message, CLEAR))
+            print('%s*** %s: %s failed: %s (%s) ***%s' %
+                  (RED, router, testname, message, times, CLEAR))
         else:
-            print('%s*** %s: %s failed ***%s' % (RED, router, testname, CLEAR))
+            print('%s*** %s: %s failed (%s) ***%s' %
+                  (RED, router, testname, times, CLEAR))
         print('%sCommand: %s%s' % (RED, ' '.join(cmd), CLEAR))
-        self.num_failed += 1
 
     def finish(self):
+        self.run()
+        if self.quiet:
+            return
         if self.num_failed == 0:
             print('%sAll tests passed.%s' % (GREEN, CLEAR))
         else:
             print('Tests: %d passed, %s%d failed%s.' %
                   (self.num_passed, RED, self.num_failed, CLEAR))
+        print('Total time: %.2fs' % (self.total_time, ))
+
+    def write_json(self, filename):
+        results = []
+        for result in self.results:
+            result = dict(result)
+            if result['passed']:
+                del result['output']  # Only interesting for failures
+            results.append(result)
+        doc = {
+            'passed': self.num_passed,
+            'failed': self.num_failed,
+            'jobs': self.jobs,
+            'wall_time': self.total_time,
+            'tests': results,
+        }
+        if filename == '-':
+            json.dump(doc, sys.stdout, indent=2)
+            print()
+        else:
+            with open(filename, 'w') as f:
+                json.dump(doc, f, indent=2)
+
+
+def _times(elapsed, virtual_time):
+    if virtual_time is None:
+        return '%.2fs' % (elapsed, )
+    return '%.2fs, %.2fs virtual' % (elapsed, virtual_time)
 
 
 if __name__ == '__main__':
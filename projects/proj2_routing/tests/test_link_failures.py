@@ -0,0 +1,70 @@
+"""
+Test routing around each possible link failure.
+
+Creates a topology like:
+
+h1 -- s1 -------------- s2 -- h2
+        \\              /
+         s3 -- s4 -- s5
+
+Waits for routing to converge, then (in a separate branch of the
+simulation for each one) fails one of the links between switches.
+Waits a while.
+Sends a ping from h1 to h2.
+
+The test passes if h2 gets the ping whichever link failed.
+
+"""
+
+import sim
+import sim.api as api
+
+from tests.test_simple import GetPacketHost
+
+
+def launch():
+    h1 = GetPacketHost.create("h1")
+    h2 = GetPacketHost.create("h2")
+
+    s1 = sim.config.default_switch_type.create('s1')
+    s2 = sim.config.default_switch_type.create('s2')
+    s3 = sim.config.default_switch_type.create('s3')
+    s4 = sim.config.default_switch_type.create('s4')
+    s5 = sim.config.default_switch_type.create('s5')
+
+    h1.linkTo(s1)
+    h2.linkTo(s2)
+
+    links = [(s1, s2), (s1, s3), (s3, s4), (s4, s5), (s5, s2)]
+    for a, b in links:
+        a.linkTo(b)
+
+    def test_tasklet():
+        t = 25.5
+        yield t  # Wait for routing to converge (just once)
+
+        a, b = api.branch(links)
+
+        api.userlog.debug("Failing %s-%s link", a.name, b.name)
+        a.unlinkTo(b)
+
+        yield t
+
+        api.userlog.debug("Sending test ping")
+        h1.ping(h2)
+
+        yield t
+
+        if h2.pings != 1:
+            api.userlog.error("With %s-%s down, h2 got %s packets instead "
+                              "of 1", a.name, b.name, h2.pings)
+            good = False
+        else:
+            api.userlog.debug("Test passed successfully!")
+            good = True
+
+        # End the simulation and (if not running in interactive mode) exit.
+        import sys
+        sys.exit(0 if good else 1)
+
+    api.run_tasklet(test_tasklet)
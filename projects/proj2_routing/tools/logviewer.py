@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import os
+import sys
+
 from Tkinter import *
 from ScrolledText import *
 from tkFont import Font
@@ -62,21 +65,22 @@ def prog(logWindow):
     import socket
     import json
     import time
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import sim.wire as wire
     while True:
         sock = None
         try:
             sock = socket.socket()
             sock.connect(('127.0.0.1', 4444))
             logWindow.append("--- Connected ----------------------")
-            d = ''
+            sock.send(json.dumps({'type': 'hello',
+                                  'protocols': [wire.BINARY]}) + "\n")
+            decoder = wire.Decoder()
             while True:
                 r = sock.recv(4096)
                 if len(r) == 0:
                     raise RuntimeError()
-                d += r
-                while d.find('\n') != -1:
-                    msg, d = d.split("\n", 1)
-                    msg = json.loads(msg)
+                for msg in decoder.feed(r):
                     if msg.get("type") == "log":
                         # print msg
                         r = msg['asctime'].split(',', 1)[0].split(' ', 1)[1]
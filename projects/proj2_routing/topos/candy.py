@@ -16,16 +16,16 @@ def launch(switch_type=sim.config.default_switch_type,
 
     """
 
-    switch_type.create('s1')
-    switch_type.create('s2')
-    switch_type.create('s3')
-    switch_type.create('s4')
-    switch_type.create('s5')
-
-    host_type.create('h1a')
-    host_type.create('h1b')
-    host_type.create('h2a')
-    host_type.create('h2b')
+    s1 = switch_type.create('s1')
+    s2 = switch_type.create('s2')
+    s3 = switch_type.create('s3')
+    s4 = switch_type.create('s4')
+    s5 = switch_type.create('s5')
+
+    h1a = host_type.create('h1a')
+    h1b = host_type.create('h1b')
+    h2a = host_type.create('h2a')
+    h2b = host_type.create('h2b')
 
     s1.linkTo(h1a)
     s1.linkTo(h1b)
@@ -0,0 +1,498 @@
+"""
+Random and regular topology generators which scale to big topologies.
+
+Run it like the other topos, picking a kind of topology with --kind:
+
+  tree    A random spanning tree plus extra links.  This is what topos.rand
+          makes (with the same options and seeds), but quicker.
+  ba      Barabasi-Albert: each new switch links to --m existing switches,
+          picked with probability proportional to their degree.
+  waxman  Switches are scattered on a square, and each pair is linked with
+          probability beta * exp(-d / (alpha * L)), where d is the distance
+          between them and L is the largest possible distance.
+  fattree A k-ary fat tree (--k, which must be even), with its hosts.
+  mesh    A --width by --height grid (a torus with --torus).
+
+For all but fattree, --hosts hosts are attached to random switches as in
+topos.rand.  --latency gives link latencies: a number, or one of
+uniform:LOW:HIGH, exp:MEAN, normal:MEAN:STDDEV, or lognormal:MU:SIGMA.
+
+The generator functions can also be used directly.  They return a Topology,
+which can then be build() into the simulator.
+
+"""
+
+import math
+import random
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+import sim
+import sim.core as core
+
+
+class Topology(object):
+    """
+    A topology waiting to be built.
+
+    Nodes are referred to by their index in names.
+
+    """
+
+    def __init__(self):
+        self.names = []
+        self.is_host = []
+        self.links = []  # (index, index)
+
+    def add_switch(self, name):
+        self.names.append(name)
+        self.is_host.append(False)
+        return len(self.names) - 1
+
+    def add_host(self, name):
+        self.names.append(name)
+        self.is_host.append(True)
+        return len(self.names) - 1
+
+    def link(self, a, b):
+        self.links.append((a, b))
+
+    def build(self, switch_type=None, host_type=None, latency=None,
+              rand=random):
+        """
+        Creates the topology in the simulator.
+
+        latency is None (to use the cables' default) or a function which
+        takes a random.Random and returns a latency (see parse_latency()).
+
+        Returns a list of the Entities.
+
+        """
+        if switch_type is None:
+            switch_type = sim.config.default_switch_type
+        if host_type is None:
+            host_type = sim.config.default_host_type
+        nodes = [(name, host_type if h else switch_type)
+                 for name, h in zip(self.names, self.is_host)]
+        latencies = None
+        if latency is not None:
+            latencies = [latency(rand) for _ in self.links]
+        return core.build_topology(nodes, self.links, latencies)
+
+
+class _Remaining(Sequence):
+    """
+    The numbers 0 to n-1, in order, minus the ones which have been removed.
+
+    Getting the i-th one and removing one are both O(log n) (it's a Fenwick
+    tree), and it's a Sequence, so random.choice() and random.sample() can
+    use it just as they would a list.
+
+    """
+
+    def __init__(self, n):
+        self._n = n
+        self._len = n
+        tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            tree[i] += 1
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+        self._top = 1
+        while self._top * 2 <= n:
+            self._top *= 2
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        tree = self._tree
+        pos = 0
+        rest = i + 1
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self._n and tree[nxt] < rest:
+                pos = nxt
+                rest -= tree[nxt]
+            step >>= 1
+        return pos
+
+    def remove(self, value):
+        tree = self._tree
+        i = value + 1
+        while i <= self._n:
+            tree[i] -= 1
+            i += i & -i
+        self._len -= 1
+
+
+def make_random(seed=None):
+    """Returns a random.Random for the seed (or the random module if None)."""
+    if seed is None:
+        return random
+    try:
+        seed = float(seed)
+        if seed == int(seed):
+            seed = int(seed)
+    except:
+        pass
+    rand = random.Random()
+    rand.seed(seed)
+    return rand
+
+
+def parse_latency(spec):
+    """
+    Turns a latency specification into a function (or None).
+
+    See the module documentation for what they look like.
+
+    """
+    if spec is None:
+        return None
+    spec = str(spec).split(":")
+    kind = spec[0].lower()
+    args = [float(a) for a in spec[1:]]
+    if kind == "uniform":
+        return lambda rand: rand.uniform(args[0], args[1])
+    elif kind == "exp":
+        return lambda rand: rand.expovariate(1.0 / args[0])
+    elif kind == "normal":
+        return lambda rand: max(0.0, rand.normalvariate(args[0], args[1]))
+    elif kind == "lognormal":
+        return lambda rand: rand.lognormvariate(args[0], args[1])
+    value = float(spec[0])
+    return lambda rand: value
+
+
+def _add_switches(topo, n):
+    return [topo.add_switch('s' + str(i + 1)) for i in range(n)]
+
+
+def _add_hosts(topo, switches, hosts, multiple_hosts, rand):
+    """Attaches hosts to random switches, just like topos.rand."""
+    remaining = None if multiple_hosts else _Remaining(len(switches))
+    for i in range(hosts):
+        host = topo.add_host('h' + str(i + 1))
+        if remaining is None:
+            switch = rand.choice(switches)
+        else:
+            j = rand.choice(remaining)
+            remaining.remove(j)
+            switch = switches[j]
+        topo.link(switch, host)
+
+
+def random_tree(n, links=None, hosts=0, multiple_hosts=True, rand=random):
+    """
+    A random spanning tree plus extra links, with links links in all.
+
+    Gives the same topology as topos.rand for the same arguments and
+    random state.
+
+    """
+    l = links
+    n = int(n)
+    h = int(hosts)
+    if l is None:
+        l = 2 * n
+    l = int(l)
+    l = min(l, l * (l - 1) // 2)
+    l = max(l, n - 1)
+
+    l -= (n - 1)
+    # topos.rand doesn't stop at the number of links possible (and then
+    # never finishes), but we do.
+    l = min(l, n * (n - 1) // 2 - (n - 1))
+
+    # Join groups of switches (starting with one per switch) until there's
+    # just one.  groups has the keys in order (it's what topos.rand gets by
+    # sorting its dict of groups every time).
+    members = [[x] for x in range(n)]
+    groups = _Remaining(n)
+
+    links = set()
+
+    while len(groups) > 1:
+        a, b = rand.sample(groups, 2)
+        aa = members[a]
+        bb = members[b]
+        an = rand.choice(aa)
+        bn = rand.choice(bb)
+        if bn < an:
+            an, bn = bn, an
+        links.add((an, bn))
+        aa.extend(bb)
+        members[b] = None
+        groups.remove(b)
+
+    nodes = list(range(n))
+
+    while l:
+        an, bn = rand.sample(nodes, 2)
+        if bn < an:
+            an, bn = bn, an
+        if (an, bn) in links:
+            continue
+        l -= 1
+        links.add((an, bn))
+
+    topo = Topology()
+    switches = _add_switches(topo, n)
+    for u, v in sorted(links):
+        topo.link(switches[u], switches[v])
+    _add_hosts(topo, switches, h, multiple_hosts, rand)
+    return topo
+
+
+def barabasi_albert(n, m=2, hosts=0, multiple_hosts=True, rand=random):
+    """
+    A Barabasi-Albert preferential attachment topology.
+
+    Starts with m switches linked in a line, and then each additional switch
+    links to m different existing ones.
+
+    """
+    n = int(n)
+    m = int(m)
+    assert 1 <= m < n
+    topo = Topology()
+    switches = _add_switches(topo, n)
+    # Each switch appears here once per link it has, so picking from it
+    # picks switches in proportion to their degree.
+    ends = []
+    for i in range(1, m):
+        topo.link(switches[i - 1], switches[i])
+        ends.extend((i - 1, i))
+    if not ends:
+        ends.append(0)
+    for i in range(m, n):
+        targets = set()
+        while len(targets) < m:
+            targets.add(rand.choice(ends))
+        for t in sorted(targets):
+            topo.link(switches[t], switches[i])
+            ends.extend((t, i))
+    _add_hosts(topo, switches, int(hosts), multiple_hosts, rand)
+    return topo
+
+
+def waxman(n, alpha=0.4, beta=0.1, connected=True, hosts=0,
+           multiple_hosts=True, rand=random):
+    """
+    A Waxman random topology on the unit square.
+
+    Rather than trying every pair of switches, the square is divided into
+    cells, and pairs of switches in each pair of cells are skipped through
+    geometrically using the highest probability any pair in those cells
+    could have.  So the time taken is roughly proportional to the number of
+    switches plus the number of links.
+
+    If connected, separate components are joined with extra links.
+
+    """
+    n = int(n)
+    alpha = float(alpha)
+    beta = float(beta)
+    max_dist = math.sqrt(2)
+    scale = alpha * max_dist
+
+    xs = [rand.random() for _ in range(n)]
+    ys = [rand.random() for _ in range(n)]
+
+    # Cells per side.  Smaller cells make for tighter bounds (which matters
+    # when alpha is small), but there are g^4 pairs of them.
+    g = max(1, int(min(max(n ** 0.25, 2 / alpha), n ** (1 / 3.0))))
+    cells = [[] for _ in range(g * g)]
+    for i in range(n):
+        cx = min(g - 1, int(xs[i] * g))
+        cy = min(g - 1, int(ys[i] * g))
+        cells[cy * g + cx].append(i)
+
+    edges = []
+    log = math.log
+
+    def skip_through(count, p_max, pair):
+        # Visits each of count pairs with probability p_max (by skipping
+        # ahead geometrically), then keeps it with probability p / p_max.
+        log_q = math.log1p(-p_max) if p_max < 1 else None
+        if log_q == 0:
+            return
+        k = -1
+        while True:
+            if log_q is None:
+                k += 1
+            else:
+                k += 1 + int(log(1.0 - rand.random()) / log_q)
+            if k >= count:
+                return
+            i, j = pair(k)
+            d = math.hypot(xs[i] - xs[j], ys[i] - ys[j])
+            if rand.random() * p_max < beta * math.exp(-d / scale):
+                edges.append((i, j) if i < j else (j, i))
+
+    for c1 in range(g * g):
+        m1 = cells[c1]
+        if not m1:
+            continue
+        x1, y1 = c1 % g, c1 // g
+        for c2 in range(c1, g * g):
+            m2 = cells[c2]
+            if not m2:
+                continue
+            x2, y2 = c2 % g, c2 // g
+            # Smallest possible distance between points in the two cells
+            dx = max(0, abs(x1 - x2) - 1) / float(g)
+            dy = max(0, abs(y1 - y2) - 1) / float(g)
+            p_max = beta * math.exp(-math.hypot(dx, dy) / scale)
+            if c1 != c2:
+                skip_through(len(m1) * len(m2), p_max,
+                             lambda k: (m1[k // len(m2)], m2[k % len(m2)]))
+            else:
+                for r in range(len(m1) - 1):
+                    rest = len(m1) - r - 1
+                    skip_through(rest, p_max,
+                                 lambda k: (m1[r], m1[r + 1 + k]))
+
+    edges.sort()
+
+    if connected and n > 1:
+        # Find the components, and link each to the one before it
+        parent = list(range(n))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for i, j in edges:
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[ri] = rj
+        components = {}
+        for i in range(n):
+            components.setdefault(find(i), []).append(i)
+        components = sorted(components.values())
+        for prev, comp in zip(components, components[1:]):
+            a = rand.choice(prev)
+            b = rand.choice(comp)
+            edges.append((a, b) if a < b else (b, a))
+
+    topo = Topology()
+    switches = _add_switches(topo, n)
+    for i, j in edges:
+        topo.link(switches[i], switches[j])
+    _add_hosts(topo, switches, int(hosts), multiple_hosts, rand)
+    return topo
+
+
+def fat_tree(k=4):
+    """
+    A k-ary fat tree.
+
+    There are k pods, each with k/2 edge switches (e<pod>_<i>) and k/2
+    aggregation switches (a<pod>_<i>), (k/2)^2 core switches (c<i>), and
+    k/2 hosts (h<pod>_<edge>_<i>) on each edge switch.
+
+    """
+    k = int(k)
+    assert k >= 2 and k % 2 == 0, "k must be even"
+    half = k // 2
+    topo = Topology()
+    core_switches = [topo.add_switch('c' + str(i + 1))
+                     for i in range(half * half)]
+    for pod in range(1, k + 1):
+        aggs = [topo.add_switch('a%i_%i' % (pod, i + 1))
+                for i in range(half)]
+        edges = [topo.add_switch('e%i_%i' % (pod, i + 1))
+                 for i in range(half)]
+        for i, agg in enumerate(aggs):
+            # Aggregation switch i goes to core switches i*k/2 .. i*k/2+k/2-1
+            for j in range(half):
+                topo.link(core_switches[i * half + j], agg)
+            for edge in edges:
+                topo.link(agg, edge)
+        for i, edge in enumerate(edges):
+            for j in range(half):
+                host = topo.add_host('h%i_%i_%i' % (pod, i + 1, j + 1))
+                topo.link(edge, host)
+    return topo
+
+
+def mesh(width, height=None, torus=False, hosts=0, multiple_hosts=True,
+         rand=random):
+    """
+    A width by height grid of switches (s<x>_<y>).
+
+    If torus, the edges wrap around.
+
+    """
+    width = int(width)
+    height = width if height is None else int(height)
+    topo = Topology()
+    switches = [topo.add_switch('s%i_%i' % (x + 1, y + 1))
+                for y in range(height) for x in range(width)]
+
+    def at(x, y):
+        return switches[y * width + x]
+
+    for y in range(height):
+        for x in range(width):
+            if x + 1 < width:
+                topo.link(at(x, y), at(x + 1, y))
+            elif torus and width > 2:
+                topo.link(at(x, y), at(0, y))
+            if y + 1 < height:
+                topo.link(at(x, y), at(x, y + 1))
+            elif torus and height > 2:
+                topo.link(at(x, y), at(x, 0))
+    _add_hosts(topo, switches, int(hosts), multiple_hosts, rand)
+    return topo
+
+
+def launch(kind="tree",
+           switch_type=sim.config.default_switch_type,
+           host_type=sim.config.default_host_type,
+           switches=6,
+           hosts=4,
+           links=None,
+           multiple_hosts=True,
+           m=2,
+           alpha=0.4,
+           beta=0.1,
+           k=4,
+           width=None,
+           height=None,
+           torus=False,
+           latency=None,
+           seed=None):
+    rand = make_random(seed)
+
+    if kind == "tree":
+        topo = random_tree(switches, links, hosts, multiple_hosts, rand)
+    elif kind == "ba":
+        topo = barabasi_albert(switches, m, hosts, multiple_hosts, rand)
+    elif kind == "waxman":
+        topo = waxman(switches, alpha, beta, True, hosts, multiple_hosts,
+                      rand)
+    elif kind == "fattree":
+        topo = fat_tree(k)
+    elif kind == "mesh":
+        if width is None:
+            width = int(math.ceil(math.sqrt(int(switches))))
+        topo = mesh(width, height, torus, hosts, multiple_hosts, rand)
+    else:
+        raise RuntimeError("No such kind of topology as '%s'" % (kind, ))
+
+    topo.build(switch_type, host_type, parse_latency(latency), rand)
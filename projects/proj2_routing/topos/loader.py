@@ -1,10 +1,434 @@
+"""
+Loads topologies from files.
+
+Three formats are understood:
+
+  topo      Our own format (see launch()).
+  edgelist  One link per line: two node names and optionally a latency.
+            Every node is a switch.  Lines starting with # or % are
+            comments, and links from a node to itself are skipped.
+  graphml   GraphML.  Edges get their latency from a "latency" attribute
+            if there is one, and nodes with a "kind" (or "type") attribute
+            of "host" are hosts.  The rest are switches.
+
+By default, the format is picked by the file's extension (.graphml or .xml
+for GraphML; .edges, .edgelist or .el for edge lists; otherwise topo).
+Any of them may be gzipped.
+
+Files are read a line (or an XML element) at a time, so big ones don't need
+to fit in memory as text.  Once a file has been parsed, what it contained is
+written to a compiled snapshot next to it (the same name with .snapshot on
+the end).  Later loads of an unchanged file just read the snapshot's
+arrays straight in instead of parsing the file again.  The snapshot has
+the file's size and modification time in it, and a hash of its content;
+the file only gets hashed again if its size or modification time has
+changed.  If the snapshot can't be written (e.g., the directory is
+read-only), it's just skipped.
+
+"""
+
+import array
+import gzip
+import hashlib
+import io
+import os
+import struct
+import sys
+
 import sim
+import sim.core as core
+
+# Bumped whenever the snapshot layout or what's in it changes
+SNAPSHOT_VERSION = 2
+
+_MAGIC = b"SIMTOPO\0"
+# Magic, version, content hash, file size, file modification time, file
+# format, node count, link count, names length
+_snapshot_header = struct.Struct("<8sI20sQd8sIII")
+
+_NO_LATENCY = float("nan")
+
+
+class LoadedTopology(object):
+    """
+    What's in a topology file.
+
+    Nodes are referred to by index.  ends holds the two nodes of each link
+    one after the other, and latencies has a latency for each link (NaN if
+    it didn't have one).  They're arrays rather than lists of tuples, since
+    there may be millions of them.
+
+    """
+
+    def __init__(self):
+        self.names = []
+        self.hosts = bytearray()  # 1 for a host, 0 for a switch
+        self.ends = array.array('i')
+        self.latencies = array.array('d')
+        self._index = {}  # Name -> index
+        self._pending = []  # (link index, name, name) for undeclared nodes
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def link_count(self):
+        return len(self.latencies)
+
+    def add_node(self, name, host=False):
+        self._index[name] = len(self.names)
+        self.names.append(name)
+        self.hosts.append(1 if host else 0)
+
+    def add_link(self, u, v, latency=None):
+        """Adds a link between the nodes named u and v."""
+        index = self._index
+        a = index.get(u)
+        b = index.get(v)
+        if a is None or b is None:
+            # Not declared (yet); sort it out in finish()
+            self._pending.append((len(self.latencies), u, v))
+            a = b = -1
+        self.ends.append(a)
+        self.ends.append(b)
+        self.latencies.append(_NO_LATENCY if latency is None else latency)
+
+    def finish(self):
+        """Resolves links to nodes which were declared after the link."""
+        index = self._index
+        ends = self.ends
+        for k, u, v in self._pending:
+            if u not in index or v not in index:
+                raise RuntimeError("Link from %s to %s has an undeclared node"
+                                   % (u, v))
+            ends[2 * k] = index[u]
+            ends[2 * k + 1] = index[v]
+        self._pending = []
+
+    def build(self, switch_type=None, host_type=None):
+        """Creates the topology in the simulator.  Returns the Entities."""
+        if switch_type is None:
+            switch_type = sim.config.default_switch_type
+        if host_type is None:
+            host_type = sim.config.default_host_type
+        kinds = (switch_type, host_type)
+        nodes = [(name, kinds[h]) for name, h in zip(self.names, self.hosts)]
+        ends = self.ends
+        edges = list(zip(ends[0::2], ends[1::2]))
+        latencies = [None if l != l else l for l in self.latencies]
+        return core.build_topology(nodes, edges, latencies)
+
+
+def _open_binary(filename):
+    """Opens a file for reading bytes, uncompressing it if it's gzipped."""
+    f = open(filename, 'rb')
+    magic = f.read(2)
+    f.seek(0)
+    if magic == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    return f
+
+
+def _open_text(filename):
+    f = _open_binary(filename)
+    if sys.version_info[0] < 3:
+        return f
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def _guess_format(filename):
+    name = filename.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    ext = os.path.splitext(name)[1]
+    if ext in (".graphml", ".xml"):
+        return "graphml"
+    if ext in (".edges", ".edgelist", ".el"):
+        return "edgelist"
+    return "topo"
+
+
+def parse_topo(lines):
+    """Parses our own format from an iterable of lines."""
+    t = LoadedTopology()
+    add_link = t.add_link
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            continue
+        line = line.split(None, 1)
+        assert len(line) >= 2
+        kind, rest = line
+
+        kind = kind.lower()
+
+        if kind == "h":
+            t.add_node(rest, True)
+        elif kind == "s":
+            t.add_node(rest, False)
+        elif kind == "l":
+            rest = rest.split()
+            assert len(rest) >= 2
+            latency = None
+            if len(rest) == 3:
+                # Latency
+                latency = float(rest[2])
+            add_link(rest[0], rest[1], latency)
+    t.finish()
+    return t
+
+
+def parse_edgelist(lines):
+    """Parses an edge list from an iterable of lines."""
+    t = LoadedTopology()
+    index = t._index
+    add_node = t.add_node
+    add_link = t.add_link
+    for line in lines:
+        rest = line.split()
+        if len(rest) < 2 or rest[0][0] in "#%":
+            continue
+        u, v = rest[0], rest[1]
+        if u == v:
+            continue
+        latency = None
+        if len(rest) >= 3:
+            try:
+                latency = float(rest[2])
+            except ValueError:
+                pass  # Something other than a latency
+        if u not in index:
+            add_node(u)
+        if v not in index:
+            add_node(v)
+        add_link(u, v, latency)
+    t.finish()
+    return t
+
+
+def parse_graphml(f):
+    """Parses GraphML from a binary file object."""
+    import xml.etree.ElementTree as ET
+
+    def tag(elem):
+        return elem.tag.rsplit("}", 1)[-1]
+
+    t = LoadedTopology()
+    latency_key = None
+    latency_default = None
+    kind_key = None
+    kind_default = None
+    graph = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        name = tag(elem)
+        if event == "start":
+            if name == "graph" and graph is None:
+                graph = elem
+            continue
+        if name == "key":
+            attr = elem.get("attr.name")
+            default = None
+            for child in elem:
+                if tag(child) == "default":
+                    default = child.text
+            if attr == "latency" and elem.get("for") in ("edge", "all"):
+                latency_key = elem.get("id")
+                if default is not None:
+                    latency_default = float(default)
+            elif attr in ("kind", "type") and elem.get("for") in ("node",
+                                                                   "all"):
+                kind_key = elem.get("id")
+                kind_default = default
+        elif name == "node":
+            kind = kind_default
+            for child in elem:
+                if tag(child) == "data" and child.get("key") == kind_key:
+                    kind = child.text
+            t.add_node(elem.get("id"), (kind or "").strip() == "host")
+        elif name == "edge":
+            latency = latency_default
+            for child in elem:
+                if tag(child) == "data" and child.get("key") == latency_key:
+                    latency = float(child.text)
+            u = elem.get("source")
+            v = elem.get("target")
+            if u != v:
+                t.add_link(u, v, latency)
+        else:
+            continue
+        # Done with it; don't keep the whole document around
+        elem.clear()
+        if graph is not None:
+            # (Cleared elements are still children of the graph)
+            del graph[:]
+    t.finish()
+    return t
+
+
+def _stamp(filename, fmt):
+    """
+    Returns a file's (size, modification time, format).
+
+    If a file's stamp is the same as when its snapshot was made, it's taken
+    to be unchanged without hashing it.
+
+    """
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime, fmt.encode('ascii')
+
+
+def _content_hash(filename, fmt):
+    h = hashlib.sha1()
+    h.update(("%i %s\n" % (SNAPSHOT_VERSION, fmt)).encode())
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+    return h.digest()
+
+
+def _little_endian(a):
+    if sys.byteorder != 'little':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a
+
+
+def _array_read(f, typecode, n):
+    """Reads an array of n items from a file."""
+    a = array.array(typecode)
+    if n:
+        a.fromfile(f, n)
+    return _little_endian(a)
+
+
+def _array_bytes(a):
+    a = _little_endian(a)
+    return a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+
+
+def write_snapshot(filename, t, digest, stamp):
+    """
+    Writes t to a snapshot file (atomically).
+
+    digest and stamp (see _stamp()) are for the file t came from.
+
+    """
+    names = b"\0".join(n if isinstance(n, bytes) else n.encode('utf-8')
+                       for n in t.names)
+    tmp = "%s.%i.tmp" % (filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_snapshot_header.pack(_MAGIC, SNAPSHOT_VERSION, digest,
+                                      stamp[0], stamp[1], stamp[2],
+                                      len(t.names), t.link_count,
+                                      len(names)))
+        f.write(bytes(t.hosts))
+        f.write(names)
+        f.write(_array_bytes(t.ends))
+        f.write(_array_bytes(t.latencies))
+    os.rename(tmp, filename)
+
+
+def read_snapshot(filename, digest=None, stamp=None):
+    """
+    Reads a snapshot if it's there and up to date, else None.
+
+    It's up to date if it was made from a file with the given digest, or
+    the given stamp (see _stamp()).
+
+    """
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        header = f.read(_snapshot_header.size)
+        if len(header) < _snapshot_header.size:
+            return None
+        (magic, version, snap_digest, src_size, src_mtime, src_fmt, nodes,
+         links, names_len) = _snapshot_header.unpack(header)
+        if magic != _MAGIC or version != SNAPSHOT_VERSION:
+            return None
+        if (snap_digest != digest and
+                (src_size, src_mtime, src_fmt.rstrip(b"\0")) != stamp):
+            return None
+        ends_len = 2 * links * array.array('i').itemsize
+        lat_len = links * array.array('d').itemsize
+        if size != len(header) + nodes + names_len + ends_len + lat_len:
+            return None
+        t = LoadedTopology()
+        t.hosts = bytearray(f.read(nodes))
+        names = f.read(names_len)
+        if sys.version_info[0] >= 3:
+            names = names.decode('utf-8')
+            sep = "\0"
+        else:
+            sep = b"\0"
+        t.names = names.split(sep) if nodes else []
+        t.ends = _array_read(f, 'i', 2 * links)
+        t.latencies = _array_read(f, 'd', links)
+        return t
+
+
+def load(filename, format=None, cache=True):
+    """
+    Loads a topology file (see the module docs), returning a
+    LoadedTopology.
+
+    If cache, uses (or makes) a snapshot of it.
+
+    """
+    fmt = format or _guess_format(filename)
+    if fmt not in ("topo", "edgelist", "graphml"):
+        raise RuntimeError("No such topology format as '%s'" % (fmt, ))
+
+    snapshot = filename + ".snapshot"
+    digest = None
+    if cache:
+        stamp = _stamp(filename, fmt)
+        t = read_snapshot(snapshot, stamp=stamp)
+        if t is not None:
+            return t
+        # The file has at least been touched, so see if its content changed
+        digest = _content_hash(filename, fmt)
+        t = read_snapshot(snapshot, digest=digest)
+        if t is not None:
+            _try_write_snapshot(snapshot, t, digest, stamp)  # New stamp
+            return t
+
+    f = _open_binary(filename) if fmt == "graphml" else _open_text(filename)
+    with f:
+        if fmt == "graphml":
+            t = parse_graphml(f)
+        elif fmt == "edgelist":
+            t = parse_edgelist(f)
+        else:
+            t = parse_topo(f)
+
+    if cache:
+        _try_write_snapshot(snapshot, t, digest, stamp)
+    return t
+
+
+def _try_write_snapshot(filename, t, digest, stamp):
+    try:
+        write_snapshot(filename, t, digest, stamp)
+    except (IOError, OSError) as e:
+        core.simlog.debug("Couldn't write topology snapshot %s: %s",
+                          filename, e)
 
 
 def launch(filename="",
            switch_type=sim.config.default_switch_type,
            host_type=sim.config.default_host_type,
-           topo=None):
+           topo=None,
+           format=None,
+           cache=True):
     """
     Loads a topology from a file.
 
@@ -29,50 +453,16 @@ def launch(filename="",
       l Comcast YouTubeNet 0.5
       l YouTubeNet CatVideoServer 0.1
 
+    Other formats can be loaded too (see the module docs).  Use --no-cache
+    to not read or write a snapshot.
+
     """
     assert filename or topo
     assert not (filename and topo)
 
     if filename:
-        reader = open(filename, 'r')
+        t = load(filename, format, cache)
     else:
-        reader = topo.split("\n")
+        t = parse_topo(topo.split("\n"))
 
-    edges = []
-    hosts = {}
-    switches = {}
-
-    def get_node(n):
-        r = hosts.get(n)
-        if r:
-            return r
-        return switches.get(n)
-
-    for line in reader:
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith("#"):
-            continue
-        line = line.split(None, 1)
-        assert len(line) >= 2
-        t, rest = line
-
-        t = t.lower()
-
-        if t == "h":
-            hosts[rest] = host_type.create(rest)
-        elif t == "s":
-            switches[rest] = switch_type.create(rest)
-        elif t == "l":
-            edges.append(rest)
-
-    for rest in edges:
-        rest = rest.split()
-        assert len(rest) >= 2
-        extra = {}
-        if len(rest) == 3:
-            # Latency
-            extra['latency'] = float(rest[2])
-        u, v = rest[:2]
-        get_node(u).linkTo(get_node(v), **extra)
+    t.build(switch_type, host_type)
@@ -0,0 +1,8 @@
+"""
+Unit tests for the simulator itself (the sim package).
+
+These don't need a router.  Run them with:
+
+  python -m unittest discover unit_tests
+
+"""
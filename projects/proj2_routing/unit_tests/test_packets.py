@@ -0,0 +1,48 @@
+"""
+Tests making packets (see sim.api.Packet).
+"""
+
+import unittest
+
+import sim.api as api
+import sim.basics as basics
+import sim.core as core
+
+
+class TestPacketsWithoutWorld(unittest.TestCase):
+    """Packets can be made before (or without) any World."""
+
+    def setUp(self):
+        self._worlds = (core._context.world, core._last_world)
+        core._context.world = None
+        core._last_world = None
+
+    def tearDown(self):
+        core._context.world, core._last_world = self._worlds
+
+    def test_packet(self):
+        p = api.Packet(dst=None)
+        self.assertEqual(p.ttl, api.Packet.DEFAULT_TTL)
+        self.assertEqual(p.trace, [])
+        p.trace.append("s1")
+        self.assertEqual(p.trace, ["s1"])
+        self.assertEqual(len(p.outer_color), 4)
+
+    def test_basics(self):
+        ping = basics.Ping(None)
+        self.assertEqual(ping.trace, [])
+        self.assertEqual(ping.outer_color[3], 0.8)
+        route = basics.RoutePacket("h1", 5)
+        self.assertEqual(route.trace, [])
+        self.assertEqual(route.outer_color, [1, 0, 1, 1])
+
+    def test_copy(self):
+        ping = basics.Ping(None)
+        copy = core._duplicate_packet(ping)
+        self.assertEqual(copy.outer_color, ping.outer_color)
+        copy.trace.append("s1")
+        self.assertEqual(ping.trace, [])
+
+
+if __name__ == '__main__':
+    unittest.main()